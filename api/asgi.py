@@ -3,6 +3,8 @@ from django.core.asgi import get_asgi_application
 
 # Ensure settings module is set for Vercel environment
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'walk.settings')
+# Under ASGI, route the hot views to their async versions (main_app.async_views).
+os.environ.setdefault('ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
 
@@ -0,0 +1,398 @@
+"""Vectorized trade analytics that populate AnalyticsSnapshot documents.
+
+A tenant's closed trades are loaded once into NumPy column arrays ordered by
+close time. Every metric is then computed for every (period, cohort) group
+with grouped reductions (``bincount``/``reduceat``) instead of Python loops.
+"""
+
+from datetime import datetime, timezone
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from .db import get_repository
+from .models import AnalyticsMetrics, AnalyticsSnapshotRepository, TradeRepository
+from .user_model import tenant_for
+from .versions import bump_data_version
+
+GRANULARITIES = ('daily', 'weekly', 'monthly')
+COHORTS = ('byStrategy', 'byRegime', 'byTimeOfDay')
+METRIC_FIELDS = tuple(AnalyticsMetrics.model_fields)
+
+# Running sufficient statistics kept next to each metrics block so a single
+# trade event can update a snapshot in O(1) (see incremental_analytics.py).
+STAT_FIELDS = {
+    'n': 'count',
+    'sum': 'sum',
+    'sumSq': 'sumSq',
+    'wins': 'wins',
+    'losses': 'losses',
+    'grossWin': 'grossWin',
+    'grossLoss': 'grossLoss',
+    'equity': 'sum',
+    'peak': 'peak',
+    'maxDrawdown': 'drawdown',
+    'lastTs': 'lastTs',
+}
+
+EPOCH = datetime(1970, 1, 1)
+
+# Risk of ruin is quoted for an account that can absorb this many average losses.
+RUIN_UNITS = 20
+
+TRADE_COLUMNS_PROJECTION = {
+    'openTs': 1,
+    'closeTs': 1,
+    'audit.createdAt': 1,
+    'realizedPnL': 1,
+    'strategyTag': 1,
+    'regimeTagIds': 1,
+    'mae': 1,
+    'mfe': 1,
+}
+
+
+def epoch_seconds(value: Optional[datetime]) -> float:
+    # pymongo returns naive datetimes that are UTC; Pydantic-built documents may be aware.
+    if value is None:
+        return np.nan
+    if value.tzinfo is None:
+        return (value - EPOCH).total_seconds()
+    return value.timestamp()
+
+
+def _datetime64(seconds: List[float]) -> np.ndarray:
+    # Much faster than letting NumPy convert datetime objects one by one.
+    values = np.asarray(seconds, dtype=np.float64)
+    result = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[ms]')
+    present = ~np.isnan(values)
+    result[present] = np.round(values[present] * 1000).astype(np.int64).astype('datetime64[ms]')
+    return result
+
+
+def explode(values: Sequence[Sequence], order: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """Flatten per-trade tag lists into parallel (trade index, tag code) arrays plus labels.
+
+    With ``order`` (a permutation of trade indices) rows are renumbered to
+    match the reordered trades and returned in that order.
+    """
+    lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+    rows = np.repeat(np.arange(len(values), dtype=np.int64), lengths)
+    flat = np.asarray([str(tag) for tag in chain.from_iterable(values)], dtype=str)
+    labels, codes = np.unique(flat, return_inverse=True)
+    if order is not None and len(rows):
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        rows = rank[rows]
+        resort = np.argsort(rows, kind='stable')
+        rows, codes = rows[resort], codes[resort]
+    return rows, codes.astype(np.int64), labels.tolist()
+
+
+class TradeColumns:
+    """Closed trades of one tenant as parallel arrays, in chronological order."""
+
+    def __init__(self, close_ts, open_ts, pnl, strategy_tags, regime_ids, mae=None, mfe=None):
+        order = np.argsort(close_ts, kind='stable')
+        self.close_ts = close_ts[order]
+        self.open_ts = open_ts[order]
+        self.pnl = pnl[order]
+        # Per-trade excursions (main_app.excursions); NaN where no bars were available.
+        self.mae = np.full(len(pnl), np.nan) if mae is None else mae[order]
+        self.mfe = np.full(len(pnl), np.nan) if mfe is None else mfe[order]
+        self.cohorts = {
+            'byStrategy': explode(strategy_tags, order),
+            'byRegime': explode(regime_ids, order),
+            'byTimeOfDay': self._time_of_day(),
+        }
+
+    def __len__(self):
+        return len(self.pnl)
+
+    def _time_of_day(self):
+        entry = np.where(np.isnat(self.open_ts), self.close_ts, self.open_ts)
+        hours = ((entry - entry.astype('datetime64[D]')) // np.timedelta64(1, 'h')).astype(np.int64)
+        present = np.unique(hours)
+        codes = np.searchsorted(present, hours)
+        return np.arange(len(hours), dtype=np.int64), codes, [f'{hour:02d}:00' for hour in present]
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[dict]) -> 'TradeColumns':
+        close_ts, open_ts, pnl, strategy_tags, regime_ids, mae, mfe = [], [], [], [], [], [], []
+        for document in documents:
+            if document.get('realizedPnL') is None:
+                continue
+            opened = document.get('openTs')
+            close_ts.append(epoch_seconds(document.get('closeTs') or opened or document['audit']['createdAt']))
+            open_ts.append(epoch_seconds(opened))
+            pnl.append(document['realizedPnL'])
+            strategy_tags.append(document.get('strategyTag') or [])
+            regime_ids.append(document.get('regimeTagIds') or [])
+            mae.append(document.get('mae'))
+            mfe.append(document.get('mfe'))
+        return cls(
+            _datetime64(close_ts),
+            _datetime64(open_ts),
+            np.asarray(pnl, dtype=np.float64),
+            strategy_tags,
+            regime_ids,
+            np.asarray(mae, dtype=np.float64),
+            np.asarray(mfe, dtype=np.float64),
+        )
+
+
+def load_trade_columns(user_id) -> TradeColumns:
+    collection = get_repository(TradeRepository).get_collection()
+    cursor = collection.find(
+        {'tenant.userId': ObjectId(user_id), 'status': 'CLOSED', 'realizedPnL': {'$ne': None}},
+        TRADE_COLUMNS_PROJECTION,
+        batch_size=10000,
+    )
+    return TradeColumns.from_documents(cursor)
+
+
+def _group_mean(codes: np.ndarray, n_groups: int, values: np.ndarray) -> np.ndarray:
+    present = ~np.isnan(values)
+    count = np.bincount(codes[present], minlength=n_groups)
+    total = np.bincount(codes[present], weights=values[present], minlength=n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def group_metrics(codes: np.ndarray, n_groups: int, pnl: np.ndarray,
+                  timestamps: Optional[np.ndarray] = None,
+                  ruin_units: int = RUIN_UNITS, mae: Optional[np.ndarray] = None,
+                  mfe: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """Compute AnalyticsMetrics and their sufficient statistics for each group in one pass.
+
+    ``codes[i]`` is the group of ``pnl[i]``; rows must already be in
+    chronological order so drawdown follows each group's equity curve.
+    ``mae``/``mfe`` are averaged over the trades that have them.
+    """
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    pnl = pnl[order]
+
+    count = np.bincount(codes, minlength=n_groups).astype(np.float64)
+    total = np.bincount(codes, weights=pnl, minlength=n_groups)
+    squares = np.bincount(codes, weights=pnl * pnl, minlength=n_groups)
+    wins = np.bincount(codes, weights=pnl > 0, minlength=n_groups)
+    losses = np.bincount(codes, weights=pnl < 0, minlength=n_groups)
+    gross_win = np.bincount(codes, weights=np.where(pnl > 0, pnl, 0.0), minlength=n_groups)
+    gross_loss = np.bincount(codes, weights=np.where(pnl < 0, -pnl, 0.0), minlength=n_groups)
+
+    drawdown = np.full(n_groups, np.nan)
+    final_peak = np.full(n_groups, np.nan)
+    last_ts = np.full(n_groups, np.datetime64('NaT'), dtype='datetime64[ms]')
+    if len(pnl):
+        # Per-group equity curves laid end to end; lifting each group above the
+        # previous one lets a single maximum.accumulate act as a segmented running max.
+        starts = np.concatenate(([0], np.cumsum(count[:-1]))).astype(np.int64)
+        cumulative = np.cumsum(pnl)
+        offsets = np.where(starts > 0, cumulative[np.maximum(starts - 1, 0)], 0.0)
+        equity = cumulative - offsets[codes]
+        lift = equity.max() - min(equity.min(), 0.0) + 1.0
+        lifted = equity + codes * lift
+        peak = np.maximum(np.maximum.accumulate(lifted) - codes * lift, 0.0)
+        nonempty = count > 0
+        drawdown[nonempty] = np.maximum.reduceat(peak - equity, starts[nonempty])
+        final_peak[nonempty] = np.maximum.reduceat(peak, starts[nonempty])
+        if timestamps is not None:
+            last_ts[nonempty] = timestamps[order][starts[nonempty] + count[nonempty].astype(np.int64) - 1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expectancy = total / count
+        std = np.sqrt(np.maximum(squares / count - expectancy ** 2, 0.0))
+        sharpe = np.where(std > 0, expectancy / std, np.nan)
+        win_rate = wins / count
+        payoff = (gross_win / wins) / (gross_loss / losses)
+        edge = np.clip(win_rate * payoff - (1 - win_rate), 0.0, 1.0)
+        ruin = ((1 - edge) / (1 + edge)) ** ruin_units
+        ruin = np.where(losses == 0, 0.0, np.where(wins == 0, 1.0, ruin))
+        ruin = np.where(count > 0, ruin, np.nan)
+
+    excursions = {
+        name: _group_mean(codes, n_groups, values[order])
+        for name, values in (('mae', mae), ('mfe', mfe)) if values is not None
+    }
+    return {
+        **excursions,
+        'count': count,
+        'sum': total,
+        'sumSq': squares,
+        'wins': wins,
+        'losses': losses,
+        'grossWin': gross_win,
+        'grossLoss': gross_loss,
+        'peak': final_peak,
+        'lastTs': last_ts,
+        'winRate': win_rate,
+        'expectancy': expectancy,
+        'drawdown': drawdown,
+        'riskOfRuin': ruin,
+        'sharpeLike': sharpe,
+    }
+
+
+def metric_rows(metrics: Dict[str, np.ndarray], n_groups: int, fields=None) -> List[dict]:
+    """Per-group dicts of ``fields`` (output name -> key in ``metrics``).
+
+    Defaults to the AnalyticsMetrics fields; NaN, NaT and missing metrics become None.
+    """
+    fields = fields or {field: field for field in METRIC_FIELDS}
+    columns = []
+    for source in fields.values():
+        values = metrics.get(source)
+        if values is None:
+            columns.append([None] * n_groups)
+        else:
+            columns.append([None if value is None or value != value else value for value in values.tolist()])
+    return [dict(zip(fields, row)) for row in zip(*columns)]
+
+
+def cohort_key(label: str) -> str:
+    # Cohort labels become field names inside the snapshot document.
+    return label.replace('.', '_').replace('$', '_')
+
+
+def period_starts(close_ts: np.ndarray, granularity: str) -> np.ndarray:
+    days = close_ts.astype('datetime64[D]')
+    if granularity == 'daily':
+        return days
+    if granularity == 'weekly':
+        # 1970-01-01 was a Thursday; shift so weeks start on Monday.
+        return days - ((days.astype(np.int64) + 3) % 7).astype('timedelta64[D]')
+    if granularity == 'monthly':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def period_end(start: np.datetime64, granularity: str) -> np.datetime64:
+    if granularity == 'daily':
+        return start
+    if granularity == 'weekly':
+        return start + np.timedelta64(6, 'D')
+    return (start.astype('datetime64[M]') + 1).astype('datetime64[D]') - np.timedelta64(1, 'D')
+
+
+def add_screen_time(snapshots: List[dict], periods: np.ndarray, granularity: str,
+                    screen_time: Tuple[np.ndarray, np.ndarray]):
+    """Set ``screenMinutes`` on each period and its ``byTimeOfDay`` hours from hourly screen seconds.
+
+    ``screen_time`` is (hour starts as datetime64[h], seconds), as made by
+    ``time_tracking.hourly_screen_time``; hours outside ``periods`` are ignored.
+    """
+    hours, seconds = screen_time
+    if not len(hours) or not len(periods):
+        return
+    starts = period_starts(hours, granularity)
+    index = np.searchsorted(periods, starts)
+    inside = index < len(periods)
+    inside[inside] = periods[index[inside]] == starts[inside]
+    index, hour_of_day, minutes = index[inside], hours[inside].astype(np.int64) % 24, seconds[inside] / 60
+    totals = np.bincount(index, weights=minutes, minlength=len(periods))
+    for period in np.unique(index).tolist():
+        snapshots[period]['metrics']['screenMinutes'] = totals[period]
+    groups, codes = np.unique(index * 24 + hour_of_day, return_inverse=True)
+    for group, value in zip(groups.tolist(), np.bincount(codes, weights=minutes).tolist()):
+        period, hour = divmod(group, 24)
+        cohort = snapshots[period]['cohorts']['byTimeOfDay']
+        cohort.setdefault(f'{hour:02d}:00', dict.fromkeys(METRIC_FIELDS))['screenMinutes'] = value
+
+
+def compute_snapshots(columns: TradeColumns, granularity: str,
+                      screen_time: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> List[dict]:
+    """Metrics and cohort breakdowns for every period of ``granularity`` that has trades.
+
+    With ``screen_time`` (see ``add_screen_time``) the periods also get the
+    session screen time, in total and per hour of day.
+    """
+    if not len(columns):
+        return []
+    periods, period_codes = np.unique(period_starts(columns.close_ts, granularity), return_inverse=True)
+    n_periods = len(periods)
+    overall = group_metrics(period_codes, n_periods, columns.pnl, columns.close_ts,
+                            mae=columns.mae, mfe=columns.mfe)
+    overall_stats = metric_rows(overall, n_periods, STAT_FIELDS)
+
+    snapshots = [
+        {
+            'granularity': granularity,
+            'periodStart': periods[index].item(),
+            'periodEnd': period_end(periods[index], granularity).item(),
+            'metrics': metrics,
+            'cohorts': {cohort: {} for cohort in COHORTS},
+            'stats': overall_stats[index],
+            'cohortStats': {cohort: {} for cohort in COHORTS},
+            'stale': False,
+        }
+        for index, metrics in enumerate(metric_rows(overall, n_periods))
+    ]
+
+    for cohort, (rows, codes, labels) in columns.cohorts.items():
+        if not len(rows):
+            continue
+        combined = period_codes[rows] * len(labels) + codes
+        groups, group_codes = np.unique(combined, return_inverse=True)
+        grouped = group_metrics(group_codes, len(groups), columns.pnl[rows], columns.close_ts[rows],
+                                mae=columns.mae[rows], mfe=columns.mfe[rows])
+        metrics = metric_rows(grouped, len(groups))
+        stats = metric_rows(grouped, len(groups), STAT_FIELDS)
+        for group, row, stat in zip(groups.tolist(), metrics, stats):
+            period, label = divmod(group, len(labels))
+            key = cohort_key(labels[label])
+            snapshots[period]['cohorts'][cohort][key] = row
+            snapshots[period]['cohortStats'][cohort][key] = stat
+    if screen_time is not None:
+        add_screen_time(snapshots, periods, granularity, screen_time)
+    return snapshots
+
+
+def snapshot_upsert(tenant: dict, snapshot: dict, now: datetime) -> UpdateOne:
+    key = {
+        'tenant.userId': tenant['userId'],
+        'granularity': snapshot['granularity'],
+        'periodStart': snapshot['periodStart'],
+    }
+    return UpdateOne(
+        key,
+        {
+            '$set': dict(snapshot, tenant=tenant, **{'audit.updatedAt': now}),
+            '$setOnInsert': {'audit.createdAt': now},
+        },
+        upsert=True,
+    )
+
+
+def build_snapshots(user_id, granularities: Sequence[str] = GRANULARITIES,
+                    columns: Optional[TradeColumns] = None) -> int:
+    """Full rebuild: recompute every snapshot for one user, replacing any drifted
+    incremental state and removing empty periods. Returns the number written.
+
+    Session screen time (``screenMinutes``) is only refreshed here."""
+    from .time_tracking import screen_time  # builds on this module
+
+    tenant = tenant_for(user_id)
+    if columns is None:
+        columns = load_trade_columns(user_id)
+    hourly = screen_time(user_id) if len(columns) else None
+    now = datetime.now(timezone.utc)
+    operations = [
+        snapshot_upsert(tenant, snapshot, now)
+        for granularity in granularities
+        for snapshot in compute_snapshots(columns, granularity, hourly)
+    ]
+    collection = get_repository(AnalyticsSnapshotRepository).get_collection()
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+    # Periods whose trades were all cancelled or reopened no longer have a snapshot.
+    collection.delete_many({
+        'tenant.userId': tenant['userId'],
+        'granularity': {'$in': list(granularities)},
+        'audit.updatedAt': {'$lt': now},
+    })
+    bump_data_version(tenant['userId'])
+    return len(operations)
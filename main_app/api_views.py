@@ -1,11 +1,45 @@
 """Django REST Framework views for the trading app API."""
 
+import os
+import re
+from datetime import datetime, time, timedelta, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.decorators import method_decorator
 from rest_framework import viewsets, status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
 from django.contrib.auth.models import User as DjangoUser
+from pydantic import ValidationError as InputError
 
+from . import attachments, behavior, links, notebook, search as search_index
+from .blobs import BlobNotFound, BlobTooLarge, blob_store, read_range
+from .caching import conditional, request_stamp
+from .db import get_repository, pool_stats
+from .exports import EXPORT_BATCH_SIZE, EXPORT_FORMATS, export_response
+from .middleware import principal_cache
+from .models import (
+    AnalyticsSnapshotRepository, AttachmentRepository, JournalEntryRepository, NotebookNoteRepository, TradeRepository,
+)
+from .pagination import MongoCursorPagination
+from .renderers import RawJSON, dumps
+from .schemas import ATTACHMENT_SCHEMA, JOURNAL_ENTRY_SCHEMA, NOTEBOOK_NOTE_SCHEMA, TRADE_SCHEMA
 from .serializers import UserSerializer
+from .user_model import UserRepository
+from .versions import ATTACHMENTS, JOURNAL, NOTES, TRADE_LIST_SCOPES, TRADES
+
+TRADE_STATUSES = ('OPEN', 'CLOSED', 'CANCELLED')
+GRANULARITIES = ('daily', 'weekly', 'monthly')
+MAX_SNAPSHOTS = 1000
+MAX_SEARCH_RESULTS = 100
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+SNAPSHOT_PROJECTION = {'periodStart': 1, 'periodEnd': 1, 'metrics': 1, 'cohorts': 1}
 
 
 @api_view(['GET'])
@@ -17,6 +51,15 @@ def api_root(request):
             'users': '/api/users/',
             'trades': '/api/trades/',
             'journal': '/api/journal/',
+            'notes': '/api/notes/',
+            'search': '/api/search/',
+            'related': '/api/related/<note|trade|journal>/<id>/',
+            'attachments': '/api/attachments/',
+            'behaviorEvents': '/api/behavior-events/',
+            'jobs': '/api/jobs/<id>/',
+            'equity': '/api/equity/',
+            'analytics': '/api/analytics/',
+            'diagnostics': '/api/diagnostics/',
             'login': '/api/login/',
             'logout': '/api/logout/',
         }
@@ -26,6 +69,492 @@ def api_root(request):
 class UserViewSet(viewsets.ModelViewSet):
     """API endpoint that allows users to be viewed or edited."""
     queryset = DjangoUser.objects.all().order_by('-date_joined')
-    serializer_class = UserSerializer   
+    serializer_class = UserSerializer
+
+
+def _list_param(params, name):
+    """Comma-separated and/or repeated query parameter as a list."""
+    return [value.strip() for raw in params.getlist(name) for value in raw.split(',') if value.strip()]
+
+
+def _in(values):
+    return values[0] if len(values) == 1 else {'$in': values}
+
+
+def _parse_bound(name, raw, end=False):
+    """ISO datetime, or a date meaning that whole day (so ``to`` is inclusive)."""
+    try:
+        day = parse_date(raw)
+        value = None if day else parse_datetime(raw)
+    except ValueError:
+        day = value = None
+    if day is not None:
+        value = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+        return value.replace(tzinfo=timezone.utc), '$lt' if end else '$gte'
+    if value is None:
+        raise ValidationError({name: f"Expected an ISO date or datetime, got {raw!r}."})
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value, '$lte' if end else '$gte'
+
+
+def selected_fields(params, schema):
+    """``?fields=`` checked against the response schema (None: all fields)."""
+    fields = _list_param(params, 'fields')
+    unknown = set(fields) - set(schema.field_names())
+    if unknown:
+        raise ValidationError({'fields': f"Unknown fields: {', '.join(sorted(unknown))}."})
+    return fields or None
+
+
+def document_query(params, user_id, date_field, filters=None):
+    """The user's documents, bounded by ``?from=``/``?to=`` on ``date_field``, plus ``filters``."""
+    query = {'tenant.userId': ObjectId(user_id)}
+    bounds = {}
+    for name, end in (('from', False), ('to', True)):
+        raw = params.get(name)
+        if raw:
+            value, operator = _parse_bound(name, raw, end)
+            bounds[operator] = value
+    if bounds:
+        query[date_field] = bounds
+    return filters(params, query) if filters else query
+
+
+def trade_filters(params, query):
+    statuses = [value.upper() for value in _list_param(params, 'status')]
+    if set(statuses) - set(TRADE_STATUSES):
+        raise ValidationError({'status': f"Expected any of: {', '.join(TRADE_STATUSES)}."})
+    if statuses:
+        query['status'] = _in(statuses)
+    strategies = _list_param(params, 'strategyTag')
+    if strategies:
+        query['strategyTag'] = _in(strategies)
+    underlyings = _list_param(params, 'underlying')
+    if underlyings:
+        query['instrument.underlying'] = {'$in': sorted({symbol for value in underlyings
+                                                           for symbol in (value, value.upper())})}
+    return query
+
+
+def journal_filters(params, query):
+    tags = _list_param(params, 'tag')
+    if tags:
+        query['tags'] = _in(tags)
+    trade_id = params.get('tradeId')
+    if trade_id:
+        try:
+            query['tradeId'] = ObjectId(trade_id)
+        except InvalidId:
+            raise ValidationError({'tradeId': 'Not a valid id.'})
+    return query
+
+
+class MongoReadOnlyViewSet(viewsets.ViewSet):
+    """List, retrieve and export the current user's documents of one collection.
+
+    Every filter becomes part of the MongoDB query, ``?fields=`` becomes the
+    projection, and lists are keyset-paginated by ``audit.createdAt``.
+    Documents are dumped by a Pydantic ``schema`` (see ``schemas.py``) and
+    returned as ready-made JSON bytes.
+    """
+    repository_class = None
+    schema = None
+    filters = None  # function(params, query) -> query
+    pagination_class = MongoCursorPagination
+    date_field = 'audit.createdAt'  # what ?from= and ?to= bound
+    export_name = None
+    lookup_value_regex = '[0-9a-fA-F]{24}'
+
+    def get_collection(self):
+        return get_repository(self.repository_class).get_collection()
+
+    def get_fields(self):
+        return selected_fields(self.request.query_params, self.schema)
+
+    def get_projection(self):
+        # The keyset cursor is built from the sort key, whichever fields are shown.
+        return self.schema.projection(self.get_fields(), keys=(self.pagination_class.sort_field, '_id'))
+
+    def get_query(self):
+        return document_query(self.request.query_params, self.request.user.id, self.date_field, self.filters)
+
+    def list(self, request):
+        paginator = self.pagination_class()
+        documents = paginator.paginate(self.get_collection(), self.get_query(), request, self.get_projection())
+        results = self.schema.dump_many(documents, self.get_fields())
+        return Response(RawJSON(b'{"next":%s,"results":%s}' % (dumps(paginator.get_next_link()), results)))
+
+    def retrieve(self, request, pk=None):
+        document = self.get_collection().find_one(
+            {'_id': ObjectId(pk), 'tenant.userId': ObjectId(request.user.id)}, self.get_projection(),
+        )
+        if document is None:
+            raise NotFound()
+        return Response(RawJSON(self.schema.dump(document, self.get_fields())))
+
+    @action(detail=False)
+    def export(self, request):
+        """The whole filtered history, streamed: ``?as=ndjson`` (default) or ``?as=csv``."""
+        kind = request.query_params.get('as', 'ndjson')
+        if kind not in EXPORT_FORMATS:
+            raise ValidationError({'as': f"Expected one of: {', '.join(EXPORT_FORMATS)}."})
+        cursor = self.get_collection().find(
+            self.get_query(),
+            self.get_projection(),
+            sort=[(self.pagination_class.sort_field, -1), ('_id', -1)],
+            batch_size=EXPORT_BATCH_SIZE,
+        )
+        return export_response(cursor, self.schema, kind, self.export_name, self.get_fields())
+
+
+@method_decorator(conditional(*TRADE_LIST_SCOPES), name='dispatch')
+class TradeViewSet(MongoReadOnlyViewSet):
+    """Trades: ``?status=``, ``?strategyTag=``, ``?underlying=`` (comma-separated) and ``?from=``/``?to=`` on openTs."""
+    repository_class = TradeRepository
+    schema = TRADE_SCHEMA
+    filters = staticmethod(trade_filters)
+    date_field = 'openTs'
+    export_name = 'trades'
+
+
+def invalid_input(error: InputError) -> ValidationError:
+    return ValidationError({'.'.join(str(part) for part in item['loc']) or 'detail': item['msg']
+                            for item in error.errors()})
+
+
+class NotebookWriteMixin:
+    """Create, partially update and delete the user's documents through ``main_app.notebook``."""
+    kind = None  # notebook.INPUTS key
+
+    def _input(self, request):
+        if not isinstance(request.data, dict):
+            raise ValidationError({'detail': 'Expected a JSON object.'})
+        return request.data
+
+    def create(self, request):
+        try:
+            document = notebook.create(self.kind, request.user.id, self._input(request))
+        except InputError as error:
+            raise invalid_input(error)
+        return Response(RawJSON(self.schema.dump(document)), status=status.HTTP_201_CREATED)
+
+    def partial_update(self, request, pk=None):
+        try:
+            document = notebook.update(self.kind, request.user.id, pk, self._input(request))
+        except InputError as error:
+            raise invalid_input(error)
+        except notebook.WriteConflict as error:
+            return Response({'detail': str(error)}, status=status.HTTP_409_CONFLICT)
+        if document is None:
+            raise NotFound()
+        return Response(RawJSON(self.schema.dump(document)))
+
+    def destroy(self, request, pk=None):
+        if not notebook.delete(self.kind, request.user.id, pk):
+            raise NotFound()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@method_decorator(conditional(JOURNAL), name='dispatch')
+class JournalEntryViewSet(NotebookWriteMixin, MongoReadOnlyViewSet):
+    """Journal entries: ``?tag=``, ``?tradeId=`` and ``?from=``/``?to=`` on createdAt."""
+    repository_class = JournalEntryRepository
+    schema = JOURNAL_ENTRY_SCHEMA
+    filters = staticmethod(journal_filters)
+    export_name = 'journal'
+    kind = 'journal'
+
+
+@method_decorator(conditional(NOTES), name='dispatch')
+class NotebookNoteViewSet(NotebookWriteMixin, MongoReadOnlyViewSet):
+    """Notebook notes: ``?from=``/``?to=`` on createdAt."""
+    repository_class = NotebookNoteRepository
+    schema = NOTEBOOK_NOTE_SCHEMA
+    export_name = 'notes'
+    kind = 'note'
+
+
+def attachment_filters(params, query):
+    for name in ('tradeId', 'journalEntryId'):
+        value = params.get(name)
+        if value:
+            try:
+                query[name] = ObjectId(value)
+            except InvalidId:
+                raise ValidationError({name: 'Not a valid id.'})
+    kind = params.get('type')
+    if kind:
+        query['type'] = kind
+    return query
+
+
+@method_decorator(conditional(ATTACHMENTS), name='dispatch')
+class AttachmentViewSet(MongoReadOnlyViewSet):
+    """Attachments: ``?tradeId=``, ``?journalEntryId=``, ``?type=`` and ``?from=``/``?to=`` on createdAt.
+
+    POST uploads one: either the raw file as the request body (its
+    Content-Type, ``?filename=``) or a multipart form with a ``file`` field,
+    plus ``?type=screenshot|csv`` (screenshot) and ``?tradeId=`` or
+    ``?journalEntryId=``. The body is streamed into the blob store.
+    """
+    repository_class = AttachmentRepository
+    schema = ATTACHMENT_SCHEMA
+    filters = staticmethod(attachment_filters)
+    export_name = 'attachments'
 
+    def create(self, request):
+        params = request.query_params
+        if request.content_type.startswith('multipart/form-data'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                raise ValidationError({'file': 'No file was submitted.'})
+            stream, content_type, filename = upload, upload.content_type, upload.name
+        else:
+            stream, content_type, filename = request.stream, request.content_type, params.get('filename')
+            if stream is None:
+                raise ValidationError({'detail': 'The request body is empty.'})
+        try:
+            attachment, created = attachments.store(
+                request.user.id, stream, params.get('type', 'screenshot'), content_type, filename,
+                trade_id=params.get('tradeId'), journal_entry_id=params.get('journalEntryId'),
+            )
+        except attachments.AttachmentRejected as error:
+            raise ValidationError({'detail': str(error)})
+        except BlobTooLarge:
+            return Response({'detail': f'Attachments are limited to {settings.ATTACHMENT_MAX_BYTES} bytes.'},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        return Response(RawJSON(self.schema.dump(attachment)),
+                        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
+    def destroy(self, request, pk=None):
+        if not attachments.delete(request.user.id, pk):
+            raise NotFound()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def byte_range(header, size):
+    """(first, last) byte of a single-range ``Range: bytes=`` header, or None to send everything.
+
+    Raises ValueError when the range lies outside the content.
+    """
+    match = BYTE_RANGE.match(header.strip()) if header else None
+    if match is None or match.groups() == ('', ''):
+        return None  # absent, malformed or multiple ranges: the whole content (RFC 9110 allows it)
+    first, last = match.groups()
+    if not first:  # the last N bytes
+        if int(last) == 0 or size == 0:
+            raise ValueError(header)
+        return max(size - int(last), 0), size - 1
+    if last and int(last) < int(first):
+        return None
+    if int(first) >= size:
+        raise ValueError(header)
+    return int(first), min(int(last), size - 1) if last else size - 1
+
+
+def blob_response(request, checksum, content_type, filename=None, disposition='inline'):
+    """A blob, or the requested byte range of it, streamed in chunks.
+
+    Blobs never change under a checksum, so the checksum is the ETag and
+    clients may keep them for good.
+    """
+    etag = f'"{checksum}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        try:
+            blob, size = blob_store().open(checksum)
+        except BlobNotFound:
+            raise NotFound()
+        if_range = request.headers.get('If-Range')
+        try:
+            requested = byte_range(request.headers.get('Range'), size) if if_range in (None, etag) else None
+        except ValueError:
+            blob.close()
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        first, last = requested or (0, size - 1)
+        response = StreamingHttpResponse(read_range(blob, first, last - first + 1), content_type=content_type,
+                                         status=status.HTTP_206_PARTIAL_CONTENT if requested else status.HTTP_200_OK)
+        response['Content-Length'] = str(last - first + 1)
+        if requested:
+            response['Content-Range'] = f'bytes {first}-{last}/{size}'
+        if filename:
+            response['Content-Disposition'] = f'{disposition}; filename="{filename.replace(chr(34), "")}"'
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    patch_cache_control(response, private=True, max_age=365 * 24 * 3600, immutable=True)
+    return response
+
+
+def _attachment(request, attachment_id):
+    try:
+        attachment = get_repository(AttachmentRepository).get_collection().find_one(
+            {'_id': ObjectId(attachment_id), 'tenant.userId': ObjectId(request.user.id)},
+            {'checksum': 1, 'contentType': 1, 'filename': 1, 'type': 1, 'thumbnail': 1, 'thumbnailStatus': 1},
+        )
+    except InvalidId:
+        attachment = None
+    if attachment is None:
+        raise NotFound()
+    return attachment
+
+
+@api_view(['GET'])
+def attachment_content(request, attachment_id):
+    """The attachment's bytes; honours ``Range`` (single ranges) and ``If-None-Match``."""
+    attachment = _attachment(request, attachment_id)
+    disposition = 'inline' if attachment['type'] == 'screenshot' else 'attachment'
+    return blob_response(request, attachment['checksum'], attachment.get('contentType') or 'application/octet-stream',
+                         attachment.get('filename'), disposition)
+
+
+@api_view(['GET'])
+def attachment_thumbnail(request, attachment_id):
+    """A screenshot's thumbnail, once a worker has made it (see ``thumbnailStatus``)."""
+    attachment = _attachment(request, attachment_id)
+    if not attachment.get('thumbnail'):
+        return Response({'detail': 'No thumbnail.', 'thumbnailStatus': attachment.get('thumbnailStatus')},
+                        status=status.HTTP_404_NOT_FOUND)
+    return blob_response(request, attachment['thumbnail'], attachments.THUMBNAIL_CONTENT_TYPE)
+
+
+@conditional(JOURNAL, NOTES)
+@api_view(['GET'])
+def search(request):
+    """Journal entries and notes matching ``?q=`` (BM25-ranked, words also match as prefixes) with tag facets.
+
+    ``?tag=`` keeps documents carrying every given tag, ``?kind=journal|note``
+    limits the kinds, ``?limit=``/``?offset=`` page through the hits.
+    """
+    params = request.query_params
+    kinds = _list_param(params, 'kind') or list(search_index.KINDS)
+    if set(kinds) - set(search_index.KINDS):
+        raise ValidationError({'kind': f"Expected any of: {', '.join(search_index.KINDS)}."})
+    try:
+        limit = min(max(int(params.get('limit', 20)), 1), MAX_SEARCH_RESULTS)
+        offset = max(int(params.get('offset', 0)), 0)
+    except ValueError:
+        raise ValidationError({'detail': 'limit and offset must be integers.'})
+    return Response(search_index.search(
+        request.user.id, params.get('q', ''), tags=_list_param(params, 'tag'), kinds=kinds, limit=limit,
+        offset=offset, stamp=request_stamp(request, request.user.id),
+    ))
+
+
+@conditional(JOURNAL, NOTES)
+@api_view(['GET'])
+def related(request, kind, document_id):
+    """Notes, trades and journal entries linked to one of them, up to ``?depth=`` (2, at most 3) hops away."""
+    try:
+        depth = int(request.query_params.get('depth', 2))
+    except ValueError:
+        raise ValidationError({'depth': 'Expected an integer.'})
+    try:
+        graph = links.related(request.user.id, kind, document_id, depth)
+    except InvalidId:
+        graph = None
+    if graph is None:
+        raise NotFound()
+    return Response(graph)
+
+
+@api_view(['POST'])
+def behavior_events(request):
+    """Log a batch of behavior events: a JSON list (or ``{"events": [...]}``) of up to ``behavior.MAX_BATCH``.
+
+    Answers 202 once the batch is buffered; it is written shortly after,
+    together with other requests' events (see ``main_app.behavior``).
+    """
+    events = request.data.get('events') if isinstance(request.data, dict) else request.data
+    if not isinstance(events, list) or not events:
+        raise ValidationError({'detail': 'Expected a non-empty list of events.'})
+    if len(events) > behavior.MAX_BATCH:
+        raise ValidationError({'detail': f'At most {behavior.MAX_BATCH} events per request.'})
+    try:
+        accepted = behavior.ingest(request.user.id, events)
+    except InputError as error:
+        raise invalid_input(error)
+    except behavior.Backpressure:
+        return Response({'detail': 'Too many events are waiting to be written; retry shortly.'},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        headers={'Retry-After': str(max(int(settings.BEHAVIOR_EVENT_FLUSH_SECONDS), 1))})
+    return Response({'accepted': accepted}, status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(['GET'])
+def job_detail(request, job_id):
+    """Poll an import or analytics job owned by the current user."""
+    from .jobs import job_status  # pulls in the import pipeline; keep it off cold starts of other views
+
+    try:
+        job = job_status(job_id, request.user.id)
+    except InvalidId:
+        job = None
+    if job is None:
+        return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    headers = {} if job['finished'] else {'Retry-After': str(int(settings.WORKER_POLL_SECONDS) or 1)}
+    return Response(job, headers=headers)
+
+
+@api_view(['GET'])
+def diagnostics(request):
+    """Connection pool and principal cache counters of the worker process that serves the request; admins only."""
+    user = get_repository(UserRepository).get_collection().find_one({'_id': ObjectId(request.user.id)}, {'role': 1})
+    if not user or user.get('role') != 'admin':
+        return Response({'detail': 'Admins only.'}, status=status.HTTP_403_FORBIDDEN)
+    return Response({'pid': os.getpid(), 'mongoPool': pool_stats(), 'principalCache': principal_cache.stats()})
+
+
+@conditional(TRADES)
+@api_view(['GET'])
+def equity(request):
+    """Equity curve and drawdown statistics; ``?ruin=1`` adds a Monte Carlo risk of ruin."""
+    from .equity import equity_curve, risk_of_ruin  # NumPy, on first use only
+
+    curve = equity_curve(request.user.id)
+    payload = {'stats': curve.stats(), 'points': curve.points()}
+    if request.query_params.get('ruin'):
+        try:
+            paths = min(max(int(request.query_params.get('paths', 10000)), 100), 200000)
+            seed = int(request.query_params.get('seed', 0))
+        except ValueError:
+            return Response({'detail': 'paths and seed must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+        payload['riskOfRuin'] = risk_of_ruin(request.user.id, paths=paths, seed=seed)
+    return Response(payload)
+
+
+def snapshot_query(params, user_id):
+    """``?granularity=`` (daily) and ``?from=``/``?to=`` on periodStart; returns (query, granularity)."""
+    granularity = params.get('granularity', 'daily')
+    if granularity not in GRANULARITIES:
+        raise ValidationError({'granularity': f"Expected one of: {', '.join(GRANULARITIES)}."})
+    query = document_query(params, user_id, 'periodStart')
+    query['granularity'] = granularity
+    return query, granularity
+
+
+def snapshot_row(document):
+    return {
+        'periodStart': document['periodStart'].date().isoformat(),
+        'periodEnd': document['periodEnd'].date().isoformat(),
+        'metrics': document.get('metrics', {}),
+        'cohorts': document.get('cohorts', {}),
+    }
+
+
+def analytics_payload(granularity, documents):
+    # Fetched newest first so the limit keeps the latest periods; charts want them oldest first.
+    return {'granularity': granularity, 'snapshots': [snapshot_row(document) for document in reversed(documents)]}
+
+
+@conditional(TRADES)
+@api_view(['GET'])
+def analytics(request):
+    """The latest AnalyticsSnapshot periods of the current user, oldest first."""
+    query, granularity = snapshot_query(request.query_params, request.user.id)
+    documents = list(get_repository(AnalyticsSnapshotRepository).get_collection().find(
+        query, SNAPSHOT_PROJECTION, sort=[('periodStart', -1)], limit=MAX_SNAPSHOTS,
+    ))
+    return Response(analytics_payload(granularity, documents))
@@ -0,0 +1,177 @@
+"""Async versions of the hot views, routed instead of the sync ones under ASGI.
+
+They build the same queries as ``login_views`` and ``api_views`` but await
+``AsyncMongoClient`` (``db.get_async_repository``) instead of holding a
+thread per request, so one ASGI worker can serve many concurrent dashboard
+users. ``settings.ASYNC_VIEWS`` (set by ``api/asgi.py``) selects them in
+``urls.py``; under WSGI every async view would run on a throwaway event
+loop, so the sync views stay in place there.
+
+Authentication comes from ``await request.auser()`` (see
+``MongoAuthMiddleware``). The JSON endpoints return the same payloads and
+errors as their DRF counterparts.
+"""
+
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from bson import ObjectId
+from django.contrib import messages
+from django.contrib.auth.hashers import check_password
+from django.contrib.auth.views import redirect_to_login
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import redirect, render
+from rest_framework.exceptions import ValidationError
+
+from .api_views import (
+    MAX_SNAPSHOTS, SNAPSHOT_PROJECTION, analytics_payload, document_query, selected_fields, snapshot_query,
+    trade_filters,
+)
+from .caching import acached_fragment, conditional
+from .db import get_async_repository
+from .forms import LoginForm, RegistrationForm
+from .login_views import (
+    TRADE_LIST_PROJECTION, TRADE_PAGE_SIZE, _page_size, render_trade_table, trade_row,
+)
+from .models import AnalyticsSnapshotRepository, TradeRepository
+from .pagination import InvalidCursor, MongoCursorPagination, afetch_page, encode_cursor, keyset_query
+from .renderers import dumps
+from .schemas import TRADE_SCHEMA
+from .user_model import UserRepository
+from .versions import TRADE_LIST_SCOPES, TRADES
+
+# Password hashing is deliberately slow; keep it off the event loop, and off the
+# single shared thread that thread-sensitive sync_to_async would use.
+acheck_password = sync_to_async(check_password, thread_sensitive=False)
+
+
+def json_response(content, status=200) -> HttpResponse:
+    return HttpResponse(content if isinstance(content, bytes) else dumps(content),
+                        status=status, content_type='application/json')
+
+
+def async_login_required(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not (await request.auser()).is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def async_api_view(view):
+    """GET-only JSON endpoint with DRF's authentication and validation error responses."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return json_response({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+        user = await request.auser()
+        if not user.is_authenticated:
+            return json_response({'detail': 'Authentication credentials were not provided.'}, status=403)
+        try:
+            return await view(request, user, *args, **kwargs)
+        except ValidationError as exc:
+            return json_response(exc.detail, status=400)
+    return wrapper
+
+
+async def login_page(request):
+    await request.auser()  # templates read request.user; resolve it without blocking
+    registration_form = RegistrationForm()
+
+    if request.method == 'POST':
+        form = LoginForm(request.POST)
+        if form.is_valid():
+            user_data = await get_async_repository(UserRepository).get_collection().find_one(
+                {'username': form.cleaned_data['username']}
+            )
+            if user_data and await acheck_password(form.cleaned_data['password'], user_data['hashed_password']):
+                request.session['user_id'] = str(user_data['_id'])
+                request.session['username'] = user_data['username']
+                messages.success(request, 'Login successful!')
+                return redirect('landing_page')
+
+            messages.error(request, 'Invalid username or password.')
+    else:
+        form = LoginForm()
+
+    return render(request, 'login.html', {'form': form, 'registration_form': registration_form})
+
+
+@async_login_required
+@conditional(*TRADE_LIST_SCOPES)
+async def landing_page(request):
+    user = await request.auser()
+
+    async def render_table():
+        return render_trade_table(*await afetch_page(
+            get_async_repository(TradeRepository).get_collection(),
+            {'tenant.userId': ObjectId(user.id)},
+            'audit.createdAt',
+            TRADE_PAGE_SIZE,
+            projection=TRADE_LIST_PROJECTION,
+        ))
+
+    return render(request, 'landing.html', {
+        'trade_table': await acached_fragment(request, user.id, 'trade_table', TRADE_LIST_SCOPES, render_table),
+    })
+
+
+@async_login_required
+@conditional(*TRADE_LIST_SCOPES)
+async def load_more_trades(request):
+    """Stream the next page of trades as JSON: {"trades": [...], "next": cursor-or-null}."""
+    user = await request.auser()
+    limit = _page_size(request)
+    try:
+        query = keyset_query({'tenant.userId': ObjectId(user.id)}, 'audit.createdAt', request.GET.get('after'))
+    except InvalidCursor as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    cursor = get_async_repository(TradeRepository).get_collection().find(
+        query,
+        TRADE_LIST_PROJECTION,
+        sort=[('audit.createdAt', -1), ('_id', -1)],
+        limit=limit + 1,
+        batch_size=limit + 1,
+    )
+
+    async def stream():
+        yield '{"trades":['
+        count, last = 0, None
+        async for document in cursor:
+            if count == limit:
+                break
+            yield (',' if count else '') + dumps(trade_row(document)).decode()
+            count, last = count + 1, document
+        else:
+            last = None
+        next_cursor = encode_cursor(last, 'audit.createdAt') if last is not None else None
+        yield '],"next":' + dumps(next_cursor).decode() + '}'
+
+    return StreamingHttpResponse(stream(), content_type='application/json')
+
+
+@conditional(*TRADE_LIST_SCOPES)
+@async_api_view
+async def trade_list(request, user):
+    """``GET /api/trades/``: same filters, fields and cursor pagination as ``TradeViewSet.list``."""
+    fields = selected_fields(request.GET, TRADE_SCHEMA)
+    paginator = MongoCursorPagination()
+    documents = await paginator.apaginate(
+        get_async_repository(TradeRepository).get_collection(),
+        document_query(request.GET, user.id, 'openTs', trade_filters),
+        request,
+        TRADE_SCHEMA.projection(fields, keys=(MongoCursorPagination.sort_field, '_id')),
+    )
+    results = TRADE_SCHEMA.dump_many(documents, fields)
+    return json_response(b'{"next":%s,"results":%s}' % (dumps(paginator.get_next_link()), results))
+
+
+@conditional(TRADES)
+@async_api_view
+async def analytics(request, user):
+    query, granularity = snapshot_query(request.GET, user.id)
+    cursor = get_async_repository(AnalyticsSnapshotRepository).get_collection().find(
+        query, SNAPSHOT_PROJECTION, sort=[('periodStart', -1)], limit=MAX_SNAPSHOTS,
+    )
+    return json_response(analytics_payload(granularity, await cursor.to_list(MAX_SNAPSHOTS)))
@@ -0,0 +1,222 @@
+"""Screenshot and CSV attachments of trades and journal entries.
+
+Uploads stream into the content-addressed blob store (``main_app.blobs``)
+and are hashed on the way, so an identical screenshot attached to several
+trades is stored once, and uploading the same file to the same trade again
+returns the attachment it already has. A screenshot is also listed in its
+trade's or journal entry's ``screenshotIds``.
+
+Thumbnails are made off the request path by the job workers
+(``manage.py run_worker``): one ``thumbnail`` job per new image content.
+They are blobs too, shared by every attachment of the same image, so an
+image is only thumbnailed once.
+"""
+
+import logging
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+
+from .blobs import blob_store
+from .db import get_repository
+from .models import AttachmentRepository, JournalEntryRepository, TradeRepository
+from .user_model import tenant_for
+from .versions import ATTACHMENTS, JOURNAL, TRADE_DOCUMENTS, bump_data_versions
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {
+    'screenshot': ('image/png', 'image/jpeg', 'image/webp', 'image/gif'),
+    'csv': ('text/csv', 'text/plain', 'application/vnd.ms-excel'),
+}
+THUMBNAIL_CONTENT_TYPE = 'image/webp'
+GARBAGE_GRACE = timedelta(hours=1)
+GARBAGE_BATCH = 500
+
+# Attachment field -> (repository of the document it belongs to, data version scope of that document)
+TARGETS = {
+    'tradeId': (TradeRepository, TRADE_DOCUMENTS),
+    'journalEntryId': (JournalEntryRepository, JOURNAL),
+}
+
+
+class AttachmentRejected(ValueError):
+    pass
+
+
+def _collection():
+    return get_repository(AttachmentRepository).get_collection()
+
+
+def content_url(attachment_id) -> str:
+    return f'/api/attachments/{attachment_id}/content/'
+
+
+def _targets(user: ObjectId, trade_id, journal_entry_id) -> Dict[str, Optional[ObjectId]]:
+    targets = {}
+    for field, value in (('tradeId', trade_id), ('journalEntryId', journal_entry_id)):
+        try:
+            target = ObjectId(value) if value else None
+        except InvalidId:
+            raise AttachmentRejected(f"{field} is not a valid id.")
+        repository_class = TARGETS[field][0]
+        if target and get_repository(repository_class).get_collection().find_one(
+                {'_id': target, 'tenant.userId': user}, {'_id': 1}) is None:
+            raise AttachmentRejected(f"{field} does not exist.")
+        targets[field] = target
+    return targets
+
+
+def _bump(user_id, targets: Dict[str, Optional[ObjectId]]):
+    bump_data_versions([user_id], [ATTACHMENTS] + [TARGETS[field][1] for field, target in targets.items() if target])
+
+
+def _link(user: ObjectId, targets: Dict[str, Optional[ObjectId]], attachment_id, operator: str):
+    for field, target in targets.items():
+        if target:
+            get_repository(TARGETS[field][0]).get_collection().update_one(
+                {'_id': target, 'tenant.userId': user}, {operator: {'screenshotIds': attachment_id}},
+            )
+
+
+def store(user_id, stream, kind: str, content_type: str, filename: Optional[str] = None, trade_id=None,
+          journal_entry_id=None) -> Tuple[dict, bool]:
+    """Stream an upload into the blob store and record it; returns (attachment, created).
+
+    Raises ``AttachmentRejected`` for a type or target that is not allowed
+    and ``blobs.BlobTooLarge`` past ``settings.ATTACHMENT_MAX_BYTES``.
+    """
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if kind not in CONTENT_TYPES:
+        raise AttachmentRejected(f"type must be one of: {', '.join(CONTENT_TYPES)}.")
+    if content_type not in CONTENT_TYPES[kind]:
+        raise AttachmentRejected(f"A {kind} must be one of: {', '.join(CONTENT_TYPES[kind])}.")
+    user = ObjectId(user_id)
+    targets = _targets(user, trade_id, journal_entry_id)
+
+    blob = blob_store().save(stream, settings.ATTACHMENT_MAX_BYTES)
+    existing = _collection().find_one({'tenant.userId': user, 'checksum': blob.checksum, **targets})
+    if existing is not None:
+        return existing, False
+
+    thumbnail, status = None, None
+    if kind == 'screenshot':
+        done = _collection().find_one({'checksum': blob.checksum, 'thumbnailStatus': {'$in': ['ready', 'unavailable']}},
+                                      {'thumbnail': 1, 'thumbnailStatus': 1})
+        thumbnail, status = (done['thumbnail'], done['thumbnailStatus']) if done else (None, 'pending')
+    now = datetime.now(timezone.utc)
+    attachment_id = ObjectId()
+    tenant = tenant_for(user_id)
+    attachment = {
+        '_id': attachment_id,
+        'tenant': tenant,
+        'audit': {'createdAt': now, 'updatedAt': now, 'deletedAt': None},
+        'type': kind,
+        'url': content_url(attachment_id),
+        'checksum': blob.checksum,
+        'size': blob.size,
+        'contentType': content_type,
+        'filename': filename,
+        'thumbnail': thumbnail,
+        'thumbnailStatus': status,
+        **targets,
+    }
+    _collection().insert_one(attachment)
+    if kind == 'screenshot':
+        _link(user, targets, attachment_id, '$addToSet')
+    _bump(user_id, targets)
+    if status == 'pending':
+        from .jobs import enqueue  # the job module pulls in the import pipeline
+
+        enqueue('thumbnail', tenant, blob.checksum)
+    return attachment, True
+
+
+def delete(user_id, attachment_id) -> bool:
+    """Remove the attachment; its blob stays until ``collect_garbage`` finds it unused."""
+    user = ObjectId(user_id)
+    attachment = _collection().find_one_and_delete({'_id': ObjectId(attachment_id), 'tenant.userId': user},
+                                                   {'tradeId': 1, 'journalEntryId': 1})
+    if attachment is None:
+        return False
+    targets = {field: attachment.get(field) for field in TARGETS}
+    _link(user, targets, attachment['_id'], '$pull')
+    _bump(user_id, targets)
+    return True
+
+
+def render_thumbnail(image_file, size: int) -> bytes:
+    """WebP of the image scaled to fit ``size`` x ``size``."""
+    from PIL import Image  # only the job workers make thumbnails
+
+    with Image.open(image_file) as image:
+        image.draft('RGB', (size, size))  # JPEG: decode at the smallest sufficient scale
+        image.thumbnail((size, size))
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        output = BytesIO()
+        image.save(output, 'WEBP', quality=80)
+    return output.getvalue()
+
+
+def make_thumbnail(checksum: str) -> Optional[str]:
+    """Thumbnail the image ``checksum`` for every attachment still waiting for it; returns the thumbnail's checksum."""
+    from PIL import Image
+
+    pending = {'checksum': checksum, 'thumbnailStatus': 'pending'}
+    user_ids = _collection().distinct('tenant.userId', pending)
+    if not user_ids:
+        return None  # already made, or the attachments are gone
+    image_file, _ = blob_store().open(checksum)
+    try:
+        data = render_thumbnail(image_file, settings.THUMBNAIL_SIZE)
+    except (Image.UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError, ValueError) as exc:
+        # Not an image Pillow can read; retrying will not change that.
+        logger.warning("No thumbnail for %s: %s", checksum, exc)
+        _collection().update_many(pending, {'$set': {'thumbnailStatus': 'unavailable'}})
+        bump_data_versions(user_ids, (ATTACHMENTS,))
+        return None
+    finally:
+        image_file.close()
+    thumbnail = blob_store().save(BytesIO(data)).checksum
+    _collection().update_many(pending, {'$set': {'thumbnail': thumbnail, 'thumbnailStatus': 'ready'}})
+    bump_data_versions(user_ids, (ATTACHMENTS,))
+    return thumbnail
+
+
+def _unreferenced(checksums: List[str]) -> List[str]:
+    used = set()
+    for attachment in _collection().find({'$or': [{'checksum': {'$in': checksums}}, {'thumbnail': {'$in': checksums}}]},
+                                         {'checksum': 1, 'thumbnail': 1}):
+        used.update((attachment['checksum'], attachment.get('thumbnail')))
+    return [checksum for checksum in checksums if checksum not in used]
+
+
+def collect_garbage(grace: timedelta = GARBAGE_GRACE, dry_run: bool = False) -> Dict[str, int]:
+    """Delete blobs stored before ``grace`` ago that no attachment (or thumbnail) refers to.
+
+    Uploads abandoned halfway that long ago are discarded too.
+    """
+    store = blob_store()
+    cutoff = datetime.now(timezone.utc) - grace
+    totals = {'checked': 0, 'deleted': 0, 'incoming': 0 if dry_run else store.discard_incoming(cutoff)}
+
+    def sweep(batch: Iterable[str]):
+        batch = list(batch)
+        totals['checked'] += len(batch)
+        for checksum in _unreferenced(batch):
+            if not dry_run:
+                store.delete(checksum)
+            totals['deleted'] += 1
+
+    batch = []
+    for checksum in store.stored_before(cutoff):
+        batch.append(checksum)
+        if len(batch) == GARBAGE_BATCH:
+            sweep(batch)
+            batch = []
+    sweep(batch)
+    return totals
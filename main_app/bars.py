@@ -0,0 +1,127 @@
+"""Local intraday bar store on memory-mapped NumPy files.
+
+Layout under ``BAR_STORE_DIR``::
+
+    <SYMBOL>/<YYYY-MM-DD>.npy   one day of OHLC bars, sorted by timestamp
+    <SYMBOL>/days.npy           sorted day numbers that have a file (date index)
+
+Day files are opened with ``mmap_mode='r'``: a query binary-searches the
+date index for the days it spans and the timestamps for the bars inside
+them, so only the pages of the requested windows are ever read.
+"""
+
+import os
+from collections import OrderedDict
+from datetime import date
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+BAR_DTYPE = np.dtype([('ts', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8')])
+MS_PER_DAY = 86_400_000
+INDEX_FILE = 'days.npy'
+
+
+def day_number(value: date) -> int:
+    return (value - date(1970, 1, 1)).days
+
+
+def day_from_number(number: int) -> date:
+    return date.fromordinal(date(1970, 1, 1).toordinal() + int(number))
+
+
+class BarStore:
+    """Per-symbol, per-day OHLC arrays with timestamps in epoch milliseconds (UTC)."""
+
+    def __init__(self, root=None, max_open_days: int = 256):
+        self.root = Path(root or settings.BAR_STORE_DIR)
+        self.max_open_days = max_open_days
+        self._indexes = {}
+        self._open_days = OrderedDict()
+
+    def _symbol_dir(self, symbol: str) -> Path:
+        return self.root / symbol.upper()
+
+    def _day_path(self, symbol: str, number: int) -> Path:
+        return self._symbol_dir(symbol) / f'{day_from_number(number).isoformat()}.npy'
+
+    def days(self, symbol: str) -> np.ndarray:
+        symbol = symbol.upper()
+        if symbol not in self._indexes:
+            path = self._symbol_dir(symbol) / INDEX_FILE
+            self._indexes[symbol] = np.load(path) if path.exists() else np.empty(0, dtype=np.int64)
+        return self._indexes[symbol]
+
+    def day(self, symbol: str, number: int) -> np.ndarray:
+        """Memory-mapped bars of one day (kept open in a small LRU)."""
+        key = (symbol.upper(), int(number))
+        bars = self._open_days.get(key)
+        if bars is None:
+            bars = np.load(self._day_path(symbol, number), mmap_mode='r')
+            self._open_days[key] = bars
+            if len(self._open_days) > self.max_open_days:
+                self._open_days.popitem(last=False)
+        else:
+            self._open_days.move_to_end(key)
+        return bars
+
+    @staticmethod
+    def _save(path: Path, array: np.ndarray):
+        temporary = path.with_name(path.name + '.tmp')
+        with open(temporary, 'wb') as target:
+            np.save(target, array)
+        os.replace(temporary, path)
+
+    def write(self, symbol: str, bars: np.ndarray) -> int:
+        """Merge ``bars`` (BAR_DTYPE) into the store; returns the number of days touched.
+
+        A bar whose timestamp is already stored replaces the old one.
+        """
+        symbol = symbol.upper()
+        directory = self._symbol_dir(symbol)
+        directory.mkdir(parents=True, exist_ok=True)
+        bars = np.asarray(bars, dtype=BAR_DTYPE)
+        numbers = bars['ts'] // MS_PER_DAY
+        touched = np.unique(numbers)
+        index = self.days(symbol)
+        for number in touched.tolist():
+            incoming = bars[numbers == number]
+            if np.isin(number, index):
+                existing = np.load(self._day_path(symbol, number))
+                incoming = np.concatenate([incoming, existing])
+            # Stable sort on (ts, input order) and keep the first of each timestamp: new bars win.
+            incoming = incoming[np.argsort(incoming['ts'], kind='stable')]
+            _, first = np.unique(incoming['ts'], return_index=True)
+            self._open_days.pop((symbol, number), None)
+            self._save(self._day_path(symbol, number), incoming[first])
+        index = np.union1d(index, touched).astype(np.int64)
+        self._save(directory / INDEX_FILE, index)
+        self._indexes[symbol] = index
+        return len(touched)
+
+    def window(self, symbol: str, start_ms: int, end_ms: int) -> Iterator[np.ndarray]:
+        """Bars with ``start_ms <= ts <= end_ms``, one memory-mapped slice per day."""
+        index = self.days(symbol)
+        first = np.searchsorted(index, start_ms // MS_PER_DAY, side='left')
+        last = np.searchsorted(index, end_ms // MS_PER_DAY, side='right')
+        for number in index[first:last].tolist():
+            bars = self.day(symbol, number)
+            timestamps = bars['ts']
+            lo = np.searchsorted(timestamps, start_ms, side='left')
+            hi = np.searchsorted(timestamps, end_ms, side='right')
+            if lo < hi:
+                yield bars[lo:hi]
+
+    def extremes(self, symbol: str, start_ms: int, end_ms: int) -> Optional[Tuple[float, float, float]]:
+        """(first open, highest high, lowest low) over the window, or None without bars."""
+        first_open, high, low = None, -np.inf, np.inf
+        for bars in self.window(symbol, start_ms, end_ms):
+            if first_open is None:
+                first_open = float(bars['open'][0])
+            high = max(high, float(bars['high'].max()))
+            low = min(low, float(bars['low'].min()))
+        if first_open is None:
+            return None
+        return first_open, high, low
@@ -0,0 +1,230 @@
+"""Batched ingestion of BehaviorEvents (emotions, rule violations, adherence).
+
+Clients post events in batches (``POST /api/behavior-events/``). Each batch
+is validated and stamped in the request, then handed to the process's
+``EventWriter``. By default it writes the batch with one ``insert_many``
+before the request answers. With ``BEHAVIOR_EVENT_FLUSH_SECONDS`` > 0 (a
+long-lived server) it becomes a bounded buffer that a background thread
+writes once ``BEHAVIOR_EVENT_BATCH_SIZE`` events are waiting or the oldest
+has waited that long, so a burst of events from an active session costs a
+few round trips instead of one each.
+
+Backpressure: with ``BEHAVIOR_EVENT_MAX_PENDING`` events waiting, a request
+blocks up to ``BEHAVIOR_EVENT_ENQUEUE_TIMEOUT`` seconds for room and then
+gets ``Backpressure`` (503 with Retry-After) instead of growing the buffer.
+
+The buffer is drained at interpreter exit, but events still in it when a
+process is killed are lost. Keep buffering off where nothing runs after the
+response (serverless deploys such as Vercel).
+
+``behavior_events`` is a time-series collection (``timestamp`` with the
+``tenant`` as metadata, see ``BehaviorEventRepository.Meta``), created by
+``manage.py ensure_indexes``.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from django.conf import settings
+from pydantic import Field, TypeAdapter
+from pydantic_mongo import PydanticObjectId
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from .db import get_repository
+from .models import BehaviorEventRepository, LazyModel
+from .user_model import tenant_for
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 1000  # events per request
+
+
+class Backpressure(Exception):
+    """The buffer stayed full for the whole enqueue timeout."""
+
+
+class BehaviorEventIn(LazyModel):
+    timestamp: datetime
+    type: str = Field(pattern="^(emotion|rule_violation|adherence)$")
+    details: Dict[str, Any] = {}
+    tradeId: Optional[PydanticObjectId] = None
+    sessionId: Optional[PydanticObjectId] = None
+
+
+@lru_cache(maxsize=None)
+def _batch_adapter() -> TypeAdapter:
+    return TypeAdapter(List[BehaviorEventIn])
+
+
+@lru_cache(maxsize=4096)
+def _tenant(user_id: str) -> dict:
+    # A user's org is set at registration and never changes; saves a lookup per batch.
+    return tenant_for(user_id)
+
+
+def _utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def prepare(user_id, events: List[dict]) -> List[dict]:
+    """Validate a batch and build the documents to insert.
+
+    Raises ``pydantic.ValidationError``; error locations start with the
+    event's index in the batch. Naive timestamps are taken as UTC.
+    """
+    now = datetime.now(timezone.utc)
+    tenant = _tenant(str(user_id))
+    return [
+        dict(event.model_dump(), _id=ObjectId(), tenant=tenant, timestamp=_utc(event.timestamp),
+             audit={'createdAt': now, 'updatedAt': None, 'deletedAt': None})
+        for event in _batch_adapter().validate_python(events)
+    ]
+
+
+def _collection():
+    return get_repository(BehaviorEventRepository).get_collection()
+
+
+class EventWriter:
+    """Buffers documents in process and writes them with ``insert_many`` on size or age."""
+
+    def __init__(self, batch_size: int, flush_seconds: float, max_pending: int):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_pending = max(max_pending, batch_size, MAX_BATCH)  # room for at least one request's batch
+        self.stats = {'written': 0, 'failed': 0, 'rejected': 0, 'batches': 0}
+        self._reset()
+
+    def _reset(self):
+        self._condition = threading.Condition()
+        self._pending = deque()
+        self._oldest = None  # monotonic arrival time of the oldest pending event
+        self._thread = None
+        self._pid = None
+
+    def reset_after_fork(self):
+        # The flusher thread does not survive a fork, and the parent writes its own buffer.
+        self._reset()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def submit(self, documents: List[dict], timeout: Optional[float] = None):
+        """Queue ``documents``; waits up to ``timeout`` seconds for room, then raises ``Backpressure``."""
+        if not documents:
+            return
+        if self.flush_seconds <= 0:
+            self._insert(documents)
+            return
+        if len(documents) > self.max_pending:
+            raise ValueError(f"A batch of {len(documents)} exceeds the buffer size {self.max_pending}")
+        with self._condition:
+            self._start()
+            if not self._condition.wait_for(lambda: len(self._pending) + len(documents) <= self.max_pending,
+                                            timeout):
+                self.stats['rejected'] += len(documents)
+                raise Backpressure(f"{len(self._pending)} behavior events are waiting to be written")
+            was_empty = not self._pending
+            if was_empty:
+                self._oldest = time.monotonic()
+            self._pending.extend(documents)
+            if was_empty or len(self._pending) >= self.batch_size:
+                self._condition.notify_all()  # the flusher sleeps without a timeout while the buffer is empty
+
+    def flush(self):
+        """Write everything buffered, in the calling thread."""
+        while True:
+            with self._condition:
+                if not self._pending:
+                    return
+                batch = self._take()
+            self._insert(batch)
+
+    def _start(self):
+        # Called with the condition held; (re)starts the flusher in this process.
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='behavior-event-writer', daemon=True)
+        self._thread.start()
+
+    def _take(self) -> List[dict]:
+        batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+        if not self._pending:
+            self._oldest = None
+        self._condition.notify_all()  # room for submitters waiting on backpressure
+        return batch
+
+    def _due(self) -> Optional[float]:
+        """Seconds until the buffer should be written: 0 now, None when empty."""
+        if len(self._pending) >= self.batch_size:
+            return 0
+        if not self._pending:
+            return None
+        return max(self._oldest + self.flush_seconds - time.monotonic(), 0)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._due() != 0:
+                    self._condition.wait(self._due())
+                batch = self._take()
+            try:
+                self._insert(batch)
+            except PyMongoError:
+                pass  # logged and counted by _insert; the flusher keeps going
+
+    def _insert(self, batch: List[dict]):
+        try:
+            _collection().insert_many(batch, ordered=False)
+        except BulkWriteError as exc:
+            written = exc.details.get('nInserted', 0)
+            self._count(written, len(batch) - written)
+            logger.error("%d of %d behavior events were not written: %s", len(batch) - written, len(batch),
+                         exc.details.get('writeErrors', [])[:1])
+            raise
+        except PyMongoError:
+            self._count(0, len(batch))
+            logger.exception("Writing %d behavior events failed", len(batch))
+            raise
+        self._count(len(batch), 0)
+
+    def _count(self, written: int, failed: int):
+        with self._condition:
+            self.stats['written'] += written
+            self.stats['failed'] += failed
+            self.stats['batches'] += 1
+
+
+writer = EventWriter(settings.BEHAVIOR_EVENT_BATCH_SIZE, settings.BEHAVIOR_EVENT_FLUSH_SECONDS,
+                     settings.BEHAVIOR_EVENT_MAX_PENDING)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=writer.reset_after_fork)
+
+
+@atexit.register
+def _drain():
+    try:
+        writer.flush()
+    except PyMongoError:
+        pass  # already logged
+
+
+def ingest(user_id, events: List[dict]) -> int:
+    """Validate a batch and queue it for writing; returns the number accepted.
+
+    Raises ``pydantic.ValidationError`` and ``Backpressure``.
+    """
+    documents = prepare(user_id, events)
+    writer.submit(documents, settings.BEHAVIOR_EVENT_ENQUEUE_TIMEOUT)
+    return len(documents)
@@ -0,0 +1,229 @@
+"""Content-addressed blob storage for attachments.
+
+A blob is named by the SHA-256 of its bytes, so storing identical content
+twice keeps one copy. Uploads are streamed through ``HashingReader`` in
+``CHUNK_SIZE`` pieces into a temporary name, hashed on the way, and only
+then moved to their checksum (or dropped, when that content is already
+stored); nothing holds a whole file in memory.
+
+Two backends, chosen by ``settings.BLOB_BACKEND``:
+
+- ``gridfs``: a GridFS bucket in the app database, where the file name is
+  the checksum; works wherever MongoDB does, including serverless deploys;
+- ``filesystem``: files under ``settings.BLOB_DIR`` fanned out by checksum
+  prefix, moved into place with an atomic rename.
+
+Blobs are never deleted when an attachment is; ``collect_garbage`` in
+``main_app.attachments`` removes those no attachment has referred to for a
+grace period (storing existing content again restarts it).
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import BinaryIO, Iterator, NamedTuple, Optional, Tuple
+
+from bson import ObjectId
+from django.conf import settings
+from gridfs import GridFSBucket
+from gridfs.errors import NoFile
+
+from .db import get_database
+
+CHUNK_SIZE = 255 * 1024  # GridFS's default chunk size
+CHECKSUM = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BlobNotFound(Exception):
+    pass
+
+
+class BlobTooLarge(Exception):
+    pass
+
+
+class StoredBlob(NamedTuple):
+    checksum: str
+    size: int
+    created: bool  # False: the same content was already stored
+
+
+class HashingReader:
+    """Wraps an upload stream, hashing and counting what is read; stops past ``max_size`` bytes."""
+
+    def __init__(self, stream, max_size: Optional[int] = None):
+        self.stream = stream
+        self.max_size = max_size
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = CHUNK_SIZE) -> bytes:
+        data = self.stream.read(size if size and size > 0 else CHUNK_SIZE)
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise BlobTooLarge(f"Larger than {self.max_size} bytes")
+        self.hash.update(data)
+        return data
+
+    def chunks(self) -> Iterator[bytes]:
+        while True:
+            data = self.read(CHUNK_SIZE)
+            if not data:
+                return
+            yield data
+
+    @property
+    def checksum(self) -> str:
+        return self.hash.hexdigest()
+
+
+def _checked(checksum: str) -> str:
+    if not CHECKSUM.match(checksum or ''):
+        raise BlobNotFound(checksum)
+    return checksum
+
+
+class FileSystemBlobStore:
+    def __init__(self, root):
+        self.root = Path(root)
+        self.incoming = self.root / 'incoming'
+
+    def path(self, checksum: str) -> Path:
+        checksum = _checked(checksum)
+        return self.root / checksum[:2] / checksum[2:4] / checksum
+
+    def save(self, stream, max_size: Optional[int] = None) -> StoredBlob:
+        self.incoming.mkdir(parents=True, exist_ok=True)
+        reader = HashingReader(stream, max_size)
+        descriptor, temporary = tempfile.mkstemp(dir=self.incoming)
+        try:
+            with os.fdopen(descriptor, 'wb') as target:
+                for chunk in reader.chunks():
+                    target.write(chunk)
+            path = self.path(reader.checksum)
+            if path.exists():
+                os.unlink(temporary)
+                os.utime(path)  # just referenced again: keep it out of garbage collection's grace window
+                return StoredBlob(reader.checksum, reader.size, False)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(temporary, path)  # atomic; a concurrent identical upload just replaces equal bytes
+        except BaseException:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            raise
+        return StoredBlob(reader.checksum, reader.size, True)
+
+    def open(self, checksum: str) -> Tuple[BinaryIO, int]:
+        """A seekable file of the blob and its size."""
+        try:
+            blob = open(self.path(checksum), 'rb')
+        except FileNotFoundError:
+            raise BlobNotFound(checksum)
+        return blob, os.fstat(blob.fileno()).st_size
+
+    def exists(self, checksum: str) -> bool:
+        return self.path(checksum).exists()
+
+    def delete(self, checksum: str):
+        try:
+            os.unlink(self.path(checksum))
+        except FileNotFoundError:
+            pass
+
+    def stored_before(self, cutoff: datetime) -> Iterator[str]:
+        """Checksums of blobs stored (or stored again) before ``cutoff``."""
+        cutoff = cutoff.timestamp()
+        for path in self.root.glob('??/??/*'):
+            if CHECKSUM.match(path.name) and path.stat().st_mtime < cutoff:
+                yield path.name
+
+    def discard_incoming(self, cutoff: datetime) -> int:
+        """Remove uploads abandoned before ``cutoff``."""
+        discarded = 0
+        for path in self.incoming.glob('*'):
+            if path.stat().st_mtime < cutoff.timestamp():
+                path.unlink(missing_ok=True)
+                discarded += 1
+        return discarded
+
+
+class GridFSBlobStore:
+    def __init__(self, bucket_name: str = 'blobs'):
+        self.bucket_name = bucket_name
+
+    def _bucket(self):
+        return GridFSBucket(get_database(), self.bucket_name, chunk_size_bytes=CHUNK_SIZE)
+
+    def _files(self):
+        return get_database()[f'{self.bucket_name}.files']
+
+    def save(self, stream, max_size: Optional[int] = None) -> StoredBlob:
+        bucket = self._bucket()
+        reader = HashingReader(stream, max_size)
+        # GridIn reads the stream chunk by chunk; an exception aborts the upload and removes its chunks.
+        file_id = bucket.upload_from_stream(f'incoming-{ObjectId()}', reader)
+        existing = self._files().update_many({'filename': reader.checksum},
+                                             {'$set': {'uploadDate': datetime.now(timezone.utc)}})
+        if existing.matched_count:
+            bucket.delete(file_id)
+            return StoredBlob(reader.checksum, reader.size, False)
+        bucket.rename(file_id, reader.checksum)
+        return StoredBlob(reader.checksum, reader.size, True)
+
+    def open(self, checksum: str) -> Tuple[BinaryIO, int]:
+        try:
+            blob = self._bucket().open_download_stream_by_name(_checked(checksum))
+        except NoFile:
+            raise BlobNotFound(checksum)
+        return blob, blob.length
+
+    def exists(self, checksum: str) -> bool:
+        return self._files().find_one({'filename': _checked(checksum)}, {'_id': 1}) is not None
+
+    def delete(self, checksum: str):
+        bucket = self._bucket()
+        for document in self._files().find({'filename': _checked(checksum)}, {'_id': 1}):
+            bucket.delete(document['_id'])
+
+    def stored_before(self, cutoff: datetime) -> Iterator[str]:
+        """Checksums of blobs stored (or stored again) before ``cutoff``."""
+        for document in self._files().find({'uploadDate': {'$lt': cutoff}}, {'filename': 1}):
+            if CHECKSUM.match(document['filename']):
+                yield document['filename']
+
+    def discard_incoming(self, cutoff: datetime) -> int:
+        """Remove uploads abandoned before ``cutoff``."""
+        bucket = self._bucket()
+        discarded = 0
+        for document in self._files().find({'filename': {'$regex': '^incoming-'}, 'uploadDate': {'$lt': cutoff}},
+                                           {'_id': 1}):
+            bucket.delete(document['_id'])
+            discarded += 1
+        return discarded
+
+
+@lru_cache(maxsize=None)
+def blob_store():
+    if settings.BLOB_BACKEND == 'filesystem':
+        return FileSystemBlobStore(settings.BLOB_DIR)
+    if settings.BLOB_BACKEND == 'gridfs':
+        return GridFSBlobStore()
+    raise ValueError(f"Unknown BLOB_BACKEND: {settings.BLOB_BACKEND}")
+
+
+def read_range(blob: BinaryIO, start: int, length: int) -> Iterator[bytes]:
+    """``length`` bytes of ``blob`` from ``start`` in chunks; closes the blob when done or abandoned."""
+    try:
+        blob.seek(start)
+        while length > 0:
+            data = blob.read(min(CHUNK_SIZE, length))
+            if not data:
+                return
+            length -= len(data)
+            yield data
+    finally:
+        blob.close()
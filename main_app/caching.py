@@ -0,0 +1,200 @@
+"""Response and fragment caching keyed on tenant and data version.
+
+Dashboard pages and API reads depend only on one user's data, and every
+write to it bumps a counter in ``data_versions`` (``main_app.versions``).
+ETags and cache keys carry the user's id and the counters of the scopes a
+response reads, so a client's copy or a cached fragment stays valid exactly
+until the next write. Nothing is purged: stale entries stop being asked for
+and age out of the backend.
+
+- ``conditional`` gives views an ETag and Last-Modified and answers a
+  matching ``If-None-Match``/``If-Modified-Since`` with 304 before the view
+  runs, so an unchanged dashboard costs one ``data_versions`` read.
+- ``cached_fragment`` keeps rendered template fragments in Django's cache.
+
+The backend is Django's ``CACHES`` (``settings.CACHE_BACKEND``): the
+local-memory LRU, files, Redis, or ``MongoCache`` below, a shared stand-in
+for Redis on deployments that only have MongoDB. Keys are prefixed with
+``settings.CACHE_RELEASE``, so a deploy never serves old templates.
+"""
+
+import pickle
+from calendar import timegm
+from datetime import datetime, timezone
+from functools import wraps
+from hashlib import blake2b
+from typing import Callable, Iterable, Optional, Tuple
+
+from asgiref.sync import iscoroutinefunction
+from bson import Binary
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.utils.safestring import SafeString, mark_safe
+from pymongo.errors import DuplicateKeyError
+
+from .db import get_repository
+from .models import CacheEntryRepository
+from .versions import DataStamp, adata_stamp, data_stamp
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def request_stamp(request, user_id) -> DataStamp:
+    """The user's data stamp, read once per request."""
+    if getattr(request, '_data_stamp', None) is None:
+        request._data_stamp = data_stamp(user_id)
+    return request._data_stamp
+
+
+async def arequest_stamp(request, user_id) -> DataStamp:
+    if getattr(request, '_data_stamp', None) is None:
+        request._data_stamp = await adata_stamp(user_id)
+    return request._data_stamp
+
+
+def validators(request, user_id, scopes: Tuple[str, ...], stamp: DataStamp) -> Tuple[str, Optional[int]]:
+    """(ETag, Last-Modified timestamp) of this URL for this user at this data version."""
+    identity = (str(user_id), scopes, stamp.version(scopes), request.get_full_path(),
+                request.headers.get('Accept', ''), settings.CACHE_RELEASE)
+    etag = '"%s"' % blake2b(repr(identity).encode(), digest_size=16).hexdigest()
+    # updatedAt moves with every scope's bump, so it is never older than the data shown.
+    modified = timegm(stamp.updated_at.utctimetuple()) if stamp.updated_at else None
+    return etag, modified
+
+
+def _finish(response, etag: str, modified: Optional[int]):
+    if response.status_code in (200, 304):
+        if not response.has_header('ETag'):
+            response['ETag'] = etag
+        if modified and not response.has_header('Last-Modified'):
+            response['Last-Modified'] = http_date(modified)
+    # Clients may keep the copy, but must ask (cheaply) before reusing it.
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def conditional(*scopes: str):
+    """Conditional GET for a sync or async view whose output depends on ``scopes`` of the user's data.
+
+    Anonymous requests and unsafe methods go straight to the view.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                user = await request.auser()
+                if request.method not in SAFE_METHODS or not user.is_authenticated:
+                    return await view(request, *args, **kwargs)
+                etag, modified = validators(request, user.id, scopes, await arequest_stamp(request, user.id))
+                response = get_conditional_response(request, etag=etag, last_modified=modified)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return _finish(response, etag, modified)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            user = request.user
+            if request.method not in SAFE_METHODS or not user.is_authenticated:
+                return view(request, *args, **kwargs)
+            etag, modified = validators(request, user.id, scopes, request_stamp(request, user.id))
+            response = get_conditional_response(request, etag=etag, last_modified=modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return _finish(response, etag, modified)
+        return wrapper
+    return decorator
+
+
+def fragment_key(name: str, user_id, scopes: Iterable[str], stamp: DataStamp) -> str:
+    return 'fragment:%s:%s:%s' % (name, user_id, '.'.join(str(count) for count in stamp.version(scopes)))
+
+
+def cached_fragment(request, user_id, name: str, scopes: Tuple[str, ...], render: Callable[[], str]) -> SafeString:
+    """``render()``'s HTML, rendered once per user and data version."""
+    key = fragment_key(name, user_id, scopes, request_stamp(request, user_id))
+    content = cache.get(key)
+    if content is None:
+        content = render()
+        cache.set(key, content)
+    return mark_safe(content)
+
+
+async def acached_fragment(request, user_id, name: str, scopes: Tuple[str, ...], render) -> SafeString:
+    """Async ``cached_fragment``; ``render`` is a coroutine function."""
+    key = fragment_key(name, user_id, scopes, await arequest_stamp(request, user_id))
+    content = await cache.aget(key)
+    if content is None:
+        content = await render()
+        await cache.aset(key, content)
+    return mark_safe(content)
+
+
+class MongoCache(BaseCache):
+    """Django cache backend over the ``cache_entries`` collection.
+
+    Values are pickled into documents keyed by the cache key; a TTL index on
+    ``expiresAt`` deletes expired ones. The TTL monitor runs about once a
+    minute, so reads check the expiry too.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+
+    def _collection(self):
+        return get_repository(CacheEntryRepository).get_collection()
+
+    def _expires_at(self, timeout) -> Optional[datetime]:
+        expires = self.get_backend_timeout(timeout)
+        return None if expires is None else datetime.fromtimestamp(expires, timezone.utc)
+
+    @staticmethod
+    def _live(now: datetime) -> dict:
+        return {'$or': [{'expiresAt': None}, {'expiresAt': {'$gt': now}}]}
+
+    @staticmethod
+    def _document(value, expires_at: Optional[datetime]) -> dict:
+        return {'value': Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)), 'expiresAt': expires_at}
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = datetime.now(timezone.utc)
+        try:
+            # Matches only an expired entry; a live one makes the upsert collide on _id.
+            self._collection().update_one({'_id': key, 'expiresAt': {'$lte': now}},
+                                          {'$set': self._document(value, self._expires_at(timeout))}, upsert=True)
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        document = self._collection().find_one({'_id': key, **self._live(datetime.now(timezone.utc))})
+        return default if document is None else pickle.loads(document['value'])
+
+    def get_many(self, keys, version=None):
+        keys = {self.make_and_validate_key(key, version=version): key for key in keys}
+        documents = self._collection().find({'_id': {'$in': list(keys)}, **self._live(datetime.now(timezone.utc))})
+        return {keys[document['_id']]: pickle.loads(document['value']) for document in documents}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._collection().update_one({'_id': key}, {'$set': self._document(value, self._expires_at(timeout))},
+                                      upsert=True)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        result = self._collection().update_one({'_id': key, **self._live(datetime.now(timezone.utc))},
+                                               {'$set': {'expiresAt': self._expires_at(timeout)}})
+        return result.matched_count == 1
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._collection().delete_one({'_id': key}).deleted_count == 1
+
+    def clear(self):
+        self._collection().delete_many({})
@@ -0,0 +1,165 @@
+"""Cohort breakdowns computed inside MongoDB with aggregation pipelines.
+
+``cohort_pipeline`` builds a single ``$match`` + ``$facet`` pipeline with one
+``$unwind``/``$group`` branch per multi-valued tag field, so only one row per
+(cohort, tag) leaves the server. ``python_cohort_stats`` computes the same
+rows from raw documents; it is the fallback for servers or local stand-ins
+(mongomock) that lack ``$facet``/``$setWindowFields``.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+from .analytics import RUIN_UNITS
+from .db import get_repository
+from .models import TradeRepository
+
+# Cohort name -> multi-valued TradeSchema field.
+COHORT_FIELDS = {
+    'byStrategy': 'strategyTag',
+    'byRegime': 'regimeTagIds',
+    'byMarketSentiment': 'marketSentimentTag',
+}
+
+STAT_NAMES = ('n', 'sum', 'sumSq', 'wins', 'losses', 'grossWin', 'grossLoss', 'maxDrawdown')
+
+
+def _when(condition, value):
+    return {'$cond': [condition, value, 0]}
+
+
+def trade_match(user_id, start: Optional[datetime] = None, end: Optional[datetime] = None) -> dict:
+    match = {'tenant.userId': ObjectId(user_id), 'status': 'CLOSED', 'realizedPnL': {'$ne': None}}
+    if start or end:
+        match['closeTs'] = {key: value for key, value in (('$gte', start), ('$lt', end)) if value}
+    return match
+
+
+def cohort_pipeline(user_id, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                    cohorts: Dict[str, str] = COHORT_FIELDS) -> List[dict]:
+    pnl = '$realizedPnL'
+    facets = {}
+    for cohort, field in cohorts.items():
+        facets[cohort] = [
+            {'$unwind': f'${field}'},
+            # Equity curve per tag, then its running peak (floored at the starting balance).
+            {'$setWindowFields': {
+                'partitionBy': f'${field}',
+                'sortBy': {'closeTs': 1, '_id': 1},
+                'output': {'equity': {'$sum': pnl, 'window': {'documents': ['unbounded', 'current']}}},
+            }},
+            {'$setWindowFields': {
+                'partitionBy': f'${field}',
+                'sortBy': {'closeTs': 1, '_id': 1},
+                'output': {'peak': {'$max': '$equity', 'window': {'documents': ['unbounded', 'current']}}},
+            }},
+            {'$group': {
+                '_id': f'${field}',
+                'n': {'$sum': 1},
+                'sum': {'$sum': pnl},
+                'sumSq': {'$sum': {'$multiply': [pnl, pnl]}},
+                'wins': {'$sum': _when({'$gt': [pnl, 0]}, 1)},
+                'losses': {'$sum': _when({'$lt': [pnl, 0]}, 1)},
+                'grossWin': {'$sum': _when({'$gt': [pnl, 0]}, pnl)},
+                'grossLoss': {'$sum': _when({'$lt': [pnl, 0]}, {'$multiply': [pnl, -1]})},
+                'maxDrawdown': {'$max': {'$subtract': [{'$max': ['$peak', 0]}, '$equity']}},
+            }},
+            {'$sort': {'_id': 1}},
+        ]
+    projection = {field: 1 for field in cohorts.values()}
+    projection.update({'realizedPnL': 1, 'closeTs': 1})
+    return [
+        {'$match': trade_match(user_id, start, end)},
+        {'$project': projection},
+        {'$facet': facets},
+    ]
+
+
+def python_cohort_stats(documents: Iterable[dict], cohorts: Dict[str, str] = COHORT_FIELDS) -> Dict[str, List[dict]]:
+    """Same output as running ``cohort_pipeline``, computed client-side."""
+    documents = sorted(documents, key=lambda doc: (doc.get('closeTs') or datetime.min, doc['_id']))
+    result = {}
+    for cohort, field in cohorts.items():
+        groups = defaultdict(lambda: dict.fromkeys(STAT_NAMES, 0) | {'equity': 0.0, 'peak': 0.0})
+        for document in documents:
+            pnl = document['realizedPnL']
+            for tag in document.get(field) or []:
+                stats = groups[tag]
+                stats['n'] += 1
+                stats['sum'] += pnl
+                stats['sumSq'] += pnl * pnl
+                stats['wins'] += pnl > 0
+                stats['losses'] += pnl < 0
+                stats['grossWin'] += max(pnl, 0)
+                stats['grossLoss'] += max(-pnl, 0)
+                stats['equity'] += pnl
+                stats['peak'] = max(stats['peak'], stats['equity'])
+                stats['maxDrawdown'] = max(stats['maxDrawdown'], stats['peak'] - stats['equity'])
+        result[cohort] = [
+            dict({name: stats[name] for name in STAT_NAMES}, _id=tag)
+            for tag, stats in sorted(groups.items(), key=lambda item: str(item[0]))
+        ]
+    return result
+
+
+def metrics_from_stats(stats: dict, ruin_units: int = RUIN_UNITS) -> dict:
+    """AnalyticsMetrics-shaped dict from one group of sufficient statistics."""
+    n, wins, losses = stats['n'], stats['wins'], stats['losses']
+    if not n:
+        return dict.fromkeys(('winRate', 'expectancy', 'drawdown', 'riskOfRuin', 'sharpeLike', 'mae', 'mfe',
+                              'screenMinutes'))
+    mean = stats['sum'] / n
+    std = max(stats['sumSq'] / n - mean * mean, 0.0) ** 0.5
+    if not losses:
+        ruin = 0.0
+    elif not wins:
+        ruin = 1.0
+    else:
+        win_rate = wins / n
+        payoff = (stats['grossWin'] / wins) / (stats['grossLoss'] / losses)
+        edge = min(max(win_rate * payoff - (1 - win_rate), 0.0), 1.0)
+        ruin = ((1 - edge) / (1 + edge)) ** ruin_units
+    return {
+        'winRate': wins / n,
+        'expectancy': mean,
+        'drawdown': stats['maxDrawdown'],
+        'riskOfRuin': ruin,
+        'sharpeLike': mean / std if std > 0 else None,
+        'mae': None,
+        'mfe': None,
+        'screenMinutes': None,
+    }
+
+
+def fetch_cohort_stats(user_id, start=None, end=None, cohorts: Dict[str, str] = COHORT_FIELDS,
+                       backend: str = 'auto') -> Dict[str, List[dict]]:
+    """Grouped statistics per cohort and tag.
+
+    ``backend`` is ``'mongo'`` (aggregation only), ``'python'`` (fetch the
+    projected trades and group client-side) or ``'auto'`` (aggregation,
+    falling back to Python when the server rejects the pipeline).
+    """
+    collection = get_repository(TradeRepository).get_collection()
+    if backend in ('auto', 'mongo'):
+        try:
+            return next(collection.aggregate(cohort_pipeline(user_id, start, end, cohorts)))
+        except (OperationFailure, NotImplementedError):
+            if backend == 'mongo':
+                raise
+    projection = {field: 1 for field in cohorts.values()}
+    projection.update({'realizedPnL': 1, 'closeTs': 1})
+    return python_cohort_stats(collection.find(trade_match(user_id, start, end), projection), cohorts)
+
+
+def cohort_breakdown(user_id, start=None, end=None, cohorts: Dict[str, str] = COHORT_FIELDS,
+                     backend: str = 'auto') -> Dict[str, Dict[str, dict]]:
+    """{cohort: {tag: AnalyticsMetrics dict}} for a user's closed trades."""
+    grouped = fetch_cohort_stats(user_id, start, end, cohorts, backend)
+    return {
+        cohort: {str(row['_id']): metrics_from_stats(row) for row in rows}
+        for cohort, rows in grouped.items()
+    }
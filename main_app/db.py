@@ -0,0 +1,332 @@
+"""Process-wide MongoDB connection manager shared by every repository.
+
+``connection_manager`` serves blocking pymongo to sync code;
+``async_connection_manager`` serves ``AsyncMongoClient`` to async views,
+with async twins of the same repository classes (``get_async_repository``).
+"""
+
+import asyncio
+import os
+import threading
+import weakref
+from functools import lru_cache
+from datetime import date, datetime
+from typing import Dict, List, Optional, Type, TypeVar
+
+from django.conf import settings
+from pymongo import monitoring
+
+T = TypeVar('T')
+
+
+def encode_fallback(value):
+    """BSON has no date type; store ``date`` fields (expiry, periodStart, ...) as midnight UTC."""
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    return value
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool events so we can report pool usage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counters = {
+            'pools_created': 0,
+            'pools_cleared': 0,
+            'connections_created': 0,
+            'connections_closed': 0,
+            'checkouts': 0,
+            'checkout_failures': 0,
+            'checkins': 0,
+        }
+
+    def _bump(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    def pool_created(self, event):
+        self._bump('pools_created')
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._bump('pools_cleared')
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._bump('connections_created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._bump('connections_closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._bump('checkout_failures')
+
+    def connection_checked_out(self, event):
+        self._bump('checkouts')
+
+    def connection_checked_in(self, event):
+        self._bump('checkins')
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self.counters)
+        stats['open_connections'] = stats['connections_created'] - stats['connections_closed']
+        stats['in_use'] = stats['checkouts'] - stats['checkins']
+        return stats
+
+
+class MongoConnectionManager:
+    """Creates the MongoClient on first use and hands out database handles.
+
+    The client is rebuilt in a forked child instead of being shared with the
+    parent, since pymongo clients are not fork-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client = None
+        self._pid = None
+        self._repositories: Dict[type, object] = {}
+        self.stats = PoolStatsListener()
+
+    def client_options(self) -> dict:
+        return {
+            'maxPoolSize': settings.MONGODB_MAX_POOL_SIZE,
+            'minPoolSize': settings.MONGODB_MIN_POOL_SIZE,
+            'maxIdleTimeMS': settings.MONGODB_MAX_IDLE_TIME_MS,
+            'connectTimeoutMS': settings.MONGODB_CONNECT_TIMEOUT_MS,
+            'serverSelectionTimeoutMS': settings.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+            'socketTimeoutMS': settings.MONGODB_SOCKET_TIMEOUT_MS,
+        }
+
+    def get_client(self):
+        if self._client is not None and self._pid == os.getpid():
+            return self._client
+        with self._lock:
+            if self._client is None or self._pid != os.getpid():
+                from bson.codec_options import TypeRegistry
+                from pymongo.mongo_client import MongoClient
+                from pymongo.server_api import ServerApi
+
+                self._repositories = {}
+                self.stats.reset()
+                self._client = MongoClient(
+                    settings.MONGODB_URI,
+                    server_api=ServerApi('1'),
+                    event_listeners=[self.stats],
+                    type_registry=TypeRegistry(fallback_encoder=encode_fallback),
+                    **self.client_options(),
+                )
+                self._pid = os.getpid()
+        return self._client
+
+    def get_database(self, name: Optional[str] = None):
+        return self.get_client()[name or settings.MONGODB_DB_NAME]
+
+    def get_repository(self, repository_class: Type[T]) -> T:
+        """Return a cached repository instance bound to the default database."""
+        database = self.get_database()
+        repository = self._repositories.get(repository_class)
+        if repository is None:
+            repository = repository_class(database=database)
+            self._repositories[repository_class] = repository
+        return repository
+
+    def pool_stats(self) -> Dict[str, int]:
+        stats = self.stats.snapshot()
+        stats['initialized'] = self._client is not None
+        if self._client is not None:
+            stats['max_pool_size'] = self._client.options.pool_options.max_pool_size
+            stats['min_pool_size'] = self._client.options.pool_options.min_pool_size
+        return stats
+
+    def reset_after_fork(self):
+        # Drop the parent's client without closing it; the parent still owns its sockets.
+        self._client = None
+        self._pid = None
+        self._repositories = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
+            self._pid = None
+            self._repositories = {}
+
+
+connection_manager = MongoConnectionManager()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=connection_manager.reset_after_fork)
+
+
+class AsyncMongoConnectionManager:
+    """One ``AsyncMongoClient`` per event loop, created on first use in that loop.
+
+    The async client is bound to the loop it runs on. An ASGI worker has one
+    loop, so this is one client and one pool per worker; the clients of
+    short-lived loops (``asyncio.run`` in a command) go away with the loop.
+    """
+
+    def __init__(self, sync_manager: MongoConnectionManager):
+        self.sync_manager = sync_manager
+        self._clients = weakref.WeakKeyDictionary()
+        self._repositories = weakref.WeakKeyDictionary()
+
+    def get_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            from bson.codec_options import TypeRegistry
+            from pymongo import AsyncMongoClient
+            from pymongo.server_api import ServerApi
+
+            client = AsyncMongoClient(
+                settings.MONGODB_URI,
+                server_api=ServerApi('1'),
+                event_listeners=[self.sync_manager.stats],
+                type_registry=TypeRegistry(fallback_encoder=encode_fallback),
+                **self.sync_manager.client_options(),
+            )
+            self._clients[loop] = client
+            self._repositories[loop] = {}
+        return client
+
+    def get_database(self, name: Optional[str] = None):
+        return self.get_client()[name or settings.MONGODB_DB_NAME]
+
+    def get_repository(self, repository_class: Type[T]):
+        """The async twin of a sync repository class, bound to this loop's client."""
+        database = self.get_database()
+        repositories = self._repositories[asyncio.get_running_loop()]
+        repository = repositories.get(repository_class)
+        if repository is None:
+            repository = async_repository_class(repository_class)(database=database)
+            repositories[repository_class] = repository
+        return repository
+
+    def reset_after_fork(self):
+        self._clients = weakref.WeakKeyDictionary()
+        self._repositories = weakref.WeakKeyDictionary()
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.pop(loop, None)
+        self._repositories.pop(loop, None)
+        if client is not None:
+            await client.close()
+
+
+@lru_cache(maxsize=None)
+def async_repository_class(repository_class):
+    """``AsyncAbstractRepository`` subclass with the same model, collection and indexes."""
+    from pydantic_mongo import AsyncAbstractRepository
+
+    document_class = repository_class.__orig_bases__[0].__args__[0]
+    meta = type('Meta', (repository_class.Meta,), {'document_class': document_class})
+    return type(f'Async{repository_class.__name__}', (AsyncAbstractRepository,), {
+        'Meta': meta, '__module__': repository_class.__module__,
+    })
+
+
+async_connection_manager = AsyncMongoConnectionManager(connection_manager)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=async_connection_manager.reset_after_fork)
+
+
+def get_client():
+    return connection_manager.get_client()
+
+
+def get_database(name: Optional[str] = None):
+    return connection_manager.get_database(name)
+
+
+def get_repository(repository_class: Type[T]) -> T:
+    return connection_manager.get_repository(repository_class)
+
+
+def get_async_database(name: Optional[str] = None):
+    return async_connection_manager.get_database(name)
+
+
+def get_async_repository(repository_class: Type[T]):
+    """Async counterpart of ``get_repository``; pass the sync repository class."""
+    return async_connection_manager.get_repository(repository_class)
+
+
+def pool_stats() -> Dict[str, int]:
+    return connection_manager.pool_stats()
+
+
+def repository_classes():
+    """Every repository whose Meta may declare indexes."""
+    from .models import (
+        AnalyticsSnapshotRepository, AttachmentRepository, BehaviorEventRepository, CacheEntryRepository,
+        DataVersionRepository, ImportJobRepository, JournalEntryRepository, MarketFactorRepository,
+        NotebookNoteRepository, PositionRepository, RegimeRepository, SessionRepository, TradeRepository,
+    )
+    from .user_model import UserRepository
+
+    return [
+        UserRepository, TradeRepository, JournalEntryRepository, NotebookNoteRepository,
+        MarketFactorRepository, AnalyticsSnapshotRepository, AttachmentRepository,
+        SessionRepository, BehaviorEventRepository, ImportJobRepository, PositionRepository,
+        DataVersionRepository, RegimeRepository, CacheEntryRepository,
+    ]
+
+
+def index_models(repository_class) -> List:
+    from pymongo import IndexModel
+
+    models = []
+    for spec in getattr(repository_class.Meta, 'indexes', []):
+        options = {key: value for key, value in spec.items() if key != 'keys'}
+        keys = spec['keys']
+        options.setdefault('name', '_'.join(f'{field}_{direction}' for field, direction in keys))
+        models.append(IndexModel(keys, **options))
+    return models
+
+
+def ensure_collection(repository_class) -> Optional[str]:
+    """Create a collection declared with ``Meta.timeseries`` as a time-series collection.
+
+    Returns ``'created'``, ``'timeseries'`` when it already is one, ``'regular'``
+    when it exists as a plain collection (which cannot be converted in place),
+    or None for collections without special options.
+    """
+    options = getattr(repository_class.Meta, 'timeseries', None)
+    if not options:
+        return None
+    database = get_database()
+    name = repository_class.Meta.collection_name
+    existing = list(database.list_collections(filter={'name': name}))
+    if existing:
+        return 'timeseries' if existing[0].get('type') == 'timeseries' else 'regular'
+    database.create_collection(name, timeseries=options)
+    return 'created'
+
+
+def ensure_indexes(repository_class) -> List[str]:
+    """Create the indexes declared on ``repository_class.Meta``; existing ones are left alone."""
+    models = index_models(repository_class)
+    if not models:
+        return []
+    return get_repository(repository_class).get_collection().create_indexes(models)
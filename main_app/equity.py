@@ -0,0 +1,182 @@
+"""Equity curve, drawdown and Monte Carlo risk of ruin per tenant.
+
+The curve is the cumulative realized P&L of a user's closed trades in close
+order (``analytics.load_trade_columns``). Peak, drawdown and time under
+water come from one ``np.maximum.accumulate`` pass each; the peak is
+floored at the starting balance, as in the snapshot metrics.
+
+Risk of ruin resamples the trade P&L distribution with replacement. Paths
+are simulated in fixed-size chunks, each with its own child of one
+``SeedSequence``, so a given seed gives the same answer whether the chunks
+run inline or on a process pool of any size. Requests simulate inline
+within ``EQUITY_MC_MAX_STEPS`` resampled trades; only
+``manage.py simulate_ruin`` uses a process pool.
+
+Curves (and simulations) are cached per user in-process and keyed on the
+user's data version (``main_app.versions``), which trade writes bump.
+"""
+
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+import numpy as np
+from django.conf import settings
+
+from .analytics import RUIN_UNITS, load_trade_columns
+from .versions import data_version
+
+CHUNK_PATHS = 2_000
+HORIZON_BLOCK = 512
+MIN_PATHS = 100
+
+
+class EquityCurve:
+    """Cumulative P&L series of one user with drawdown statistics."""
+
+    def __init__(self, timestamps: np.ndarray, pnl: np.ndarray):
+        self.timestamps = timestamps
+        self.pnl = pnl
+        self.equity = np.cumsum(pnl)
+        self.peak = np.maximum(np.maximum.accumulate(self.equity), 0.0) if len(pnl) else self.equity
+        self.drawdown = self.peak - self.equity
+        # Index of the last point at (or above) the running peak; before any new high, the first trade.
+        at_peak = np.where(self.drawdown <= 0, np.arange(len(pnl)), 0)
+        self.last_peak = np.maximum.accumulate(at_peak) if len(pnl) else at_peak
+
+    @classmethod
+    def for_user(cls, user_id) -> 'EquityCurve':
+        columns = load_trade_columns(user_id)
+        return cls(columns.close_ts, columns.pnl)
+
+    def __len__(self):
+        return len(self.pnl)
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        if not len(self):
+            return {'trades': 0, 'netPnL': 0.0, 'maxDrawdown': None, 'maxDrawdownDurationDays': None,
+                    'currentDrawdown': None, 'sharpeLike': None}
+        underwater = (self.timestamps - self.timestamps[self.last_peak]) / np.timedelta64(1, 'D')
+        std = self.pnl.std()
+        return {
+            'trades': len(self),
+            'netPnL': float(self.equity[-1]),
+            'maxDrawdown': float(self.drawdown.max()),
+            'maxDrawdownDurationDays': float(underwater.max()),
+            'currentDrawdown': float(self.drawdown[-1]),
+            'sharpeLike': float(self.pnl.mean() / std) if std > 0 else None,
+        }
+
+    def points(self) -> Dict[str, list]:
+        """Chart series: epoch-millisecond timestamps, equity and drawdown."""
+        return {
+            't': self.timestamps.astype('datetime64[ms]').astype(np.int64).tolist(),
+            'equity': self.equity.tolist(),
+            'drawdown': self.drawdown.tolist(),
+        }
+
+
+def _ruined_paths(pnl: np.ndarray, paths: int, horizon: int, capital: float, seed) -> int:
+    rng = np.random.default_rng(seed)
+    equity = np.zeros(paths)
+    ruined = np.zeros(paths, dtype=bool)
+    for start in range(0, horizon, HORIZON_BLOCK):
+        steps = rng.choice(pnl, size=(paths, min(HORIZON_BLOCK, horizon - start)))
+        curve = equity[:, None] + np.cumsum(steps, axis=1)
+        ruined |= curve.min(axis=1) <= -capital
+        equity = curve[:, -1]
+    return int(ruined.sum())
+
+
+def simulate_ruin(pnl: np.ndarray, paths: int = 10_000, horizon: Optional[int] = None,
+                  capital: Optional[float] = None, seed: int = 0, workers: int = 1,
+                  max_steps: Optional[int] = None) -> Dict:
+    """Share of resampled P&L paths that lose ``capital`` within ``horizon`` trades.
+
+    ``capital`` defaults to RUIN_UNITS average losses and ``horizon`` to the
+    number of trades observed. With ``max_steps``, ``paths * horizon`` is
+    kept within it by simulating fewer paths (at least MIN_PATHS) and then a
+    shorter horizon; the result reports what was simulated. ``workers`` > 1
+    forks a process pool, which is for management commands, not web workers.
+    """
+    pnl = np.asarray(pnl, dtype=np.float64)
+    losses = pnl[pnl < 0]
+    horizon = horizon or len(pnl)
+    if max_steps and paths * horizon > max_steps:
+        paths = min(paths, max(max_steps // max(horizon, 1), MIN_PATHS))
+        horizon = min(horizon, max(max_steps // paths, 1))
+    if capital is None:
+        capital = RUIN_UNITS * float(-losses.mean()) if len(losses) else 0.0
+    result = {'paths': paths, 'horizon': horizon, 'capital': capital, 'seed': seed}
+    if not len(losses) or not horizon:
+        return dict(result, probability=0.0)
+
+    sizes = [min(CHUNK_PATHS, paths - start) for start in range(0, paths, CHUNK_PATHS)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    arguments = [(pnl, size, horizon, capital, child) for size, child in zip(sizes, seeds)]
+    if workers > 1 and len(arguments) > 1:
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=min(workers, len(arguments)), mp_context=context) as pool:
+            ruined = sum(pool.map(_ruined_paths, *zip(*arguments)))
+    else:
+        ruined = sum(_ruined_paths(*args) for args in arguments)
+    return dict(result, probability=ruined / paths)
+
+
+class CurveCache:
+    """LRU of per-user results, each stored with the data version it was built from."""
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        return None
+
+    def put(self, key, version, value):
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+curve_cache = CurveCache(settings.EQUITY_CACHE_SIZE)
+
+
+def equity_curve(user_id, version: Optional[int] = None) -> EquityCurve:
+    """The user's curve, rebuilt only when their trades changed since it was cached."""
+    key = ('curve', str(user_id))
+    version = data_version(user_id) if version is None else version
+    curve = curve_cache.get(key, version)
+    if curve is None:
+        curve = EquityCurve.for_user(user_id)
+        curve_cache.put(key, version, curve)
+    return curve
+
+
+def risk_of_ruin(user_id, paths: int = 10_000, seed: int = 0) -> Dict:
+    """Cached ``simulate_ruin`` for a request: inline, within ``EQUITY_MC_MAX_STEPS``."""
+    key = ('ruin', str(user_id), paths, seed)
+    version = data_version(user_id)
+    result = curve_cache.get(key, version)
+    if result is None:
+        result = simulate_ruin(equity_curve(user_id, version).pnl, paths=paths, seed=seed,
+                               max_steps=settings.EQUITY_MC_MAX_STEPS)
+        curve_cache.put(key, version, result)
+    return result
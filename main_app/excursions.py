@@ -0,0 +1,114 @@
+"""Batch MAE/MFE of trades from the local bar store.
+
+For every trade with an ``openTs``/``closeTs`` window, the underlying's bars
+in that window are located by binary search in the bar store and reduced
+with vectorized min/max. A closing fill's own ``openTs`` is its fill time,
+so its window starts at ``entryTs`` instead: when the earliest lot it closed
+was opened, as matched by the ledger.
+
+Excursions are measured in underlying price points from the first bar's
+open, in the direction of the position's exposure: long calls and short
+puts gain when the underlying rises, long puts and short calls when it
+falls. ``mae`` is the worst move against the position, ``mfe`` the best
+move in its favour, both as non-negative numbers.
+
+Trades are processed symbol by symbol in open-time order, so consecutive
+windows hit the same memory-mapped day files.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from .bars import BarStore
+from .db import get_repository
+from .jobs import enqueue_analytics_rebuild
+from .ledger import CLOSING_SIDES, OPENING_SIDES
+from .models import TradeRepository
+from .versions import bump_data_versions
+
+EXCURSION_PROJECTION = {
+    'tenant': 1, 'instrument.underlying': 1, 'instrument.optionType': 1, 'side': 1, 'openTs': 1, 'closeTs': 1,
+    'entryTs': 1,
+}
+WRITE_BATCH = 10_000
+
+
+def _epoch_ms(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def exposure(side: str, option_type: str) -> int:
+    """+1 if the position profits from the underlying rising, -1 if from it falling."""
+    book = OPENING_SIDES.get(side) or CLOSING_SIDES.get(side)
+    bullish = (book == 'long') == (option_type == 'CALL')
+    return 1 if bullish else -1
+
+
+def window_start(trade: dict) -> Optional[datetime]:
+    return trade.get('entryTs') or trade.get('openTs')
+
+
+def trade_excursion(store: BarStore, trade: dict) -> Optional[Tuple[float, float]]:
+    extremes = store.extremes(trade['instrument']['underlying'], _epoch_ms(window_start(trade)),
+                              _epoch_ms(trade['closeTs']))
+    if extremes is None:
+        return None
+    entry, high, low = extremes
+    up, down = max(high - entry, 0.0), max(entry - low, 0.0)
+    if exposure(trade['side'], trade['instrument']['optionType']) > 0:
+        return down, up
+    return up, down
+
+
+def compute_excursions(trades: Iterable[dict], store: Optional[BarStore] = None) -> Dict[ObjectId, Tuple[float, float]]:
+    """{trade id: (mae, mfe)} for every trade with bars in its window."""
+    store = store or BarStore()
+    by_symbol = defaultdict(list)
+    for trade in trades:
+        start = window_start(trade)
+        if start and trade.get('closeTs') and _epoch_ms(trade['closeTs']) >= _epoch_ms(start):
+            by_symbol[trade['instrument']['underlying'].upper()].append(trade)
+    results = {}
+    for symbol, group in by_symbol.items():
+        if not len(store.days(symbol)):
+            continue
+        group.sort(key=lambda trade: _epoch_ms(window_start(trade)))
+        for trade in group:
+            excursion = trade_excursion(store, trade)
+            if excursion is not None:
+                results[trade['_id']] = excursion
+    return results
+
+
+def update_excursions(user_ids: Optional[List] = None, recompute: bool = False,
+                      store: Optional[BarStore] = None) -> Dict[str, int]:
+    """Fill ``mae``/``mfe`` on closed trades and queue analytics rebuilds for affected users."""
+    query = {'status': 'CLOSED', 'openTs': {'$ne': None}, 'closeTs': {'$ne': None}}
+    if user_ids:
+        query['tenant.userId'] = {'$in': [ObjectId(user_id) for user_id in user_ids]}
+    if not recompute:
+        query['mae'] = None
+    collection = get_repository(TradeRepository).get_collection()
+    trades = list(collection.find(query, EXCURSION_PROJECTION, batch_size=WRITE_BATCH))
+    results = compute_excursions(trades, store)
+
+    operations = [UpdateOne({'_id': trade_id}, {'$set': {'mae': mae, 'mfe': mfe}})
+                  for trade_id, (mae, mfe) in results.items()]
+    for start in range(0, len(operations), WRITE_BATCH):
+        collection.bulk_write(operations[start:start + WRITE_BATCH], ordered=False)
+
+    tenants = {}
+    for trade in trades:
+        if trade['_id'] in results and trade['tenant'].get('userId'):
+            tenants[trade['tenant']['userId']] = trade['tenant']
+    bump_data_versions(tenants)
+    for tenant in tenants.values():
+        enqueue_analytics_rebuild(tenant)
+    return {'trades': len(trades), 'updated': len(operations), 'withoutBars': len(trades) - len(operations),
+            'users': len(tenants)}
@@ -0,0 +1,83 @@
+"""Streaming NDJSON and CSV exports straight from a MongoDB cursor.
+
+The cursor is consumed one batch at a time; each batch is validated and
+dumped by the response schema (``schemas.DocumentSchema``) and handed to
+``StreamingHttpResponse``, so an export of a full history holds one batch
+in memory, never the whole result.
+"""
+
+import csv
+import json
+from itertools import islice
+from typing import Iterable, Iterator, List
+
+from django.http import StreamingHttpResponse
+
+from .schemas import DocumentSchema
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+EXPORT_BATCH_SIZE = 1000
+
+
+class Echo:
+    """File-like object whose ``write`` returns the line, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def batches(cursor, size: int = EXPORT_BATCH_SIZE) -> Iterator[List[dict]]:
+    cursor = iter(cursor)
+    while True:
+        batch = list(islice(cursor, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        if any(isinstance(item, dict) for item in value):
+            return json.dumps(value, separators=(',', ':'))
+        return '|'.join(str(item) for item in value)
+    return value
+
+
+def flatten(row: dict, columns: List[str]) -> list:
+    cells = []
+    for column in columns:
+        value = row
+        for part in column.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        cells.append(_cell(value))
+    return cells
+
+
+def ndjson_chunks(cursor, schema: DocumentSchema, fields=None) -> Iterator[bytes]:
+    for batch in batches(cursor):
+        yield schema.dump_lines(batch, fields)
+
+
+def csv_lines(cursor, schema: DocumentSchema, fields=None) -> Iterator[str]:
+    columns = schema.columns(fields)
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for batch in batches(cursor):
+        yield ''.join(writer.writerow(flatten(row, columns)) for row in schema.rows(batch, fields))
+
+
+def export_response(cursor: Iterable[dict], schema: DocumentSchema, kind: str, filename: str,
+                    fields=None) -> StreamingHttpResponse:
+    """Stream ``cursor`` through ``schema`` as NDJSON or CSV."""
+    if kind == 'csv':
+        content = csv_lines(cursor, schema, fields)
+    else:
+        content = ndjson_chunks(cursor, schema, fields)
+    response = StreamingHttpResponse(content, content_type=EXPORT_FORMATS[kind])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{kind}"'
+    return response
@@ -1,10 +1,12 @@
 
 from typing import Optional
+from uuid import uuid4
 from django import forms
 from django.contrib.auth.hashers import make_password
 from bson import ObjectId
 
-from .user_model import UserSchema, UserRepository, client
+from .db import get_repository
+from .user_model import UserSchema, UserRepository
 from .models import TenantScoped, AuditMeta, Instrument, TradeRepository, TradeSchema, strategy_choices, market_sentiment_choices
 from pydantic import Field
 from typing import List
@@ -44,7 +46,7 @@ class RegistrationForm(forms.Form):
         if not self.is_valid():
             raise ValueError("Form must be valid before saving")
 
-        user_repo = UserRepository(database=client['tradingApp'])
+        user_repo = get_repository(UserRepository)
 
         user_data = UserSchema(
             _id=ObjectId(),
@@ -78,13 +80,21 @@ class TradeForm(forms.Form):
     status = forms.ChoiceField(choices=[('OPEN', 'Open'), ('CLOSED', 'Closed'), ('CANCELLED', 'Cancelled')], required=True, initial='OPEN')
     strategyTag = forms.MultipleChoiceField(required=True, widget=forms.CheckboxSelectMultiple, choices=[(choice, choice) for choice in strategy_choices], label="Strategy Tags")
     marketSentimentTag = forms.MultipleChoiceField(required=False, widget=forms.CheckboxSelectMultiple, choices=[(choice, choice) for choice in market_sentiment_choices], label="Market Sentiment Tags")
+    # Minted when the form is rendered, so resubmitting the same form saves the trade once.
+    idempotencyKey = forms.CharField(widget=forms.HiddenInput, required=False, max_length=64, initial=lambda: uuid4().hex)
     
     def save_to_mongodb(self, user_id):
         """Persist the validated trade to MongoDB using the Pydantic TradeSchema."""
+        # The write pipeline (analytics, ledger) loads NumPy; rendering a form should not.
+        from .idempotency import dedupe_key, upsert_trade
+        from .incremental_analytics import apply_trade_change
+        from .ledger import apply_fill
+        from .versions import bump_data_versions
+
         if not self.is_valid():
             raise ValueError("Form must be valid before saving")
         
-        trade_repo = TradeRepository(database=client['tradingApp'])
+        trade_repo = get_repository(TradeRepository)
         
         # Create instrument
         instrument = Instrument(
@@ -122,6 +132,12 @@ class TradeForm(forms.Form):
             unrealizedPnL=None
         )
         
-        trade_repo.save(trade_data)
+        document = trade_repo.to_document(trade_data)
+        document['dedupeKey'] = dedupe_key(document, self.cleaned_data.get('idempotencyKey'))
+        self.created = upsert_trade(document)
+        if self.created:
+            apply_trade_change(None, document)
+            apply_fill(document)
+            bump_data_versions([user_id])
         return trade_data
 
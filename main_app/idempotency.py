@@ -0,0 +1,107 @@
+"""Idempotent trade writes keyed on ``TradeSchema.dedupeKey``.
+
+Every ingested trade carries a key that is unique per user (partial unique
+index on ``tenant.userId`` + ``dedupeKey``):
+
+* ``ref:<brokerRef>`` when the broker supplied an order/execution id,
+* ``form:<token>`` for manual entry, where the token is minted with the form
+  so a double submit carries the same key,
+* ``sha:<digest>`` otherwise: a SHA-256 over the fields that identify an
+  execution (instrument, side, qty, price, fees, openTs), leaving out
+  everything that changes over the trade's life (status, closeTs, P&L, tags).
+
+Writes are ``UpdateOne(key, {'$setOnInsert': trade}, upsert=True)``, so
+replaying the same rows matches existing documents and writes nothing.
+"""
+
+import hashlib
+import json
+from datetime import date, datetime, timezone
+from typing import List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from .db import get_repository
+from .models import TradeRepository
+
+IDENTITY_FIELDS = ('side', 'qty', 'price', 'fees', 'openTs')
+INSTRUMENT_FIELDS = ('underlying', 'optionType', 'strike', 'expiry')
+DUPLICATE_KEY = 11000
+
+
+def _canonical(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, int) and not isinstance(value, bool):
+        return float(value)  # 400 and 400.0 must hash alike
+    return value
+
+
+def content_hash(trade: dict) -> str:
+    instrument = trade.get('instrument') or {}
+    identity = [_canonical(instrument.get(name)) for name in INSTRUMENT_FIELDS]
+    identity += [_canonical(trade.get(name)) for name in IDENTITY_FIELDS]
+    return hashlib.sha256(json.dumps(identity, separators=(',', ':')).encode()).hexdigest()
+
+
+def dedupe_key(trade: dict, token: Optional[str] = None) -> str:
+    if trade.get('brokerRef'):
+        return f"ref:{trade['brokerRef']}"
+    if token:
+        return f'form:{token}'
+    return f'sha:{content_hash(trade)}'
+
+
+def key_filter(trade: dict) -> dict:
+    return {'tenant.userId': trade['tenant']['userId'], 'dedupeKey': trade['dedupeKey']}
+
+
+def upsert_trades(documents: List[dict]) -> Tuple[List[dict], int, List[dict]]:
+    """Write trades that are not stored yet.
+
+    Documents must already carry ``dedupeKey``. Returns (inserted documents,
+    number of duplicates skipped, write errors). Repeats inside the batch are
+    dropped before the round trip.
+    """
+    unique, seen = [], set()
+    for document in documents:
+        key = (document['tenant']['userId'], document['dedupeKey'])
+        if key not in seen:
+            seen.add(key)
+            unique.append(document)
+    duplicates = len(documents) - len(unique)
+    if not unique:
+        return [], duplicates, []
+
+    operations = [UpdateOne(key_filter(doc), {'$setOnInsert': doc}, upsert=True) for doc in unique]
+    collection = get_repository(TradeRepository).get_collection()
+    errors = []
+    try:
+        result = collection.bulk_write(operations, ordered=False)
+        upserted = result.upserted_ids
+    except BulkWriteError as exc:
+        upserted = {item['index']: item['_id'] for item in exc.details.get('upserted', [])}
+        for error in exc.details.get('writeErrors', []):
+            if error.get('code') == DUPLICATE_KEY:
+                # Lost an upsert race against a concurrent import of the same trade.
+                continue
+            document = unique[error['index']]
+            errors.append({'row': None, 'brokerRef': document.get('brokerRef'), 'error': error.get('errmsg')})
+    inserted = [unique[index] for index in sorted(upserted)]
+    duplicates += len(unique) - len(inserted) - len(errors)
+    return inserted, duplicates, errors
+
+
+def upsert_trade(document: dict) -> bool:
+    """Single-trade variant of ``upsert_trades``; True if the trade was new."""
+    collection = get_repository(TradeRepository).get_collection()
+    try:
+        result = collection.update_one(key_filter(document), {'$setOnInsert': document}, upsert=True)
+    except DuplicateKeyError:
+        return False
+    return result.upserted_id is not None
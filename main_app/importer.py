@@ -0,0 +1,288 @@
+"""Streaming broker CSV import driven by ImportJob documents.
+
+Rows are read lazily with ``csv.DictReader`` and handled in fixed-size
+batches: mapped through the job's column-mapping template, validated into
+``TradeSchema`` and written with one unordered upsert ``bulk_write`` per
+batch (``main_app.idempotency``), so re-importing an overlapping file only
+counts the rows it has already seen as duplicates.
+Memory stays constant however large the file is, and ``ImportJob.stats`` /
+``errors`` are updated once per batch. Queueing, retries and status
+transitions are handled by ``main_app.jobs``.
+"""
+
+import csv
+import io
+from datetime import date, datetime, timezone
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pydantic import ValidationError
+
+from .blobs import BlobNotFound, blob_store
+from .db import get_repository
+from .idempotency import dedupe_key, upsert_trades
+from .models import AttachmentRepository, ImportJobRepository, TradeRepository, TradeSchema
+
+BATCH_SIZE = 5000
+# ImportJob.errors keeps at most this many row errors; the failure count keeps growing.
+MAX_STORED_ERRORS = 1000
+
+SIDE_ALIASES = {
+    'BUY': 'BUY', 'BOT': 'BUY', 'BTO': 'BUY', 'BUY_TO_OPEN': 'BUY',
+    'SELL': 'SELL', 'SLD': 'SELL', 'STC': 'SELL', 'SELL_TO_CLOSE': 'SELL',
+    'SHORT': 'SHORT', 'STO': 'SHORT', 'SELL_TO_OPEN': 'SHORT',
+    'COVER': 'COVER', 'BTC': 'COVER', 'BUY_TO_CLOSE': 'COVER',
+}
+OPTION_TYPE_ALIASES = {'C': 'CALL', 'CALL': 'CALL', 'P': 'PUT', 'PUT': 'PUT'}
+
+# Template: TradeSchema field path -> CSV column, plus parsing options.
+MAPPING_TEMPLATES = {
+    'default': {
+        'columns': {
+            'brokerRef': 'brokerRef',
+            'instrument.underlying': 'underlying',
+            'instrument.optionType': 'optionType',
+            'instrument.strike': 'strike',
+            'instrument.expiry': 'expiry',
+            'side': 'side',
+            'qty': 'qty',
+            'price': 'price',
+            'fees': 'fees',
+            'openTs': 'openTs',
+            'closeTs': 'closeTs',
+            'status': 'status',
+            'strategyTag': 'strategyTag',
+            'marketSentimentTag': 'marketSentimentTag',
+            'realizedPnL': 'realizedPnL',
+        },
+        'defaults': {'status': 'OPEN'},
+        'list_separator': ';',
+    },
+    'tastytrade': {
+        'columns': {
+            'brokerRef': 'Order #',
+            'instrument.underlying': 'Underlying Symbol',
+            'instrument.optionType': 'Call or Put',
+            'instrument.strike': 'Strike Price',
+            'instrument.expiry': 'Expiration Date',
+            'side': 'Action',
+            'qty': 'Quantity',
+            'price': 'Average Price',
+            'fees': 'Fees',
+            'openTs': 'Date',
+        },
+        'defaults': {'status': 'OPEN'},
+        'date_formats': ['%m/%d/%y', '%Y-%m-%d'],
+        'absolute_price': True,
+    },
+}
+
+NUMBER_FIELDS = {'instrument.strike', 'price', 'fees', 'realizedPnL'}
+DATETIME_FIELDS = {'openTs', 'closeTs'}
+DATE_FIELDS = {'instrument.expiry'}
+LIST_FIELDS = {'strategyTag', 'marketSentimentTag'}
+
+
+class ImportFailed(Exception):
+    """Raised when an import job cannot start (bad source or template)."""
+
+
+def get_template(template_id: Optional[str]) -> dict:
+    try:
+        return MAPPING_TEMPLATES[template_id or 'default']
+    except KeyError:
+        raise ImportFailed(f"Unknown mapping template: {template_id}") from None
+
+
+def _number(value: str) -> float:
+    return float(value.replace(',', '').replace('$', ''))
+
+
+def _datetime(value: str, template: dict) -> datetime:
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        parsed = None
+        for fmt in template.get('datetime_formats', []):
+            try:
+                parsed = datetime.strptime(value, fmt)
+                break
+            except ValueError:
+                continue
+        if parsed is None:
+            raise ValueError(f"unrecognised datetime {value!r}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def _date(value: str, template: dict) -> date:
+    for fmt in template.get('date_formats', []):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return date.fromisoformat(value[:10])
+
+
+def _converter(path: str, template: dict):
+    """Pick the parser for one mapped field once per job rather than once per cell.
+
+    Plain numbers and ISO dates are left as strings for pydantic-core to
+    parse, which is much faster than doing it in Python.
+    """
+    if path in NUMBER_FIELDS:
+        if path == 'price' and template.get('absolute_price'):
+            return lambda value: abs(_number(value))
+        return lambda value: _number(value) if ',' in value or '$' in value else value
+    if path in DATETIME_FIELDS and template.get('datetime_formats'):
+        return lambda value: _datetime(value, template)
+    if path in DATE_FIELDS and template.get('date_formats'):
+        return lambda value: _date(value, template)
+    if path in LIST_FIELDS:
+        separator = template.get('list_separator', ';')
+        return lambda value: [item.strip() for item in value.split(separator) if item.strip()]
+    if path == 'side':
+        return lambda value: SIDE_ALIASES.get(value.strip().upper().replace(' ', '_'), value)
+    if path == 'instrument.optionType':
+        return lambda value: OPTION_TYPE_ALIASES.get(value.strip().upper(), value)
+    if path == 'status':
+        return lambda value: value.strip().upper()
+    return str.strip
+
+
+class RowMapper:
+    """Turns CSV rows into TradeSchema input using a template's column mapping."""
+
+    # Passing every list field explicitly spares Pydantic from copying the mutable defaults.
+    EMPTY_LISTS = ('strategyTag', 'marketSentimentTag', 'regimeTagIds', 'journalEntryIds', 'screenshotIds')
+
+    def __init__(self, template: dict):
+        self.defaults = template.get('defaults', {})
+        self.fields = []
+        for path, column in template['columns'].items():
+            nested = path.startswith('instrument.')
+            key = path.split('.', 1)[1] if nested else path
+            self.fields.append((column, key, nested, _converter(path, template)))
+
+    def __call__(self, row: Dict[str, str], tenant: dict, now: datetime) -> dict:
+        instrument = {}
+        trade = {name: [] for name in self.EMPTY_LISTS}
+        trade.update(self.defaults)
+        trade.update({'_id': ObjectId(), 'tenant': tenant, 'audit': {'createdAt': now}, 'instrument': instrument})
+        for column, key, nested, convert in self.fields:
+            raw = row.get(column)
+            if not raw or raw.isspace():
+                continue
+            (instrument if nested else trade)[key] = convert(raw)
+        return trade
+
+
+def _error_message(exc: Exception) -> str:
+    if isinstance(exc, ValidationError):
+        return '; '.join(
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors()
+        )
+    return str(exc)
+
+
+def validate_batch(rows: List[tuple], mapper: RowMapper, tenant: dict, now: datetime):
+    """Validate (line number, row) pairs; returns (documents, errors)."""
+    documents, errors = [], []
+    for line, row in rows:
+        try:
+            model = TradeSchema.model_validate(mapper(row, tenant, now))
+        except (ValidationError, ValueError, TypeError) as exc:
+            errors.append({'row': line, 'error': _error_message(exc)})
+            continue
+        document = TradeRepository.to_document(model)
+        document['dedupeKey'] = dedupe_key(document)
+        documents.append(document)
+    return documents, errors
+
+
+def numbered_batches(reader: Iterable[Dict[str, str]], size: int) -> Iterator[List[tuple]]:
+    # Line 1 is the header, so data rows start at line 2.
+    numbered = enumerate(reader, start=2)
+    while True:
+        batch = list(islice(numbered, size))
+        if not batch:
+            return
+        yield batch
+
+
+def open_source(source: str, user_id=None) -> TextIO:
+    """Open an ImportJob source: a CSV attachment id of ``user_id`` or a local file path.
+
+    Attachments are read from the blob store (``main_app.blobs``); only ones
+    stored before it keep a file path in ``url``.
+    """
+    try:
+        attachment_id = ObjectId(source)
+    except (InvalidId, TypeError):
+        attachment_id = None
+    if attachment_id is not None:
+        attachment = get_repository(AttachmentRepository).get_collection().find_one(
+            {'_id': attachment_id, 'type': 'csv', 'tenant.userId': user_id}, {'url': 1, 'checksum': 1},
+        )
+        if attachment is None:
+            raise ImportFailed(f"No CSV attachment {source}")
+        if attachment.get('checksum'):
+            try:
+                blob, _ = blob_store().open(attachment['checksum'])
+            except BlobNotFound:
+                raise ImportFailed(f"The content of attachment {source} is missing") from None
+            return io.TextIOWrapper(blob, encoding='utf-8-sig', newline='')
+        source = attachment['url']
+    try:
+        return open(source, newline='', encoding='utf-8-sig')
+    except OSError as exc:
+        raise ImportFailed(f"Cannot open import source {source!r}: {exc}") from exc
+
+
+def _job_collection():
+    return get_repository(ImportJobRepository).get_collection()
+
+
+def _record_progress(job_id, counters: Dict[str, int], errors: List[dict]):
+    update = {'$inc': {f'stats.{key}': value for key, value in counters.items()},
+              '$set': {'audit.updatedAt': datetime.now(timezone.utc)}}
+    if errors:
+        update['$push'] = {'errors': {'$each': errors[:MAX_STORED_ERRORS], '$slice': MAX_STORED_ERRORS}}
+    _job_collection().update_one({'_id': job_id}, update)
+
+
+def import_stream(job: dict, stream: TextIO, batch_size: int = BATCH_SIZE) -> Dict[str, int]:
+    """Import every row of ``stream`` for ``job``; returns the final counters."""
+    mapper = RowMapper(get_template(job.get('mappingTemplateId')))
+    tenant = job['tenant']
+    totals = dict.fromkeys(('rowsRead', 'rowsInserted', 'rowsDuplicate', 'rowsFailed', 'batches', 'closedWithPnL'), 0)
+    for batch in numbered_batches(csv.DictReader(stream), batch_size):
+        now = datetime.now(timezone.utc)
+        documents, errors = validate_batch(batch, mapper, tenant, now)
+        inserted, duplicates, write_errors = upsert_trades(documents)
+        errors += write_errors
+        counters = {
+            'rowsRead': len(batch),
+            'rowsInserted': len(inserted),
+            'rowsDuplicate': duplicates,
+            'rowsFailed': len(errors),
+            'batches': 1,
+            'closedWithPnL': sum(
+                1 for doc in inserted if doc.get('status') == 'CLOSED' and doc.get('realizedPnL') is not None
+            ),
+        }
+        _record_progress(job['_id'], counters, errors)
+        for key, value in counters.items():
+            totals[key] += value
+    return totals
+
+
+def execute_import(job: dict, stream: Optional[TextIO] = None, batch_size: int = BATCH_SIZE) -> Dict[str, int]:
+    """Import ``job``'s source (or ``stream``); status changes are left to main_app.jobs."""
+    if stream is not None:
+        return import_stream(job, stream, batch_size)
+    with open_source(job['source'], job['tenant']['userId']) as source:
+        return import_stream(job, source, batch_size)
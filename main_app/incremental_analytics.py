@@ -0,0 +1,207 @@
+"""Incremental AnalyticsSnapshot maintenance for single trade events.
+
+Every snapshot keeps running sufficient statistics (``stats`` and
+``cohortStats``: counts, sums, sums of squares, equity, running peak and max
+drawdown) next to the metrics built from them. Saving, closing or cancelling
+a trade only touches the daily, weekly and monthly snapshots it falls in,
+with one pipeline update per snapshot, so each event costs O(1) work.
+
+Drawdown can only be extended forwards in time. A back-dated trade or a
+removal marks the snapshot ``stale``, and ``manage.py build_analytics --stale``
+rebuilds it from scratch.
+"""
+
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from .analytics import GRANULARITIES, RUIN_UNITS, cohort_key
+from .db import get_repository
+from .models import AnalyticsSnapshotRepository
+from .versions import bump_data_version
+
+
+def counts_toward_metrics(trade: Optional[dict]) -> bool:
+    return bool(trade) and trade.get('status') == 'CLOSED' and trade.get('realizedPnL') is not None
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def closed_at(trade: dict) -> datetime:
+    # Same fallback order as analytics.TradeColumns.
+    return _naive_utc(trade.get('closeTs') or trade.get('openTs') or trade['audit']['createdAt'])
+
+
+def period_bounds(day: date, granularity: str):
+    if granularity == 'daily':
+        return day, day
+    if granularity == 'weekly':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    if granularity == 'monthly':
+        start = day.replace(day=1)
+        following = (start + timedelta(days=32)).replace(day=1)
+        return start, following - timedelta(days=1)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def trade_cohorts(trade: dict) -> Dict[str, List[str]]:
+    entry = _naive_utc(trade.get('openTs')) or closed_at(trade)
+    return {
+        'byStrategy': [cohort_key(str(tag)) for tag in trade.get('strategyTag') or []],
+        'byRegime': [cohort_key(str(tag)) for tag in trade.get('regimeTagIds') or []],
+        'byTimeOfDay': [f'{entry.hour:02d}:00'],
+    }
+
+
+def _field(prefix: str, name: str) -> str:
+    return f'${prefix}.{name}'
+
+
+def _add(prefix: str, name: str, amount: float) -> dict:
+    return {'$add': [{'$ifNull': [_field(prefix, name), 0]}, amount]}
+
+
+def stat_updates(prefix: str, pnl: float, sign: int, timestamp: datetime) -> dict:
+    updates = {
+        f'{prefix}.n': _add(prefix, 'n', sign),
+        f'{prefix}.sum': _add(prefix, 'sum', sign * pnl),
+        f'{prefix}.sumSq': _add(prefix, 'sumSq', sign * pnl * pnl),
+        f'{prefix}.wins': _add(prefix, 'wins', sign if pnl > 0 else 0),
+        f'{prefix}.losses': _add(prefix, 'losses', sign if pnl < 0 else 0),
+        f'{prefix}.grossWin': _add(prefix, 'grossWin', sign * max(pnl, 0.0)),
+        f'{prefix}.grossLoss': _add(prefix, 'grossLoss', sign * max(-pnl, 0.0)),
+        f'{prefix}.equity': _add(prefix, 'equity', sign * pnl),
+    }
+    if sign > 0:
+        updates[f'{prefix}.lastTs'] = {'$max': [_field(prefix, 'lastTs'), {'$literal': timestamp}]}
+    return updates
+
+
+def metric_updates(prefix: str, target: str, ruin_units: int = RUIN_UNITS) -> dict:
+    """Aggregation expressions that derive AnalyticsMetrics from the stats at ``prefix``."""
+    n = _field(prefix, 'n')
+    wins = _field(prefix, 'wins')
+    losses = _field(prefix, 'losses')
+    mean = {'$divide': [_field(prefix, 'sum'), {'$max': [n, 1]}]}
+    variance = {'$subtract': [{'$divide': [_field(prefix, 'sumSq'), {'$max': [n, 1]}]},
+                              {'$multiply': ['$$mean', '$$mean']}]}
+    sharpe = {'$let': {
+        'vars': {'mean': mean},
+        'in': {'$let': {
+            'vars': {'std': {'$sqrt': {'$max': [variance, 0]}}},
+            'in': {'$cond': [{'$gt': ['$$std', 0]}, {'$divide': ['$$mean', '$$std']}, None]},
+        }},
+    }}
+    edge = {'$min': [1, {'$max': [0, {'$subtract': [
+        {'$multiply': ['$$winRate', '$$payoff']}, {'$subtract': [1, '$$winRate']},
+    ]}]}]}
+    ruin = {'$switch': {
+        'branches': [
+            {'case': {'$lte': [n, 0]}, 'then': None},
+            {'case': {'$lte': [losses, 0]}, 'then': 0.0},
+            {'case': {'$lte': [wins, 0]}, 'then': 1.0},
+        ],
+        'default': {'$let': {
+            'vars': {
+                'winRate': {'$divide': [wins, n]},
+                'payoff': {'$divide': [{'$divide': [_field(prefix, 'grossWin'), wins]},
+                                       {'$divide': [_field(prefix, 'grossLoss'), losses]}]},
+            },
+            'in': {'$let': {
+                'vars': {'edge': edge},
+                'in': {'$pow': [{'$divide': [{'$subtract': [1, '$$edge']}, {'$add': [1, '$$edge']}]},
+                                ruin_units]},
+            }},
+        }},
+    }}
+
+    def when_nonempty(expression):
+        return {'$cond': [{'$gt': [n, 0]}, expression, None]}
+
+    return {
+        f'{target}.winRate': when_nonempty({'$divide': [wins, {'$max': [n, 1]}]}),
+        f'{target}.expectancy': when_nonempty(mean),
+        f'{target}.drawdown': when_nonempty(_field(prefix, 'maxDrawdown')),
+        f'{target}.sharpeLike': when_nonempty(sharpe),
+        f'{target}.riskOfRuin': ruin,
+    }
+
+
+def snapshot_update(trade: dict, granularity: str, sign: int, now: datetime) -> UpdateOne:
+    """One pipeline update applying ``trade`` (sign +1) or removing it (sign -1) from a snapshot."""
+    pnl = float(trade['realizedPnL'])
+    timestamp = closed_at(trade)
+    start, end = period_bounds(timestamp.date(), granularity)
+
+    blocks = [('stats', 'metrics')] + [
+        (f'cohortStats.{cohort}.{key}', f'cohorts.{cohort}.{key}')
+        for cohort, keys in trade_cohorts(trade).items()
+        for key in keys
+    ]
+
+    if sign > 0:
+        stale = {'$lt': [{'$literal': timestamp}, {'$ifNull': ['$stats.lastTs', {'$literal': timestamp}]}]}
+    else:
+        stale = True
+    accumulate = {'stale': {'$or': [{'$ifNull': ['$stale', False]}, stale]}}
+    peaks, drawdowns, metrics = {}, {}, {}
+    for prefix, target in blocks:
+        accumulate.update(stat_updates(prefix, pnl, sign, timestamp))
+        peaks[f'{prefix}.peak'] = {'$max': [{'$ifNull': [_field(prefix, 'peak'), 0]}, _field(prefix, 'equity')]}
+        drawdowns[f'{prefix}.maxDrawdown'] = {'$max': [
+            {'$ifNull': [_field(prefix, 'maxDrawdown'), 0]},
+            {'$subtract': [_field(prefix, 'peak'), _field(prefix, 'equity')]},
+        ]}
+        metrics.update(metric_updates(prefix, target))
+
+    metrics.update({
+        'tenant.orgId': {'$ifNull': ['$tenant.orgId', {'$literal': trade['tenant']['orgId']}]},
+        'periodEnd': {'$literal': end},
+        'audit.createdAt': {'$ifNull': ['$audit.createdAt', {'$literal': now}]},
+        'audit.updatedAt': {'$literal': now},
+    })
+    return UpdateOne(
+        {'tenant.userId': trade['tenant']['userId'], 'granularity': granularity, 'periodStart': start},
+        [{'$set': accumulate}, {'$set': peaks}, {'$set': drawdowns}, {'$set': metrics}],
+        upsert=True,
+    )
+
+
+def _contribution(trade: Optional[dict]):
+    if not counts_toward_metrics(trade):
+        return None
+    return (float(trade['realizedPnL']), closed_at(trade), trade_cohorts(trade))
+
+
+def apply_trade_change(before: Optional[dict], after: Optional[dict],
+                       granularities=GRANULARITIES) -> int:
+    """Update the snapshots affected by a trade going from ``before`` to ``after``.
+
+    Either side may be ``None`` (insert/delete). Only CLOSED trades with a
+    realizedPnL count, so closing adds the trade and cancelling or reopening
+    removes it. Returns the number of snapshot updates sent.
+    """
+    if _contribution(before) == _contribution(after):
+        return 0
+    now = datetime.now(timezone.utc)
+    operations = []
+    if counts_toward_metrics(before):
+        operations += [snapshot_update(before, granularity, -1, now) for granularity in granularities]
+    if counts_toward_metrics(after):
+        operations += [snapshot_update(after, granularity, +1, now) for granularity in granularities]
+    if operations:
+        # Ordered, so a removal lands before the re-add on the same snapshot.
+        get_repository(AnalyticsSnapshotRepository).get_collection().bulk_write(operations, ordered=True)
+        bump_data_version((after or before)['tenant']['userId'])
+    return len(operations)
+
+
+def stale_users() -> List:
+    collection = get_repository(AnalyticsSnapshotRepository).get_collection()
+    return collection.distinct('tenant.userId', {'stale': True})
@@ -0,0 +1,293 @@
+"""Durable background jobs on top of the ImportJob collection.
+
+``import_jobs`` doubles as the work queue. A worker claims a PENDING job with
+one atomic ``find_one_and_update`` that flips it to RUNNING and stamps a
+lease; a heartbeat thread keeps extending the lease while the job runs, and
+the job ends COMPLETED or FAILED. A RUNNING job whose lease has expired
+belonged to a dead worker and is claimed again. Failures go back to PENDING
+with exponential backoff (``runAfter``) until ``JOB_MAX_ATTEMPTS``.
+
+Only the lease owner may heartbeat or finish a job, so a worker that lost
+its lease cannot overwrite the outcome recorded by the one that took over.
+"""
+
+import logging
+import os
+import random
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from bson import ObjectId
+from django.conf import settings
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from .attachments import make_thumbnail
+from .db import get_repository
+from .importer import MAX_STORED_ERRORS, ImportFailed, execute_import
+from .models import ImportJobRepository
+from .versions import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+JOB_KINDS = ('import', 'analytics_rebuild', 'thumbnail')
+FINISHED = ('COMPLETED', 'FAILED')
+
+
+def _collection():
+    return get_repository(ImportJobRepository).get_collection()
+
+
+def worker_name(index: int = 0) -> str:
+    return f'{socket.gethostname()}:{os.getpid()}:{index}'
+
+
+def enqueue(kind: str, tenant: dict, source: str, mapping_template_id: Optional[str] = None,
+            run_after: Optional[datetime] = None) -> ObjectId:
+    """Store a PENDING job and return its id."""
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    now = datetime.now(timezone.utc)
+    job_id = ObjectId()
+    _collection().insert_one({
+        '_id': job_id,
+        'tenant': tenant,
+        'audit': {'createdAt': now},
+        'source': source,
+        'mappingTemplateId': mapping_template_id,
+        'status': 'PENDING',
+        'stats': {},
+        'errors': [],
+        'kind': kind,
+        'attempts': 0,
+        'runAfter': run_after or now,
+    })
+    return job_id
+
+
+def enqueue_analytics_rebuild(tenant: dict) -> ObjectId:
+    """Queue a full snapshot rebuild for the tenant's user, reusing one that is still pending."""
+    now = datetime.now(timezone.utc)
+    job = _collection().find_one_and_update(
+        {'kind': 'analytics_rebuild', 'tenant.userId': tenant['userId'], 'status': 'PENDING'},
+        {'$setOnInsert': {
+            'tenant.orgId': tenant['orgId'],
+            'audit': {'createdAt': now},
+            'source': 'analytics',
+            'mappingTemplateId': None,
+            'stats': {},
+            'errors': [],
+            'attempts': 0,
+            'runAfter': now,
+        }},
+        projection={'_id': 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return job['_id']
+
+
+def claim(worker: str, lease_seconds: Optional[int] = None, query: Optional[dict] = None) -> Optional[dict]:
+    """Atomically take the oldest runnable job (optionally also matching ``query``)."""
+    now = datetime.now(timezone.utc)
+    lease_seconds = lease_seconds or settings.JOB_LEASE_SECONDS
+    runnable = {'$or': [
+        {'status': 'PENDING', 'runAfter': {'$lte': now}},
+        {'status': 'PENDING', 'runAfter': None},
+        {'status': 'RUNNING', 'leaseExpiresAt': {'$lt': now}},
+    ]}
+    return _collection().find_one_and_update(
+        {'$and': [runnable, query]} if query else runnable,
+        {'$set': {
+            'status': 'RUNNING',
+            'leaseOwner': worker,
+            'leaseExpiresAt': now + timedelta(seconds=lease_seconds),
+            'heartbeatAt': now,
+            'audit.updatedAt': now,
+        }, '$inc': {'attempts': 1}},
+        sort=[('runAfter', 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def heartbeat(job_id, worker: str, lease_seconds: int) -> bool:
+    """Extend the lease; False means another worker has taken the job over."""
+    now = datetime.now(timezone.utc)
+    result = _collection().update_one(
+        {'_id': job_id, 'status': 'RUNNING', 'leaseOwner': worker},
+        {'$set': {'leaseExpiresAt': now + timedelta(seconds=lease_seconds), 'heartbeatAt': now}},
+    )
+    return result.matched_count == 1
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter, capped at JOB_RETRY_MAX_SECONDS."""
+    delay = min(settings.JOB_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), settings.JOB_RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _release(job: dict, worker: str, fields: dict, error: Optional[dict] = None) -> bool:
+    update = {'$set': dict(fields, **{'audit.updatedAt': datetime.now(timezone.utc)}),
+              '$unset': {'leaseOwner': '', 'leaseExpiresAt': ''}}
+    if error:
+        update['$push'] = {'errors': {'$each': [error], '$slice': MAX_STORED_ERRORS}}
+    result = _collection().update_one({'_id': job['_id'], 'status': 'RUNNING', 'leaseOwner': worker}, update)
+    return result.matched_count == 1
+
+
+def complete(job: dict, worker: str) -> Optional[str]:
+    return 'COMPLETED' if _release(job, worker, {'status': 'COMPLETED'}) else None
+
+
+def fail(job: dict, worker: str, message: str, retry: bool = True) -> Optional[str]:
+    """Send the job back to PENDING with a backoff, or to FAILED once out of attempts."""
+    attempts = job.get('attempts', 1)
+    error = {'row': None, 'error': message, 'attempt': attempts}
+    if retry and attempts < settings.JOB_MAX_ATTEMPTS:
+        run_after = datetime.now(timezone.utc) + timedelta(seconds=retry_delay(attempts))
+        released = _release(job, worker, {'status': 'PENDING', 'runAfter': run_after}, error)
+        return 'PENDING' if released else None
+    return 'FAILED' if _release(job, worker, {'status': 'FAILED'}, error) else None
+
+
+class Heartbeat(threading.Thread):
+    """Extends a job's lease every third of the lease period until stopped."""
+
+    def __init__(self, job_id, worker: str, lease_seconds: int):
+        super().__init__(name=f'heartbeat-{job_id}', daemon=True)
+        self.job_id = job_id
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        while not self.stopped.wait(self.lease_seconds / 3):
+            try:
+                if not heartbeat(self.job_id, self.worker, self.lease_seconds):
+                    self.lost = True
+                    logger.warning("Lost lease on job %s", self.job_id)
+                    return
+            except PyMongoError:
+                # Keep trying; the lease only lapses if the outage outlasts it.
+                logger.exception("Heartbeat for job %s failed", self.job_id)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def _run_import(job: dict, **options):
+    _collection().update_one({'_id': job['_id']}, {'$set': {'stats': {}}})  # a retry counts from scratch
+    totals = execute_import(job, **options)
+    user_id = job['tenant'].get('userId')
+    # Duplicates may be rows an earlier attempt inserted before dying, so they get the same follow-up.
+    if not user_id or not (totals['rowsInserted'] or totals['rowsDuplicate']):
+        return
+    from .ledger import replay_user  # NumPy, like analytics and regimes: only for workers that run jobs
+    from .regimes import tag_user
+
+    # New fills can close lots anywhere in the history, so match the whole ledger again.
+    ledger = replay_user(user_id)
+    tag_user(user_id)  # only the untagged, i.e. the new, trades
+    bump_data_version(user_id)
+    if totals['closedWithPnL'] or totals['rowsDuplicate'] or ledger['realizedChanged']:
+        # A bulk load invalidates many buckets at once; a full rebuild is cheaper than per-trade updates.
+        enqueue_analytics_rebuild(job['tenant'])
+
+
+def _run_analytics_rebuild(job: dict, **options):
+    from .analytics import build_snapshots
+
+    build_snapshots(job['tenant']['userId'])
+
+
+def _run_thumbnail(job: dict, **options):
+    make_thumbnail(job['source'])  # source: checksum of the image
+
+
+HANDLERS = {
+    'import': _run_import,
+    'analytics_rebuild': _run_analytics_rebuild,
+    'thumbnail': _run_thumbnail,
+}
+
+
+def run_job(job: dict, worker: str, lease_seconds: Optional[int] = None, retry: bool = True,
+            **options) -> Optional[str]:
+    """Run a claimed job under a heartbeat; returns its new status (None if the lease was lost)."""
+    lease_seconds = lease_seconds or settings.JOB_LEASE_SECONDS
+    if job['attempts'] > settings.JOB_MAX_ATTEMPTS:
+        # Claimed again after its lease expired once too often, i.e. it keeps killing workers.
+        return fail(job, worker, "Lease expired on every attempt", retry=False)
+
+    beat = Heartbeat(job['_id'], worker, lease_seconds)
+    beat.start()
+    error = None
+    try:
+        HANDLERS[job.get('kind', 'import')](job, **options)
+    except ImportFailed as exc:
+        # Bad source or template: retrying will not help.
+        error, retry = str(exc), False
+    except Exception as exc:
+        logger.exception("Job %s failed", job['_id'])
+        error = f'{type(exc).__name__}: {exc}'
+    finally:
+        beat.stop()
+    if error is not None:
+        return fail(job, worker, error, retry)
+    return complete(job, worker)
+
+
+def run_now(query: dict, worker: str, **options) -> Optional[str]:
+    """Claim one job matching ``query`` and run it in this process without retries."""
+    job = claim(worker, query=query)
+    if job is None:
+        return None
+    return run_job(job, worker, retry=False, **options)
+
+
+def work(worker: str, stop, poll_seconds: Optional[float] = None, lease_seconds: Optional[int] = None,
+         burst: bool = False) -> int:
+    """Claim and run jobs until ``stop`` (an Event) is set, or the queue is empty when ``burst``."""
+    poll_seconds = poll_seconds or settings.WORKER_POLL_SECONDS
+    done = 0
+    while not stop.is_set():
+        try:
+            job = claim(worker, lease_seconds)
+        except PyMongoError:
+            logger.exception("Claiming a job failed")
+            job = None
+        if job is None:
+            if burst:
+                break
+            stop.wait(poll_seconds)
+            continue
+        status = run_job(job, worker, lease_seconds)
+        logger.info("Job %s (%s) -> %s", job['_id'], job.get('kind', 'import'), status)
+        done += 1
+    return done
+
+
+def job_status(job_id, user_id) -> Optional[dict]:
+    """Pollable view of a job owned by ``user_id``, or None."""
+    projection = dict.fromkeys(('kind', 'status', 'attempts', 'stats', 'runAfter', 'heartbeatAt', 'audit'), 1)
+    projection['errors'] = {'$slice': -20}
+    job = _collection().find_one({'_id': ObjectId(job_id), 'tenant.userId': ObjectId(user_id)}, projection)
+    if job is None:
+        return None
+    return {
+        'id': str(job['_id']),
+        'kind': job.get('kind', 'import'),
+        'status': job['status'],
+        'attempts': job.get('attempts', 0),
+        'stats': job.get('stats', {}),
+        'errors': job.get('errors', []),
+        'runAfter': job.get('runAfter'),
+        'heartbeatAt': job.get('heartbeatAt'),
+        'createdAt': job['audit'].get('createdAt'),
+        'updatedAt': job['audit'].get('updatedAt'),
+        'finished': job['status'] in FINISHED,
+    }
@@ -0,0 +1,433 @@
+"""Position ledger: lot matching of BUY/SELL/SHORT/COVER fills into P&L.
+
+Fills are grouped per (user, underlying, optionType, strike, expiry). BUY
+opens long lots and SELL closes them; SHORT opens short lots and COVER
+closes them. Closing quantity is matched against open lots FIFO, LIFO or at
+average cost (``AVERAGE`` still depletes lots oldest-first, but prices every
+close at the book's average cost). Opening fees are folded into the lot's
+per-unit cost, closing fees are charged to the closing fill pro rata to the
+matched quantity, and prices are per share, so P&L is scaled by the options
+contract multiplier.
+
+Written back to the trades:
+
+* closing fills: ``realizedPnL``, ``status`` CLOSED, ``closeTs`` and
+  ``entryTs``, the fill time of the earliest lot they closed;
+* opening fills: ``status`` (OPEN while any of the lot is left) and
+  ``unrealizedPnL`` of the remainder, marked at the position's last fill
+  price until a revaluation supplies a better mark.
+
+Rows that already describe a full round trip (an opening side with
+``closeTs`` and ``realizedPnL``) and CANCELLED fills are left alone, as are
+closing fills that find no open lots (history that starts mid-position).
+
+Open lots live in ``positions`` as parallel arrays (``LotBook``), so a new
+fill later than the position's last one is applied incrementally
+(``apply_fill``); a back-dated fill replays just that position.
+"""
+
+from array import array
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from django.conf import settings
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from .db import get_repository
+from .incremental_analytics import apply_trade_change
+from .models import PositionRepository, TradeRepository
+
+METHODS = ('FIFO', 'LIFO', 'AVERAGE')
+OPENING_SIDES = {'BUY': 'long', 'SHORT': 'short'}
+CLOSING_SIDES = {'SELL': 'long', 'COVER': 'short'}
+EPSILON = 1e-9
+
+FILL_PROJECTION = {
+    'tenant': 1, 'audit.createdAt': 1, 'instrument': 1, 'side': 1, 'qty': 1, 'price': 1, 'fees': 1,
+    'openTs': 1, 'closeTs': 1, 'status': 1, 'realizedPnL': 1, 'unrealizedPnL': 1, 'entryTs': 1,
+}
+FILL_TIME_PROJECTION = {'side': 1, 'openTs': 1, 'closeTs': 1, 'audit.createdAt': 1}
+
+
+def _naive_utc(value):
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def position_key(trade: dict) -> tuple:
+    instrument = trade['instrument']
+    expiry = instrument['expiry']
+    if isinstance(expiry, datetime):
+        expiry = expiry.date()
+    return instrument['underlying'], instrument['optionType'], float(instrument['strike']), expiry
+
+
+def key_filter(user_id, key: tuple) -> dict:
+    underlying, option_type, strike, expiry = key
+    return {
+        'tenant.userId': user_id,
+        'instrument.underlying': underlying,
+        'instrument.optionType': option_type,
+        'instrument.strike': strike,
+        'instrument.expiry': expiry,
+    }
+
+
+def fill_time(trade: dict) -> datetime:
+    first, second = ('closeTs', 'openTs') if trade['side'] in CLOSING_SIDES else ('openTs', 'closeTs')
+    return _naive_utc(trade.get(first) or trade.get(second) or trade['audit']['createdAt'])
+
+
+def in_ledger(trade: dict) -> bool:
+    if trade.get('status') == 'CANCELLED' or trade.get('side') not in OPENING_SIDES.keys() | CLOSING_SIDES.keys():
+        return False
+    round_trip = trade.get('closeTs') is not None and trade.get('realizedPnL') is not None
+    return not (trade['side'] in OPENING_SIDES and round_trip)
+
+
+class LotBook:
+    """Open lots of one side of a position, oldest first, in parallel arrays.
+
+    FIFO consumes from ``head`` (compacting the consumed prefix now and then),
+    LIFO pops from the tail, so matching never shifts the arrays.
+    """
+
+    __slots__ = ('qty', 'cost', 'fills', 'head', 'size', 'basis')
+
+    def __init__(self, qty=(), cost=(), fills=(), basis=None):
+        self.qty = array('d', qty)
+        self.cost = array('d', cost)
+        self.fills = list(fills)
+        self.head = 0
+        self.size = sum(self.qty)
+        self.basis = sum(q * c for q, c in zip(self.qty, self.cost)) if basis is None else basis
+
+    @classmethod
+    def from_document(cls, document: Optional[dict]) -> 'LotBook':
+        document = document or {}
+        return cls(document.get('qty', ()), document.get('cost', ()), document.get('fillIds', ()),
+                   document.get('basis'))
+
+    def to_document(self) -> dict:
+        head = self.head
+        return {'qty': self.qty[head:].tolist(), 'cost': self.cost[head:].tolist(),
+                'fillIds': self.fills[head:], 'basis': self.basis}
+
+    def add(self, qty: float, unit_cost: float, fill_id):
+        self.qty.append(qty)
+        self.cost.append(unit_cost)
+        self.fills.append(fill_id)
+        self.size += qty
+        self.basis += qty * unit_cost
+
+    def average_cost(self) -> float:
+        return self.basis / self.size if self.size > EPSILON else 0.0
+
+    def take(self, qty: float, method: str) -> Tuple[float, float, List[Tuple[object, float]]]:
+        """Close up to ``qty``; returns (matched qty, cost basis released, [(fill id, qty left)])."""
+        matched = min(qty, self.size)
+        released = self.average_cost() * matched if method == 'AVERAGE' else 0.0
+        touched = []
+        remaining = matched
+        while remaining > EPSILON:
+            index = len(self.qty) - 1 if method == 'LIFO' else self.head
+            lot = self.qty[index]
+            used = min(lot, remaining)
+            if method != 'AVERAGE':
+                released += used * self.cost[index]
+            left = lot - used
+            touched.append((self.fills[index], left if left > EPSILON else 0.0))
+            if left > EPSILON:
+                self.qty[index] = left
+            elif method == 'LIFO':
+                self.qty.pop()
+                self.cost.pop()
+                self.fills.pop()
+            else:
+                self.head += 1
+            remaining -= used
+        self.size -= matched
+        self.basis -= released
+        if self.size <= EPSILON:
+            self.qty, self.cost, self.fills, self.head = array('d'), array('d'), [], 0
+            self.size = self.basis = 0.0
+        elif self.head > 64 and self.head * 2 > len(self.qty):
+            del self.qty[:self.head], self.cost[:self.head], self.fills[:self.head]
+            self.head = 0
+        return matched, released, touched
+
+    def open_lots(self):
+        for index in range(self.head, len(self.qty)):
+            yield self.fills[index], self.qty[index], self.cost[index]
+
+
+class PositionBook:
+    """Long and short lots of one instrument plus running totals."""
+
+    def __init__(self, method: str, multiplier: float, long: LotBook = None, short: LotBook = None,
+                 realized: float = 0.0, last_price: Optional[float] = None, last_fill=None, fills: int = 0):
+        if method not in METHODS:
+            raise ValueError(f"Unknown lot matching method: {method}")
+        self.method = method
+        self.multiplier = multiplier
+        self.books = {'long': long or LotBook(), 'short': short or LotBook()}
+        self.realized = realized
+        self.last_price = last_price
+        self.last_fill = last_fill  # (fill time, fill id) of the latest fill applied
+        self.fills = fills
+
+    @classmethod
+    def from_document(cls, document: dict, multiplier: float) -> 'PositionBook':
+        last_fill = (document['lastFillAt'], document['lastFillId']) if document.get('lastFillId') else None
+        return cls(document['method'], multiplier, LotBook.from_document(document.get('long')),
+                   LotBook.from_document(document.get('short')), document.get('realizedPnL', 0.0),
+                   document.get('lastPrice'), last_fill, document.get('fills', 0))
+
+    def apply(self, fill: dict) -> Tuple[Optional[float], List[Tuple[object, float]]]:
+        """Apply one fill; returns (realized P&L or None, [(opening fill id, qty left)])."""
+        qty, price = float(fill['qty']), float(fill['price'])
+        fees = float(fill.get('fees') or 0.0)
+        self.last_price = price
+        self.last_fill = (fill_time(fill), fill['_id'])
+        self.fills += 1
+        side = fill['side']
+        if side in OPENING_SIDES:
+            per_unit_fee = fees / (qty * self.multiplier) if qty else 0.0
+            # A long lot costs price + fees; a short lot's credit is price - fees.
+            unit = price + per_unit_fee if side == 'BUY' else price - per_unit_fee
+            self.books[OPENING_SIDES[side]].add(qty, unit, fill['_id'])
+            return None, []
+        book = self.books[CLOSING_SIDES[side]]
+        matched, released, touched = book.take(qty, self.method)
+        if not matched:
+            return None, []
+        value = price * matched
+        gross = value - released if side == 'SELL' else released - value
+        realized = gross * self.multiplier - fees * matched / qty
+        self.realized += realized
+        return realized, touched
+
+    def unrealized(self) -> Dict[object, Tuple[float, float]]:
+        """{opening fill id: (qty left, unrealized P&L at the last price)} for every open lot."""
+        result = {}
+        for side, book in self.books.items():
+            average = book.average_cost()
+            for fill_id, qty, unit in book.open_lots():
+                if self.method == 'AVERAGE':
+                    unit = average
+                move = self.last_price - unit if side == 'long' else unit - self.last_price
+                result[fill_id] = (qty, move * qty * self.multiplier)
+        return result
+
+    def to_document(self, tenant: dict, key: tuple, now: datetime) -> dict:
+        underlying, option_type, strike, expiry = key
+        last_at, last_id = self.last_fill or (None, None)
+        return {
+            'tenant': tenant,
+            'audit': {'createdAt': now, 'updatedAt': now},
+            'instrument': {'underlying': underlying, 'optionType': option_type, 'strike': strike, 'expiry': expiry},
+            'method': self.method,
+            'long': self.books['long'].to_document(),
+            'short': self.books['short'].to_document(),
+            'realizedPnL': self.realized,
+            'lastPrice': self.last_price,
+            'lastFillAt': last_at,
+            'lastFillId': last_id,
+            'fills': self.fills,
+            'revision': ObjectId(),
+        }
+
+
+def _closing_fields(fill: dict, realized: float, entry_ts: Optional[datetime]) -> dict:
+    return {'realizedPnL': realized, 'status': 'CLOSED', 'closeTs': fill.get('closeTs') or fill_time(fill),
+            'entryTs': entry_ts, 'unrealizedPnL': None}
+
+
+def _opening_fields(left: float, unrealized: Optional[float]) -> dict:
+    if left > EPSILON:
+        return {'status': 'OPEN', 'unrealizedPnL': unrealized}
+    return {'status': 'CLOSED', 'unrealizedPnL': 0.0}
+
+
+def replay_fills(fills: Iterable[dict], method: str, multiplier: float):
+    """Match fills already sorted by ``fill_time``; pure, no I/O.
+
+    Returns (book, {fill id: fields to store}, unmatched closing qty).
+    """
+    book = PositionBook(method, multiplier)
+    fields = {}
+    unmatched = 0.0
+    opening = []
+    opened_at = {}
+    for fill in fills:
+        realized, touched = book.apply(fill)
+        if fill['side'] in OPENING_SIDES:
+            opening.append(fill['_id'])
+            opened_at[fill['_id']] = fill_time(fill)
+        elif realized is None:
+            unmatched += float(fill['qty'])
+        else:
+            entry_ts = min(opened_at[fill_id] for fill_id, _ in touched)
+            fields[fill['_id']] = _closing_fields(fill, realized, entry_ts)
+    open_lots = book.unrealized()
+    for fill_id in opening:
+        left, unrealized = open_lots.get(fill_id, (0.0, None))
+        fields[fill_id] = _opening_fields(left, unrealized)
+    return book, fields, unmatched
+
+
+def _changes(document: dict, fields: dict) -> dict:
+    changes = {}
+    for name, value in fields.items():
+        current = _naive_utc(document.get(name))
+        if isinstance(value, float) and isinstance(current, (int, float)):
+            if abs(value - current) <= EPSILON * max(1.0, abs(value)):
+                continue
+        elif _naive_utc(value) == current:
+            continue
+        changes[name] = value
+    return changes
+
+
+def _position_collection():
+    return get_repository(PositionRepository).get_collection()
+
+
+def _trade_collection():
+    return get_repository(TradeRepository).get_collection()
+
+
+def _write_position(user_id, tenant: dict, key: tuple, book: PositionBook, now: datetime) -> UpdateOne:
+    """Upsert of the position that keeps ``audit.createdAt`` of one already stored."""
+    document = book.to_document(tenant, key, now)
+    audit = document.pop('audit')
+    document['audit.updatedAt'] = audit['updatedAt']
+    update = {'$set': document, '$setOnInsert': {'audit.createdAt': audit['createdAt']}}
+    return UpdateOne(key_filter(user_id, key), update, upsert=True)
+
+
+def _entry_time(fill_ids: List) -> Optional[datetime]:
+    """Fill time of the earliest of the opening fills a close matched."""
+    fills = _trade_collection().find({'_id': {'$in': fill_ids}}, FILL_TIME_PROJECTION)
+    return min((fill_time(fill) for fill in fills), default=None)
+
+
+def _sort_key(fill: dict):
+    return fill_time(fill), fill['_id']
+
+
+def replay_user(user_id, method: Optional[str] = None, multiplier: Optional[float] = None) -> Dict[str, float]:
+    """Rebuild every position of a user from their fills and write changed P&L back in bulk."""
+    user_id = ObjectId(user_id)
+    method = method or settings.LEDGER_METHOD
+    multiplier = multiplier or settings.OPTION_CONTRACT_MULTIPLIER
+    grouped = defaultdict(list)
+    for fill in _trade_collection().find({'tenant.userId': user_id}, FILL_PROJECTION):
+        if in_ledger(fill):
+            grouped[position_key(fill)].append(fill)
+
+    now = datetime.now(timezone.utc)
+    trade_updates, position_writes = [], []
+    totals = {'fills': 0, 'positions': len(grouped), 'updated': 0, 'realizedChanged': 0, 'unmatchedQty': 0.0}
+    for key, fills in grouped.items():
+        fills.sort(key=_sort_key)
+        book, fields, unmatched = replay_fills(fills, method, multiplier)
+        totals['fills'] += len(fills)
+        totals['unmatchedQty'] += unmatched
+        for fill in fills:
+            changes = _changes(fill, fields.get(fill['_id'], {}))
+            if changes:
+                trade_updates.append(UpdateOne({'_id': fill['_id']}, {'$set': changes}))
+                totals['realizedChanged'] += 'realizedPnL' in changes
+        position_writes.append(_write_position(user_id, fills[0]['tenant'], key, book, now))
+
+    if trade_updates:
+        _trade_collection().bulk_write(trade_updates, ordered=False)
+    totals['updated'] = len(trade_updates)
+    positions = _position_collection()
+    if position_writes:
+        positions.bulk_write(position_writes, ordered=False)
+    positions.delete_many({'tenant.userId': user_id, 'audit.updatedAt': {'$lt': now}})
+    return totals
+
+
+def replay_position(user_id, key: tuple, method: Optional[str] = None,
+                    multiplier: Optional[float] = None) -> int:
+    """Rebuild one position (after a back-dated fill); snapshots are adjusted per changed fill."""
+    multiplier = multiplier or settings.OPTION_CONTRACT_MULTIPLIER
+    projection = dict(FILL_PROJECTION, strategyTag=1, regimeTagIds=1)
+    fills = [fill for fill in _trade_collection().find(key_filter(user_id, key), projection) if in_ledger(fill)]
+    if not fills:
+        _position_collection().delete_one(key_filter(user_id, key))
+        return 0
+    if method is None:
+        existing = _position_collection().find_one(key_filter(user_id, key), {'method': 1})
+        method = existing['method'] if existing else settings.LEDGER_METHOD
+    fills.sort(key=_sort_key)
+    book, fields, _ = replay_fills(fills, method, multiplier)
+    updates = []
+    for fill in fills:
+        changes = _changes(fill, fields.get(fill['_id'], {}))
+        if changes:
+            updates.append(UpdateOne({'_id': fill['_id']}, {'$set': changes}))
+            apply_trade_change(fill, dict(fill, **changes))
+    if updates:
+        _trade_collection().bulk_write(updates, ordered=False)
+    now = datetime.now(timezone.utc)
+    _position_collection().bulk_write([_write_position(user_id, fills[0]['tenant'], key, book, now)])
+    return len(updates)
+
+
+def apply_fill(trade: dict, multiplier: Optional[float] = None) -> int:
+    """Apply one newly stored fill to its position; returns the number of trades updated.
+
+    Only the position's open lots are read and rewritten. Fills dated before
+    the position's latest fill, and writes that lose a race with another
+    writer, fall back to ``replay_position``.
+    """
+    if not in_ledger(trade):
+        return 0
+    multiplier = multiplier or settings.OPTION_CONTRACT_MULTIPLIER
+    user_id = trade['tenant']['userId']
+    key = position_key(trade)
+    positions = _position_collection()
+    existing = positions.find_one(key_filter(user_id, key))
+    if existing is None:
+        book = PositionBook(settings.LEDGER_METHOD, multiplier)
+    else:
+        book = PositionBook.from_document(existing, multiplier)
+        if book.last_fill and _sort_key(trade) <= book.last_fill:
+            return replay_position(user_id, key, book.method, multiplier)
+
+    realized, touched = book.apply(trade)
+    now = datetime.now(timezone.utc)
+    document = book.to_document(trade['tenant'], key, now)
+    try:
+        if existing is None:
+            positions.insert_one(document)
+        else:
+            document['audit']['createdAt'] = existing['audit']['createdAt']
+            result = positions.replace_one({'_id': existing['_id'], 'revision': existing.get('revision')}, document)
+            if not result.matched_count:
+                return replay_position(user_id, key, book.method, multiplier)
+    except DuplicateKeyError:
+        return replay_position(user_id, key, book.method, multiplier)
+
+    # Every open lot is re-marked at the new last price.
+    fields = {fill_id: _opening_fields(left, unrealized) for fill_id, (left, unrealized) in book.unrealized().items()}
+    for fill_id, left in touched:
+        fields.setdefault(fill_id, _opening_fields(left, None))
+    if trade['side'] in OPENING_SIDES:
+        fields.setdefault(trade['_id'], _opening_fields(0.0, None))
+    elif realized is not None:
+        fields[trade['_id']] = _closing_fields(trade, realized, _entry_time([fill_id for fill_id, _ in touched]))
+    updates = [UpdateOne({'_id': fill_id}, {'$set': values}) for fill_id, values in fields.items()]
+    if updates:
+        _trade_collection().bulk_write(updates, ordered=False)
+    if realized is not None:
+        apply_trade_change(trade, dict(trade, **fields[trade['_id']]))
+    return len(updates)
@@ -0,0 +1,344 @@
+"""Link graph of notebook notes.
+
+A note's markdown links with ``[[Title]]`` (also ``[[Title|label]]`` and
+``[[Title#heading]]``) to another note of the same user, and with
+``[[trade:<id>]]``, ``[[journal:<id>]]`` or ``[[note:<id>]]`` to a document
+by id. Saving a note stores its forward edges in ``links`` (by target
+kind), keeps ``[[Title]]`` links to no existing note in
+``unresolvedLinks``, and maintains the reverse edges:
+
+- note -> note: ``backlinks['note']`` of the target lists the linking
+  notes. A save diffs the new targets against the stored ones and sends
+  only the ``$addToSet``/``$pull`` updates for the difference, in one
+  unordered bulk write;
+- note -> trade or journal entry: answered by multikey indexes on
+  ``links.trade``/``links.journal``, so linking never writes to trades.
+
+A note created (or renamed) with a title that other notes were waiting for
+resolves their ``unresolvedLinks`` in the same bulk write; renaming or
+deleting a note drops the edges that came from its old title, and those
+title links become unresolved again (or move to the next note with it).
+
+``related`` walks the graph from a note, trade or journal entry, in both
+directions and up to a bounded depth, with a few indexed queries per level.
+"""
+
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+
+from .db import get_repository
+from .models import JournalEntryRepository, NotebookNoteRepository
+
+LINK = re.compile(r'\[\[([^\[\]|#\n]+)(?:#[^\[\]|\n]*)?(?:\|[^\[\]\n]*)?\]\]')
+ID_LINK = re.compile(r'^(note|trade|journal):\s*([0-9a-fA-F]{24})$')
+NODE_KINDS = ('note', 'trade', 'journal')
+MAX_DEPTH = 3
+MAX_RELATED = 500
+
+
+def title_key(title: str) -> str:
+    return ' '.join(title.split()).casefold()
+
+
+class ParsedLinks(NamedTuple):
+    titles: Set[str]  # title keys
+    ids: Dict[str, Set[ObjectId]]  # kind -> ids
+
+
+def parse(markdown: str) -> ParsedLinks:
+    titles, ids = set(), {}
+    for target in LINK.findall(markdown or ''):
+        target = target.strip()
+        by_id = ID_LINK.match(target)
+        if by_id:
+            try:
+                ids.setdefault(by_id.group(1), set()).add(ObjectId(by_id.group(2)))
+            except InvalidId:
+                continue
+        elif target:
+            titles.add(title_key(target))
+    return ParsedLinks(titles, ids)
+
+
+def _notes():
+    return get_repository(NotebookNoteRepository).get_collection()
+
+
+def _link_fields(note_id: ObjectId, title: str, parsed: ParsedLinks, notes_by_title: Dict[str, ObjectId]) -> dict:
+    key = title_key(title)
+    titles = parsed.titles - {key}  # a note does not link to itself
+    targets = {kind: set(ids) for kind, ids in parsed.ids.items()}
+    resolved = {title: notes_by_title[title] for title in titles if title in notes_by_title}
+    targets.setdefault('note', set()).update(resolved.values())
+    targets['note'].discard(note_id)
+    return {
+        'titleKey': key,
+        'links': {kind: sorted(ids) for kind, ids in targets.items() if ids},
+        'unresolvedLinks': sorted(titles - set(resolved)),
+    }
+
+
+def note_link_fields(user_id, note_id: ObjectId, title: str, markdown: str) -> dict:
+    """``titleKey``, ``links`` and ``unresolvedLinks`` of a note with this title and markdown."""
+    parsed = parse(markdown)
+    notes_by_title = {}
+    if parsed.titles:
+        # Oldest note first, so a duplicated title resolves to the note that had it first.
+        query = {'tenant.userId': ObjectId(user_id), 'titleKey': {'$in': sorted(parsed.titles)}, '_id': {'$ne': note_id}}
+        for note in _notes().find(query, {'titleKey': 1}, sort=[('audit.createdAt', 1)]):
+            notes_by_title.setdefault(note['titleKey'], note['_id'])
+    return _link_fields(note_id, title, parsed, notes_by_title)
+
+
+def _note_targets(note: Optional[dict]) -> Set[ObjectId]:
+    return set(((note or {}).get('links') or {}).get('note') or ())
+
+
+def link_operations(user_id, note: dict, previous: Optional[dict]) -> List[UpdateOne]:
+    """Reverse-edge updates after ``note`` was saved over ``previous`` (None: created)."""
+    user = ObjectId(user_id)
+    note_id = note['_id']
+    after, before = _note_targets(note), _note_targets(previous)
+    operations = [UpdateOne({'_id': target, 'tenant.userId': user}, {'$addToSet': {'backlinks.note': note_id}})
+                  for target in sorted(after - before)]
+    operations += [UpdateOne({'_id': target, 'tenant.userId': user}, {'$pull': {'backlinks.note': note_id}})
+                   for target in sorted(before - after)]
+    return operations
+
+
+def resolve_waiting(user_id, note: dict, previous: Optional[dict]) -> Tuple[List[ObjectId], List[UpdateOne]]:
+    """Notes whose ``[[Title]]`` links wait for this note's (new) title, and the updates that link them."""
+    key = note['titleKey']
+    if previous is not None and previous.get('titleKey') == key:
+        return [], []
+    user = ObjectId(user_id)
+    waiting = [source['_id'] for source in _notes().find({'tenant.userId': user, 'unresolvedLinks': key}, {'_id': 1})
+               if source['_id'] != note['_id']]
+    if not waiting:
+        return [], []
+    operations = [UpdateOne({'_id': source, 'tenant.userId': user},
+                            {'$pull': {'unresolvedLinks': key}, '$addToSet': {'links.note': note['_id']}})
+                  for source in waiting]
+    operations.append(UpdateOne({'_id': note['_id'], 'tenant.userId': user},
+                                {'$addToSet': {'backlinks.note': {'$each': waiting}}}))
+    return waiting, operations
+
+
+def _move_title(user: ObjectId, key: str, current: ObjectId, successor: Optional[ObjectId],
+                keep: Set[str] = frozenset()) -> Tuple[List[ObjectId], List[UpdateOne]]:
+    """Updates pointing the ``[[key]]`` links resolved to ``current`` at ``successor`` (None: unresolved).
+
+    Returns the sources that no longer link to ``current`` (they still do by
+    id or by a title in ``keep``) and the updates.
+    """
+    dropped, operations = [], []
+    for source in _notes().find({'tenant.userId': user, 'links.note': current}, {'markdown': 1}):
+        parsed = parse(source.get('markdown') or '')
+        if source['_id'] == current or key not in parsed.titles:
+            continue
+        if current not in parsed.ids.get('note', ()) and not parsed.titles & keep:
+            dropped.append(source['_id'])
+            operations.append(UpdateOne({'_id': source['_id'], 'tenant.userId': user},
+                                        {'$pull': {'links.note': current}}))
+        if successor is None:
+            operations.append(UpdateOne({'_id': source['_id'], 'tenant.userId': user},
+                                        {'$addToSet': {'unresolvedLinks': key}}))
+        elif successor != source['_id']:
+            operations.append(UpdateOne({'_id': source['_id'], 'tenant.userId': user},
+                                        {'$addToSet': {'links.note': successor}}))
+            operations.append(UpdateOne({'_id': successor, 'tenant.userId': user},
+                                        {'$addToSet': {'backlinks.note': source['_id']}}))
+    if dropped:
+        operations.append(UpdateOne({'_id': current, 'tenant.userId': user},
+                                    {'$pull': {'backlinks.note': {'$in': dropped}}}))
+    return dropped, operations
+
+
+def _oldest_titled(user: ObjectId, key: str, other_than: ObjectId) -> Optional[dict]:
+    return _notes().find_one({'tenant.userId': user, 'titleKey': key, '_id': {'$ne': other_than}},
+                             {'audit.createdAt': 1}, sort=[('audit.createdAt', 1)])
+
+
+def rename_operations(user_id, note: dict,
+                      previous: Optional[dict]) -> Tuple[List[ObjectId], List[ObjectId], List[UpdateOne]]:
+    """Title links that move because this note was renamed: (sources gained, sources dropped, updates).
+
+    Links to the old title go to the oldest other note that has it, or wait
+    again; links to the new title held by a younger note come to this one,
+    as ``rebuild`` resolves duplicated titles.
+    """
+    old, key = (previous or {}).get('titleKey'), note['titleKey']
+    if previous is None or old == key:
+        return [], [], []
+    user = ObjectId(user_id)
+    note_id = note['_id']
+    dropped, operations = [], []
+    if old:
+        holder = _oldest_titled(user, old, note_id)
+        dropped, operations = _move_title(user, old, note_id, holder and holder['_id'], keep={key})
+    gained = []
+    rival = _oldest_titled(user, key, note_id)
+    created = (note.get('audit') or {}).get('createdAt')
+    if rival is not None and created is not None and created < ((rival.get('audit') or {}).get('createdAt') or created):
+        gained, moved = _move_title(user, key, rival['_id'], note_id)
+        operations += moved
+    return gained, dropped, operations
+
+
+def unlink_operations(user_id, note: dict) -> List[UpdateOne]:
+    """Updates removing a deleted note from both ends of its edges.
+
+    Notes that linked to it by title wait for that title again.
+    """
+    user = ObjectId(user_id)
+    note_id = note['_id']
+    operations = [UpdateOne({'_id': target, 'tenant.userId': user}, {'$pull': {'backlinks.note': note_id}})
+                  for target in sorted(_note_targets(note))]
+    sources = sorted(set(((note.get('backlinks') or {}).get('note')) or ()))
+    if sources:
+        for source in _notes().find({'_id': {'$in': sources}, 'tenant.userId': user}, {'markdown': 1}):
+            update = {'$pull': {'links.note': note_id}}
+            if note.get('titleKey') in parse(source.get('markdown') or '').titles:
+                update['$addToSet'] = {'unresolvedLinks': note['titleKey']}
+            operations.append(UpdateOne({'_id': source['_id'], 'tenant.userId': user}, update))
+    return operations
+
+
+def apply(operations: List[UpdateOne]) -> int:
+    if not operations:
+        return 0
+    return _notes().bulk_write(operations, ordered=False).modified_count
+
+
+def saved(user_id, note: dict, previous: Optional[dict]) -> dict:
+    """Maintain the graph around a saved note; returns ``note`` with its backlinks as they now are."""
+    waiting, operations = resolve_waiting(user_id, note, previous)
+    gained, dropped, renamed = rename_operations(user_id, note, previous)
+    apply(link_operations(user_id, note, previous) + operations + renamed)
+    if waiting or gained or dropped:
+        backlinks = dict(note.get('backlinks') or {})
+        backlinks['note'] = sorted((set(backlinks.get('note') or ()) | set(waiting) | set(gained)) - set(dropped))
+        note = dict(note, backlinks=backlinks)
+    return note
+
+
+def deleted(user_id, note: dict):
+    apply(unlink_operations(user_id, note))
+
+
+def rebuild(user_id) -> Dict[str, int]:
+    """Recompute every note's links and backlinks of a user (after imports or for notes saved before links)."""
+    user = ObjectId(user_id)
+    notes = list(_notes().find({'tenant.userId': user}, {'title': 1, 'markdown': 1}, sort=[('audit.createdAt', 1)]))
+    notes_by_title = {}
+    for note in notes:
+        notes_by_title.setdefault(title_key(note.get('title') or ''), note['_id'])
+    fields, backlinks = {}, {note['_id']: set() for note in notes}
+    for note in notes:
+        fields[note['_id']] = _link_fields(note['_id'], note.get('title') or '', parse(note.get('markdown') or ''),
+                                           notes_by_title)
+        for target in fields[note['_id']]['links'].get('note', ()):
+            if target in backlinks:
+                backlinks[target].add(note['_id'])
+    operations = [UpdateOne({'_id': note_id}, {'$set': dict(values, backlinks={'note': sorted(backlinks[note_id])})})
+                  for note_id, values in fields.items()]
+    apply(operations)
+    return {'notes': len(notes), 'edges': sum(len(sources) for sources in backlinks.values())}
+
+
+def related(user_id, kind: str, document_id, depth: int = 2, limit: int = MAX_RELATED) -> Optional[dict]:
+    """Everything within ``depth`` hops of a note, trade or journal entry; None if the root note is not the user's.
+
+    Edges are note links (either direction) and a journal entry's trade.
+    Nodes come with their hop count; notes also with their title.
+    """
+    user = ObjectId(user_id)
+    root = (kind, ObjectId(document_id))
+    depth = max(0, min(depth, MAX_DEPTH))
+    titles = {}
+    if kind == 'note':
+        note = _notes().find_one({'_id': root[1], 'tenant.userId': user}, {'title': 1})
+        if note is None:
+            return None
+        titles[root[1]] = note['title']
+    hops = {root: 0}
+    edges = set()  # (from node, to node, relation)
+    frontier = [root]
+    truncated = False
+    for level in range(1, depth + 1):
+        found = []  # (edge, node reached)
+        for edge in _edges(user, frontier, titles):
+            for node in edge[:2]:
+                if node not in hops:
+                    found.append((edge, node))
+            edges.add(edge)
+        frontier = []
+        for edge, node in found:
+            if node in hops:
+                continue
+            if len(hops) >= limit:
+                truncated = True
+                break
+            hops[node] = level
+            frontier.append(node)
+        if not frontier or truncated:
+            break
+
+    untitled = [node_id for node_kind, node_id in hops if node_kind == 'note' and node_id not in titles]
+    if untitled:
+        for note in _notes().find({'_id': {'$in': untitled}, 'tenant.userId': user}, {'title': 1}):
+            titles[note['_id']] = note['title']
+    nodes = []
+    for (node_kind, node_id), hop in sorted(hops.items(), key=lambda item: (item[1], item[0][0], item[0][1])):
+        node = {'kind': node_kind, 'id': str(node_id), 'depth': hop}
+        if node_kind == 'note':
+            if node_id not in titles:
+                continue  # a dangling link to a note that is gone or not the user's
+            node['title'] = titles[node_id]
+        nodes.append(node)
+    shown = {(node['kind'], node['id']) for node in nodes}
+    return {
+        'root': {'kind': kind, 'id': str(root[1])},
+        'nodes': nodes,
+        'edges': [{'from': str(source[1]), 'to': str(target[1]), 'relation': relation}
+                  for source, target, relation in sorted(edges, key=lambda edge: (str(edge[0][1]), str(edge[1][1])))
+                  if (source[0], str(source[1])) in shown and (target[0], str(target[1])) in shown],
+        'truncated': truncated,
+    }
+
+
+def _edges(user: ObjectId, frontier: Iterable[Tuple[str, ObjectId]], titles: Dict[ObjectId, str]):
+    """Edges touching the frontier nodes: up to three indexed queries per level."""
+    ids = {node_kind: [node_id for kind, node_id in frontier if kind == node_kind] for node_kind in NODE_KINDS}
+    if ids['note']:
+        for note in _notes().find({'_id': {'$in': ids['note']}, 'tenant.userId': user},
+                                  {'title': 1, 'links': 1, 'backlinks': 1}):
+            source = ('note', note['_id'])
+            titles[note['_id']] = note['title']
+            for target_kind, targets in (note.get('links') or {}).items():
+                for target in targets:
+                    yield source, (target_kind, target), 'link'
+            for other in (note.get('backlinks') or {}).get('note') or ():
+                yield ('note', other), source, 'link'
+    if ids['trade'] or ids['journal']:
+        linked = [{f'links.{node_kind}': {'$in': ids[node_kind]}} for node_kind in ('trade', 'journal')
+                  if ids[node_kind]]
+        for note in _notes().find({'tenant.userId': user, '$or': linked},
+                                  {'title': 1, 'links.trade': 1, 'links.journal': 1}):
+            titles[note['_id']] = note['title']
+            for target_kind in ('trade', 'journal'):
+                wanted = set(ids[target_kind])
+                for target in (note.get('links') or {}).get(target_kind) or ():
+                    if target in wanted:
+                        yield ('note', note['_id']), (target_kind, target), 'link'
+        # Journal entries belong to a trade through tradeId.
+        entries = [{'_id': {'$in': ids['journal']}}] if ids['journal'] else []
+        entries += [{'tradeId': {'$in': ids['trade']}}] if ids['trade'] else []
+        journal = get_repository(JournalEntryRepository).get_collection()
+        for entry in journal.find({'tenant.userId': user, '$or': entries}, {'tradeId': 1}):
+            if entry.get('tradeId'):
+                yield ('journal', entry['_id']), ('trade', entry['tradeId']), 'trade'
@@ -1,5 +1,8 @@
-from django.http import HttpResponse
+import json
+
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
+from django.template.loader import render_to_string
 from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
@@ -8,9 +11,14 @@ from django.contrib.auth.hashers import check_password
 from datetime import datetime
 from bson import ObjectId
 
+from .caching import cached_fragment, conditional
 from .forms import LoginForm, RegistrationForm, TradeForm
-from main_app.models import client as mongo_client
-from .user_model import UserRepository, client
+from .db import get_repository
+from .middleware import invalidate_principal
+from .pagination import InvalidCursor, encode_cursor, fetch_page, iter_page
+from .models import TradeRepository
+from .user_model import UserRepository
+from .versions import TRADE_LIST_SCOPES
 
 
 def login_page(request):
@@ -19,7 +27,7 @@ def login_page(request):
     if request.method == 'POST':
         form = LoginForm(request.POST)
         if form.is_valid():
-            user_collection = client['tradingApp']['users']
+            user_collection = get_repository(UserRepository).get_collection()
             user_data = user_collection.find_one({'username': form.cleaned_data['username']})
             if user_data and check_password(form.cleaned_data['password'], user_data['hashed_password']):
                 request.session['user_id'] = str(user_data['_id'])
@@ -35,6 +43,8 @@ def login_page(request):
 
 
 def logout_view(request):
+    if request.session.get('user_id'):
+        invalidate_principal(request.session['user_id'])
     request.session.flush()
     messages.info(request, 'You have been logged out.')
     return redirect('about_page')
@@ -46,7 +56,7 @@ def new_trade(request):
         form = TradeForm(request.POST)
         if form.is_valid():
             form.save_to_mongodb(request.user.id)
-            messages.success(request, 'Trade saved.')
+            messages.success(request, 'Trade saved.' if form.created else 'Trade was already saved.')
             return redirect('landing_page')
     else:
         form = TradeForm()
@@ -54,11 +64,104 @@ def new_trade(request):
     return render(request, 'new_trade.html', {'form': form})
 
 
+TRADE_PAGE_SIZE = 25
+MAX_TRADE_PAGE_SIZE = 100
+
+# Only the columns landing.html renders are fetched.
+TRADE_LIST_PROJECTION = {
+    'audit.createdAt': 1,
+    'instrument': 1,
+    'side': 1,
+    'qty': 1,
+    'price': 1,
+    'status': 1,
+    'strategyTag': 1,
+    'realizedPnL': 1,
+}
+
+
+def trade_row(document):
+    """Flatten a projected trade document into the row shown on the landing page."""
+    instrument = document.get('instrument', {})
+    expiry = instrument.get('expiry')
+    return {
+        'id': str(document['_id']),
+        'createdAt': document['audit']['createdAt'].isoformat(),
+        'underlying': instrument.get('underlying'),
+        'optionType': instrument.get('optionType'),
+        'strike': instrument.get('strike'),
+        'expiry': expiry.date().isoformat() if isinstance(expiry, datetime) else expiry,
+        'side': document.get('side'),
+        'qty': document.get('qty'),
+        'price': document.get('price'),
+        'status': document.get('status'),
+        'strategyTag': document.get('strategyTag', []),
+        'realizedPnL': document.get('realizedPnL'),
+    }
+
+
+def _page_size(request):
+    try:
+        return max(1, min(int(request.GET.get('limit', TRADE_PAGE_SIZE)), MAX_TRADE_PAGE_SIZE))
+    except ValueError:
+        return TRADE_PAGE_SIZE
+
+
+def render_trade_table(trades, next_cursor) -> str:
+    return render_to_string('trade_table.html', {
+        'trades': [trade_row(trade) for trade in trades],
+        'next_cursor': next_cursor,
+    })
+
+
 @login_required
+@conditional(*TRADE_LIST_SCOPES)
 def landing_page(request):
-    trades_collection = mongo_client['tradingApp']['trades']
-    user_trades = list(trades_collection.find({'tenant.userId': ObjectId(request.user.id)}).sort('audit.createdAt', -1))
-    return render(request, 'landing_page.html', {'trades': user_trades})
+    def render_table():
+        return render_trade_table(*fetch_page(
+            get_repository(TradeRepository).get_collection(),
+            {'tenant.userId': ObjectId(request.user.id)},
+            'audit.createdAt',
+            TRADE_PAGE_SIZE,
+            projection=TRADE_LIST_PROJECTION,
+        ))
+
+    return render(request, 'landing.html', {
+        'trade_table': cached_fragment(request, request.user.id, 'trade_table', TRADE_LIST_SCOPES, render_table),
+    })
+
+
+@login_required
+@conditional(*TRADE_LIST_SCOPES)
+def load_more_trades(request):
+    """Stream the next page of trades as JSON: {"trades": [...], "next": cursor-or-null}."""
+    limit = _page_size(request)
+    try:
+        documents = iter_page(
+            get_repository(TradeRepository).get_collection(),
+            {'tenant.userId': ObjectId(request.user.id)},
+            'audit.createdAt',
+            limit,
+            after=request.GET.get('after'),
+            projection=TRADE_LIST_PROJECTION,
+        )
+    except InvalidCursor as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+
+    def stream():
+        yield '{"trades":['
+        last = None
+        for count, document in enumerate(documents):
+            if count == limit:
+                break
+            yield (',' if count else '') + json.dumps(trade_row(document))
+            last = document
+        else:
+            last = None
+        next_cursor = encode_cursor(last, 'audit.createdAt') if last is not None else None
+        yield '],"next":' + json.dumps(next_cursor) + '}'
+
+    return StreamingHttpResponse(stream(), content_type='application/json')
 
 
 def register_page(request):
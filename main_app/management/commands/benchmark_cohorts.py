@@ -0,0 +1,64 @@
+"""Compare server-side cohort aggregation with the client-side Python path."""
+
+import math
+import statistics
+import time
+
+import bson
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app.cohort_queries import COHORT_FIELDS, cohort_pipeline, python_cohort_stats, trade_match
+from main_app.db import get_repository
+from main_app.models import TradeRepository
+
+
+class Command(BaseCommand):
+    help = "Time $facet cohort aggregation against fetching trades and grouping in Python."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='User id whose trades are grouped.')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        collection = get_repository(TradeRepository).get_collection()
+        user_id = options['user']
+        projection = {field: 1 for field in COHORT_FIELDS.values()}
+        projection.update({'realizedPnL': 1, 'closeTs': 1})
+
+        def mongo_path():
+            return next(collection.aggregate(cohort_pipeline(user_id)))
+
+        def python_path():
+            documents = list(collection.find(trade_match(user_id), projection))
+            python_path.transferred = sum(len(bson.encode(document)) for document in documents)
+            return python_cohort_stats(documents)
+
+        timings = {}
+        results = {}
+        for name, path in (('mongo', mongo_path), ('python', python_path)):
+            samples = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                results[name] = path()
+                samples.append(time.perf_counter() - started)
+            timings[name] = statistics.median(samples)
+
+        if not self.same_rows(results['mongo'], results['python']):
+            raise CommandError("Aggregation and Python fallback disagree")
+
+        rows = sum(len(group) for group in results['mongo'].values())
+        self.stdout.write(f"mongo:  {timings['mongo'] * 1000:.1f} ms median, "
+                          f"{len(bson.encode(results['mongo']))} bytes, {rows} rows")
+        self.stdout.write(f"python: {timings['python'] * 1000:.1f} ms median, "
+                          f"{python_path.transferred} bytes of trades")
+
+    @staticmethod
+    def same_rows(left, right):
+        for cohort in COHORT_FIELDS:
+            a, b = left.get(cohort, []), right.get(cohort, [])
+            if [row['_id'] for row in a] != [row['_id'] for row in b]:
+                return False
+            for x, y in zip(a, b):
+                if any(not math.isclose(x[key], y[key], rel_tol=1e-9, abs_tol=1e-9) for key in x if key != '_id'):
+                    return False
+        return True
@@ -0,0 +1,114 @@
+"""Concurrent-user load test of the ASGI request path against a local mongod."""
+
+import asyncio
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from importlib import import_module
+
+from bson import ObjectId
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient
+
+from main_app.db import async_connection_manager, get_repository
+from main_app.middleware import invalidate_principal
+from main_app.models import TradeRepository
+from main_app.user_model import UserRepository
+
+LOAD_USERNAME = 'loadtest'
+HOST = 'localhost'  # AsyncClient's default "testserver" is not in ALLOWED_HOSTS
+DEFAULT_PATHS = ['/landing/', '/landing/trades/?limit=50', '/api/trades/?limit=50', '/api/analytics/']
+
+
+def ensure_load_user(trades: int) -> ObjectId:
+    """The load-test user, created with ``trades`` synthetic trades if missing."""
+    users = get_repository(UserRepository).get_collection()
+    user = users.find_one({'username': LOAD_USERNAME}, {'_id': 1})
+    if user is not None:
+        return user['_id']
+    user_id, org_id = ObjectId(), ObjectId()
+    users.insert_one({
+        '_id': user_id, 'orgId': org_id, 'username': LOAD_USERNAME, 'email': 'loadtest@example.com',
+        'hashed_password': make_password(None), 'role': 'reader',
+    })
+    invalidate_principal(user_id)
+    start = datetime.now(timezone.utc) - timedelta(days=365)
+    get_repository(TradeRepository).get_collection().insert_many([{
+        'tenant': {'orgId': org_id, 'userId': user_id},
+        'audit': {'createdAt': start + timedelta(minutes=30 * index)},
+        'instrument': {'underlying': 'SPY', 'optionType': 'CALL' if index % 2 else 'PUT',
+                       'strike': 400.0 + index % 50, 'expiry': datetime(2025, 12, 19)},
+        'side': 'BUY', 'qty': 1, 'price': 2.0, 'fees': 0.0,
+        'openTs': start + timedelta(minutes=30 * index), 'closeTs': None,
+        'status': 'CLOSED' if index % 3 else 'OPEN', 'strategyTag': ['daily support breakout'],
+        'marketSentimentTag': [], 'regimeTagIds': [], 'journalEntryIds': [], 'screenshotIds': [],
+        'realizedPnL': float(index % 7 - 3) * 10 if index % 3 else None,
+    } for index in range(trades)])
+    return user_id
+
+
+def session_cookie(user_id: ObjectId) -> str:
+    store = import_module(settings.SESSION_ENGINE).SessionStore()
+    store['user_id'] = str(user_id)
+    store['username'] = LOAD_USERNAME
+    store.save()
+    return store.session_key
+
+
+async def run_user(cookie: str, paths, requests: int, latencies: list, errors: list):
+    client = AsyncClient(headers={'host': HOST})
+    client.cookies[settings.SESSION_COOKIE_NAME] = cookie
+    for index in range(requests):
+        path = paths[index % len(paths)]
+        started = time.perf_counter()
+        response = await client.get(path)
+        if getattr(response, 'streaming', False):
+            if response.is_async:
+                async for _ in response.streaming_content:
+                    pass
+            else:
+                for _ in response.streaming_content:
+                    pass
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            errors.append((path, response.status_code))
+
+
+class Command(BaseCommand):
+    help = ("Drive the ASGI handler with many concurrent logged-in users. Run once with ASYNC_VIEWS=0 "
+            "(sync views in threads) and once with ASYNC_VIEWS=1 (async views) to compare.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Concurrent users.')
+        parser.add_argument('--requests', type=int, default=20, help='Requests per user.')
+        parser.add_argument('--path', action='append', default=[], help='Path to request (repeatable).')
+        parser.add_argument('--trades', type=int, default=5000, help='Trades of a newly created load-test user.')
+
+    def handle(self, *args, **options):
+        user_id = ensure_load_user(options['trades'])
+        cookie = session_cookie(user_id)
+        paths = options['path'] or DEFAULT_PATHS
+        latencies, errors = [], []
+
+        async def main():
+            await AsyncClient(headers={'host': HOST}).get('/login/')  # warm up URL resolution and templates
+            started = time.perf_counter()
+            await asyncio.gather(*(run_user(cookie, paths, options['requests'], latencies, errors)
+                                   for _ in range(options['users'])))
+            elapsed = time.perf_counter() - started
+            await async_connection_manager.close()
+            return elapsed
+
+        elapsed = asyncio.run(main())
+        if errors:
+            raise CommandError(f"{len(errors)} failed requests, e.g. {errors[0]}")
+        latencies.sort()
+        mode = 'async views' if settings.ASYNC_VIEWS else 'sync views'
+        self.stdout.write(
+            f"{mode}: {len(latencies)} requests from {options['users']} users in {elapsed:.2f}s "
+            f"= {len(latencies) / elapsed:.0f} req/s; latency p50 {statistics.median(latencies) * 1000:.1f} ms, "
+            f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms, "
+            f"max {latencies[-1] * 1000:.1f} ms"
+        )
@@ -0,0 +1,94 @@
+"""Compare the DRF serializer path with the Pydantic fast path for trade payloads."""
+
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from main_app.db import get_repository
+from main_app.models import TradeRepository
+from main_app.schemas import TRADE_SCHEMA
+from main_app.serializers import TradeListSerializer
+
+
+def synthetic_trades(count: int, seed: int = 0):
+    """Trade documents as pymongo returns them (naive UTC datetimes, ObjectIds)."""
+    rng = random.Random(seed)
+    tenant = {'orgId': ObjectId(), 'userId': ObjectId()}
+    start = datetime(2024, 1, 2, 14, 30)
+    trades = []
+    for index in range(count):
+        opened = start + timedelta(minutes=17 * index)
+        closed = rng.random() < 0.7
+        trades.append({
+            '_id': ObjectId(),
+            'tenant': tenant,
+            'audit': {'createdAt': opened, 'updatedAt': None, 'deletedAt': None},
+            'brokerRef': f'B{index:08d}',
+            'dedupeKey': f'ref:B{index:08d}',
+            'instrument': {'underlying': rng.choice(['SPY', 'QQQ', 'IWM']), 'optionType': rng.choice(['CALL', 'PUT']),
+                           'strike': float(rng.randrange(380, 520)), 'expiry': datetime(2024, 3, 15)},
+            'side': rng.choice(['BUY', 'SELL', 'SHORT', 'COVER']),
+            'qty': rng.randrange(1, 20),
+            'price': round(rng.uniform(0.5, 12.0), 2),
+            'fees': 1.3,
+            'openTs': opened,
+            'closeTs': opened + timedelta(minutes=rng.randrange(5, 300)) if closed else None,
+            'status': 'CLOSED' if closed else 'OPEN',
+            'strategyTag': ['daily support breakout'],
+            'marketSentimentTag': [],
+            'regimeTagIds': [ObjectId()],
+            'journalEntryIds': [],
+            'screenshotIds': [],
+            'realizedPnL': round(rng.gauss(20, 150), 2) if closed else None,
+            'unrealizedPnL': None,
+            'mae': None,
+            'mfe': None,
+        })
+    return trades
+
+
+class Command(BaseCommand):
+    help = "Time DRF Serializer + JSONRenderer against Pydantic validate/dump_json on a trade list."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trades', type=int, default=10_000, help='Synthetic payload size.')
+        parser.add_argument('--user', help="Use this user's stored trades instead of synthetic ones.")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        if options['user']:
+            documents = list(get_repository(TradeRepository).get_collection().find(
+                {'tenant.userId': ObjectId(options['user'])}, TRADE_SCHEMA.projection(),
+            ))
+        else:
+            documents = synthetic_trades(options['trades'])
+        renderer = JSONRenderer()
+
+        def drf_path():
+            return renderer.render(TradeListSerializer(documents, many=True).data)
+
+        def pydantic_path():
+            return TRADE_SCHEMA.dump_many(documents)
+
+        timings, payloads = {}, {}
+        for name, path in (('drf', drf_path), ('pydantic', pydantic_path)):
+            samples = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                payloads[name] = path()
+                samples.append(time.perf_counter() - started)
+            timings[name] = statistics.median(samples)
+
+        if json.loads(payloads['drf']) != json.loads(payloads['pydantic']):
+            raise CommandError("DRF and Pydantic payloads differ")
+
+        for name in ('drf', 'pydantic'):
+            self.stdout.write(f"{name + ':':<9} {timings[name] * 1000:8.1f} ms median, "
+                              f"{len(payloads[name])} bytes, {len(documents)} trades")
+        self.stdout.write(f"speedup:  {timings['drf'] / timings['pydantic']:.1f}x")
@@ -0,0 +1,37 @@
+"""Precompute AnalyticsSnapshot documents for one or all users (full rebuild)."""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from main_app.analytics import GRANULARITIES, build_snapshots, load_trade_columns
+from main_app.db import get_repository
+from main_app.incremental_analytics import stale_users
+from main_app.models import TradeRepository
+
+
+class Command(BaseCommand):
+    help = "Compute daily/weekly/monthly analytics snapshots from closed trades."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[],
+                            help='User id to rebuild (repeatable); defaults to every user with trades.')
+        parser.add_argument('--granularity', action='append', choices=GRANULARITIES, default=[],
+                            help='Only build this granularity (repeatable).')
+        parser.add_argument('--stale', action='store_true',
+                            help='Only rebuild users whose incrementally maintained snapshots are marked stale.')
+
+    def handle(self, *args, **options):
+        if options['stale']:
+            user_ids = stale_users()
+        else:
+            user_ids = options['user'] or get_repository(TradeRepository).get_collection().distinct('tenant.userId')
+        granularities = options['granularity'] or GRANULARITIES
+        for user_id in user_ids:
+            started = time.perf_counter()
+            columns = load_trade_columns(user_id)
+            written = build_snapshots(user_id, granularities, columns=columns)
+            self.stdout.write(
+                f"{user_id}: {len(columns)} closed trades, {written} snapshots "
+                f"in {time.perf_counter() - started:.2f}s"
+            )
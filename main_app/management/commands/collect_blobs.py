@@ -0,0 +1,22 @@
+"""Delete attachment blobs that nothing refers to any more."""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from main_app.attachments import GARBAGE_GRACE, collect_garbage
+
+
+class Command(BaseCommand):
+    help = "Remove blobs (and abandoned uploads) unused for the grace period from the attachment store."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-minutes', type=int, default=int(GARBAGE_GRACE.total_seconds() // 60),
+                            help='Leave blobs stored more recently than this alone.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be deleted.')
+
+    def handle(self, *args, **options):
+        totals = collect_garbage(timedelta(minutes=options['grace_minutes']), options['dry_run'])
+        verb = 'would delete' if options['dry_run'] else 'deleted'
+        self.stdout.write(f"{totals['checked']} old blobs checked, {verb} {totals['deleted']} unreferenced; "
+                          f"{totals['incoming']} abandoned uploads discarded")
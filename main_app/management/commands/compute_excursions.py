@@ -0,0 +1,23 @@
+"""Compute MAE/MFE for closed trades from the local bar store."""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from main_app.excursions import update_excursions
+
+
+class Command(BaseCommand):
+    help = "Fill Trade.mae/mfe from intraday bars and queue analytics rebuilds for affected users."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[], help='Only this user (repeatable).')
+        parser.add_argument('--recompute', action='store_true', help='Also redo trades that already have MAE/MFE.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        totals = update_excursions(options['user'] or None, options['recompute'])
+        self.stdout.write(
+            f"{totals['updated']} of {totals['trades']} trades updated ({totals['withoutBars']} without bars), "
+            f"{totals['users']} analytics rebuilds queued in {time.perf_counter() - started:.2f}s"
+        )
@@ -0,0 +1,68 @@
+"""Build the indexes declared on each repository's Meta and report index usage."""
+
+from django.core.management.base import BaseCommand, CommandError
+from pymongo.errors import OperationFailure
+
+from main_app.db import ensure_collection, ensure_indexes, get_repository, index_models, repository_classes
+
+
+class Command(BaseCommand):
+    help = "Create declared MongoDB indexes and time-series collections (idempotent) and print $indexStats usage."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collection', action='append', default=[],
+                            help='Only handle this collection (repeatable).')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='List the declared indexes without creating them.')
+        parser.add_argument('--stats-only', action='store_true',
+                            help='Skip index creation and only report usage statistics.')
+
+    def handle(self, *args, **options):
+        repositories = [
+            repo for repo in repository_classes()
+            if not options['collection'] or repo.Meta.collection_name in options['collection']
+        ]
+        if not repositories:
+            raise CommandError(f"No repository matches {options['collection']}")
+
+        failures = 0
+        for repository_class in repositories:
+            name = repository_class.Meta.collection_name
+            if options['dry_run']:
+                for model in index_models(repository_class):
+                    self.stdout.write(f"{name}: {model.document['name']} {dict(model.document['key'])}")
+                continue
+            if not options['stats_only']:
+                try:
+                    layout = ensure_collection(repository_class)
+                    created = ensure_indexes(repository_class)
+                except OperationFailure as exc:
+                    failures += 1
+                    self.stderr.write(self.style.ERROR(f"{name}: {exc}"))
+                    continue
+                if layout == 'created':
+                    self.stdout.write(self.style.SUCCESS(f"{name}: created as a time-series collection"))
+                elif layout == 'regular':
+                    self.stderr.write(self.style.WARNING(
+                        f"{name}: declared time-series but exists as a regular collection; "
+                        f"copy it into a new time-series collection to change the layout"))
+                self.stdout.write(self.style.SUCCESS(f"{name}: ensured {', '.join(created) or 'no indexes'}"))
+            self.report_usage(repository_class)
+
+        if failures:
+            raise CommandError(f"{failures} collection(s) failed index creation")
+
+    def report_usage(self, repository_class):
+        collection = get_repository(repository_class).get_collection()
+        try:
+            rows = list(collection.aggregate([{'$indexStats': {}}]))
+        except OperationFailure as exc:
+            self.stderr.write(f"  $indexStats unavailable: {exc}")
+            return
+        for row in sorted(rows, key=lambda r: r['name']):
+            accesses = row.get('accesses', {})
+            since = accesses.get('since')
+            self.stdout.write(
+                f"  {row['name']}: {accesses.get('ops', 0)} ops"
+                + (f" since {since:%Y-%m-%d %H:%M}" if since else '')
+            )
@@ -0,0 +1,46 @@
+"""Import a broker CSV export into the trades collection."""
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app.db import get_repository
+from main_app.importer import BATCH_SIZE, MAPPING_TEMPLATES
+from main_app.jobs import enqueue, run_now, worker_name
+from main_app.models import ImportJobRepository
+from main_app.user_model import tenant_for
+
+
+class Command(BaseCommand):
+    help = "Create an ImportJob for a CSV file and run it (or leave it to run_worker with --enqueue)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='CSV file path or CSV attachment id.')
+        parser.add_argument('--user', required=True, help='Owner of the imported trades.')
+        parser.add_argument('--template', default='default', choices=sorted(MAPPING_TEMPLATES))
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--enqueue', action='store_true', help='Only queue the job for a worker.')
+
+    def handle(self, *args, **options):
+        try:
+            tenant = tenant_for(ObjectId(options['user']))
+        except ValueError as exc:
+            raise CommandError(str(exc)) from exc
+        job_id = enqueue('import', tenant, options['source'], options['template'])
+        if options['enqueue']:
+            self.stdout.write(f"Job {job_id} queued")
+            return
+
+        worker = worker_name()
+        run_now({'_id': job_id}, worker, batch_size=options['batch_size'])
+        job = get_repository(ImportJobRepository).get_collection().find_one({'_id': job_id})
+        if job['status'] != 'COMPLETED':
+            last = job['errors'][-1]['error'] if job['errors'] else 'unknown error'
+            raise CommandError(f"Job {job_id} {job['status'].lower()}: {last}")
+        # Run the snapshot rebuild the import queued, too, rather than waiting for a worker.
+        run_now({'kind': 'analytics_rebuild', 'tenant.userId': tenant['userId']}, worker)
+
+        stats = job['stats']
+        self.stdout.write(self.style.SUCCESS(
+            f"Job {job_id}: {stats.get('rowsInserted', 0)} of {stats.get('rowsRead', 0)} rows imported, "
+            f"{stats.get('rowsDuplicate', 0)} duplicates skipped, {stats.get('rowsFailed', 0)} failed"
+        ))
@@ -0,0 +1,46 @@
+"""Load intraday OHLC bars from a CSV file into the local bar store."""
+
+import csv
+from datetime import datetime, timezone
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app.bars import BAR_DTYPE, BarStore
+
+
+def _timestamp_ms(value: str) -> int:
+    if value.isdigit():
+        return int(value) if len(value) > 10 else int(value) * 1000  # epoch ms or s
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+class Command(BaseCommand):
+    help = "Merge a CSV of bars (ts, open, high, low, close[, symbol]) into BAR_STORE_DIR."
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='CSV file with ts (ISO or epoch), open, high, low, close columns.')
+        parser.add_argument('--symbol', help='Symbol for every row; otherwise read from a "symbol" column.')
+
+    def handle(self, *args, **options):
+        rows = {}
+        try:
+            with open(options['source'], newline='', encoding='utf-8-sig') as source:
+                for row in csv.DictReader(source):
+                    symbol = options['symbol'] or row.get('symbol')
+                    if not symbol:
+                        raise CommandError("No --symbol given and the file has no symbol column")
+                    rows.setdefault(symbol.upper(), []).append((
+                        _timestamp_ms(row['ts'].strip()), float(row['open']), float(row['high']),
+                        float(row['low']), float(row['close']),
+                    ))
+        except (OSError, KeyError, ValueError) as exc:
+            raise CommandError(f"Cannot read bars: {exc}") from exc
+
+        store = BarStore()
+        for symbol, bars in rows.items():
+            days = store.write(symbol, np.array(bars, dtype=BAR_DTYPE))
+            self.stdout.write(f"{symbol}: {len(bars)} bars over {days} days")
@@ -0,0 +1,27 @@
+"""Recompute the notebook link graph from note markdown."""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from main_app.db import get_repository
+from main_app.links import rebuild
+from main_app.models import NotebookNoteRepository
+from main_app.versions import NOTES, bump_data_versions
+
+
+class Command(BaseCommand):
+    help = "Re-parse [[links]] of every note and rewrite links, unresolvedLinks and backlinks (e.g. after imports)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[],
+                            help='User id to rebuild (repeatable); defaults to every user with notes.')
+
+    def handle(self, *args, **options):
+        user_ids = options['user'] or get_repository(NotebookNoteRepository).get_collection().distinct('tenant.userId')
+        for user_id in user_ids:
+            started = time.perf_counter()
+            totals = rebuild(user_id)
+            self.stdout.write(f"{user_id}: {totals['notes']} notes, {totals['edges']} note links "
+                              f"in {time.perf_counter() - started:.2f}s")
+        bump_data_versions(user_ids, (NOTES,))
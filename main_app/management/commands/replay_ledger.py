@@ -0,0 +1,37 @@
+"""Rebuild positions and trade P&L from fills by lot matching."""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from main_app.analytics import build_snapshots
+from main_app.db import get_repository
+from main_app.ledger import METHODS, replay_user
+from main_app.models import TradeRepository
+from main_app.versions import bump_data_versions
+
+
+class Command(BaseCommand):
+    help = "Match BUY/SELL/SHORT/COVER fills into lots and write realized/unrealized P&L back."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[],
+                            help='User id to replay (repeatable); defaults to every user with trades.')
+        parser.add_argument('--method', choices=METHODS, help='Lot matching method (default: LEDGER_METHOD).')
+        parser.add_argument('--skip-analytics', action='store_true',
+                            help='Do not rebuild analytics snapshots when realized P&L changed.')
+
+    def handle(self, *args, **options):
+        user_ids = options['user'] or get_repository(TradeRepository).get_collection().distinct('tenant.userId')
+        for user_id in user_ids:
+            started = time.perf_counter()
+            totals = replay_user(user_id, options['method'])
+            self.stdout.write(
+                f"{user_id}: {totals['fills']} fills in {totals['positions']} positions, "
+                f"{totals['updated']} trades updated, {totals['unmatchedQty']:g} unmatched closing qty "
+                f"in {time.perf_counter() - started:.2f}s"
+            )
+            if totals['updated']:
+                bump_data_versions([user_id])
+            if totals['realizedChanged'] and not options['skip_analytics']:
+                build_snapshots(user_id)
@@ -0,0 +1,29 @@
+"""Mark open option lots to market from a local price file."""
+
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main_app.revaluation import RevaluationFailed, revalue
+
+
+class Command(BaseCommand):
+    help = "Revalue every OPEN trade from a CSV/Parquet price file (Black-Scholes when a mark is missing)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('prices', help='CSV or Parquet file: underlying, optionType, strike, expiry, mark.')
+        parser.add_argument('--as-of', type=date.fromisoformat, help='Valuation date (default: today, UTC).')
+        parser.add_argument('--rate', type=float, help='Risk-free rate for the fallback (default: RISK_FREE_RATE).')
+        parser.add_argument('--dry-run', action='store_true', help='Price everything but write nothing.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            totals = revalue(options['prices'], options['as_of'], options['rate'], dry_run=options['dry_run'])
+        except RevaluationFailed as exc:
+            raise CommandError(str(exc)) from exc
+        self.stdout.write(self.style.SUCCESS(
+            f"{totals['trades']} open trades: {totals['marked']} marked, {totals['theoretical']} theoretical, "
+            f"{totals['unpriced']} unpriced; {totals['updated']} updated in {time.perf_counter() - started:.2f}s"
+        ))
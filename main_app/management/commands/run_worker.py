@@ -0,0 +1,57 @@
+"""Run background jobs (CSV imports, analytics rebuilds, thumbnails) from the import_jobs queue."""
+
+import multiprocessing
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main_app.jobs import work, worker_name
+
+
+def _process_main(index, stop, poll_seconds, lease_seconds, burst):
+    # The parent owns shutdown; a Ctrl-C must not interrupt a job halfway through.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    work(worker_name(index), stop, poll_seconds, lease_seconds, burst)
+
+
+class Command(BaseCommand):
+    help = "Claim and run queued ImportJobs with a pool of worker threads or processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.WORKER_CONCURRENCY)
+        parser.add_argument('--processes', action='store_true',
+                            help='Use worker processes instead of threads (CPU-bound analytics).')
+        parser.add_argument('--poll', type=float, default=settings.WORKER_POLL_SECONDS,
+                            help='Seconds to sleep when the queue is empty.')
+        parser.add_argument('--lease', type=int, default=settings.JOB_LEASE_SECONDS,
+                            help='Lease length in seconds; heartbeats renew it every third of that.')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        concurrency = max(options['concurrency'], 1)
+        arguments = (options['poll'], options['lease'], options['burst'])
+        if options['processes']:
+            stop = multiprocessing.Event()
+            workers = [multiprocessing.Process(target=_process_main, args=(index, stop) + arguments)
+                       for index in range(concurrency)]
+        else:
+            stop = threading.Event()
+            workers = [threading.Thread(target=work, args=(worker_name(index), stop) + arguments)
+                       for index in range(concurrency)]
+
+        def shutdown(signum, frame):
+            self.stdout.write("Stopping after the current jobs finish...")
+            stop.set()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+        kind = 'processes' if options['processes'] else 'threads'
+        self.stdout.write(f"Worker running with {concurrency} {kind}")
+        for worker in workers:
+            worker.start()
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(timeout=0.5)
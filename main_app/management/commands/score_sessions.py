@@ -0,0 +1,32 @@
+"""Recompute adherence scores and net screen time of sessions."""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from main_app.analytics import build_snapshots
+from main_app.db import get_repository
+from main_app.models import SessionRepository
+from main_app.time_tracking import score_sessions
+
+
+class Command(BaseCommand):
+    help = "Score every closed session (adherence, net screen time, trades and rule violations) in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[],
+                            help='User id to score (repeatable); defaults to every user with sessions.')
+        parser.add_argument('--skip-analytics', action='store_true',
+                            help='Do not rebuild analytics snapshots to refresh their screen time.')
+
+    def handle(self, *args, **options):
+        user_ids = options['user'] or get_repository(SessionRepository).get_collection().distinct('tenant.userId')
+        for user_id in user_ids:
+            started = time.perf_counter()
+            totals = score_sessions(user_id)
+            self.stdout.write(
+                f"{user_id}: {totals['sessions']} sessions ({totals['open']} open), "
+                f"{totals['updated']} updated in {time.perf_counter() - started:.2f}s"
+            )
+            if totals['updated'] and not options['skip_analytics']:
+                build_snapshots(user_id)
@@ -0,0 +1,35 @@
+"""Monte Carlo risk of ruin over a user's full trade history, on a process pool."""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main_app.db import get_repository
+from main_app.models import TradeRepository
+
+
+class Command(BaseCommand):
+    help = "Simulate risk of ruin without the per-request step cap, forking EQUITY_MC_WORKERS processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[],
+                            help='User id to simulate (repeatable); defaults to every user with trades.')
+        parser.add_argument('--paths', type=int, default=100_000, help='Resampled paths per user.')
+        parser.add_argument('--horizon', type=int, help='Trades per path (default: trades observed).')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--workers', type=int, help='Processes (default: EQUITY_MC_WORKERS).')
+
+    def handle(self, *args, **options):
+        from main_app.equity import equity_curve, simulate_ruin  # NumPy, only when simulating
+
+        workers = options['workers'] or settings.EQUITY_MC_WORKERS
+        user_ids = options['user'] or get_repository(TradeRepository).get_collection().distinct('tenant.userId')
+        for user_id in user_ids:
+            started = time.perf_counter()
+            result = simulate_ruin(equity_curve(user_id).pnl, paths=options['paths'], horizon=options['horizon'],
+                                   seed=options['seed'], workers=workers)
+            self.stdout.write(
+                f"{user_id}: {result['probability']:.4%} of {result['paths']} paths lose {result['capital']:g} "
+                f"within {result['horizon']} trades in {time.perf_counter() - started:.2f}s"
+            )
@@ -0,0 +1,137 @@
+"""Import-time profile of a cold start: what a fresh worker loads before its first response."""
+
+import json
+import os
+import subprocess
+import sys
+from typing import List, NamedTuple, Optional
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+ENTRY_POINTS = {'wsgi': 'walk.wsgi', 'asgi': 'api.asgi'}
+DEFAULT_PATHS = ['/login/', '/landing/', '/api/trades/']
+
+# Run in a fresh interpreter: this process has already imported everything. -X importtime does not see
+# importlib.import_module (how Django loads app models, middleware and URLconfs), so the probe times those.
+PROBE = """
+import importlib, json, os, sys, time
+dynamic = {{}}
+import_module = importlib.import_module
+def timed_import_module(name, package=None):
+    if name in sys.modules:
+        return import_module(name, package)
+    began = time.perf_counter()
+    try:
+        return import_module(name, package)
+    finally:
+        dynamic[name] = time.perf_counter() - began
+importlib.import_module = timed_import_module
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', {settings_module!r})
+started = time.perf_counter()
+import {entry}
+loaded = time.perf_counter()
+from django.urls import resolve
+for path in {paths!r}:
+    resolve(path)  # imports the URLconf and view modules, as the first request would
+resolved = time.perf_counter()
+print(json.dumps({{'application': loaded - started, 'urls': resolved - loaded, 'modules': sorted(sys.modules),
+                  'dynamic': dynamic}}))
+"""
+
+
+class ImportRecord(NamedTuple):
+    module: str
+    self_us: Optional[int]  # None for modules loaded by import_module, whose own time is not separated
+    cumulative_us: int
+
+
+class ColdStart(NamedTuple):
+    application: float  # seconds to import the entry point (settings, django.setup(), middleware)
+    urls: float  # seconds to resolve the probe paths
+    modules: List[str]
+    imports: List[ImportRecord]
+
+    @property
+    def total(self) -> float:
+        return self.application + self.urls
+
+
+def parse_importtime(stderr: str) -> List[ImportRecord]:
+    """Records of ``python -X importtime`` output (``import time: self | cumulative | name``)."""
+    records = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        if not self_us.strip().isdigit():
+            continue  # the header line
+        records.append(ImportRecord(name.strip(), int(self_us), int(cumulative_us)))
+    return records
+
+
+def cold_start(entry: str, paths: List[str]) -> ColdStart:
+    probe = PROBE.format(settings_module=os.environ.get('DJANGO_SETTINGS_MODULE', 'walk.settings'),
+                         entry=entry, paths=paths)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', probe], cwd=settings.BASE_DIR,
+                            capture_output=True, text=True)
+    if result.returncode:
+        raise CommandError(f"Cold start of {entry} failed:\n{result.stderr[-2000:]}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    imports = parse_importtime(result.stderr)
+    imports += [ImportRecord(module, None, int(seconds * 1_000_000)) for module, seconds in timings['dynamic'].items()]
+    return ColdStart(timings['application'], timings['urls'], timings['modules'], imports)
+
+
+class Command(BaseCommand):
+    help = ("Start the app in fresh interpreters and report import time per module, so cold-start "
+            "latency is measured; --budget-ms and STARTUP_DEFERRED_MODULES turn it into a check.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entry', choices=ENTRY_POINTS, default='wsgi', help='Entry point to start.')
+        parser.add_argument('--path', action='append', default=[],
+                            help='URL to resolve after startup (repeatable); defaults to the hot pages.')
+        parser.add_argument('--repeat', type=int, default=3, help='Cold starts to run; the median one is reported.')
+        parser.add_argument('--limit', type=int, default=25, help='Modules to list.')
+        parser.add_argument('--package', default='main_app', help='Also list every module of this package.')
+        parser.add_argument('--budget-ms', type=float, default=settings.STARTUP_BUDGET_MS,
+                            help='Fail when the median cold start exceeds this (0: report only).')
+
+    def handle(self, *args, **options):
+        entry = ENTRY_POINTS[options['entry']]
+        runs = sorted((cold_start(entry, options['path'] or DEFAULT_PATHS) for _ in range(max(1, options['repeat']))),
+                      key=lambda run: run.total)
+        run = runs[len(runs) // 2]
+        imports = run.imports
+        self.stdout.write(
+            f"{entry}: cold start {run.total * 1000:.0f} ms (median of {len(runs)}; "
+            f"min {runs[0].total * 1000:.0f}, max {runs[-1].total * 1000:.0f}) = "
+            f"application {run.application * 1000:.0f} ms + URL resolution {run.urls * 1000:.0f} ms; "
+            f"{len(imports)} modules imported"
+        )
+
+        self.write_table(f"Top {options['limit']} imports by cumulative time",
+                         sorted(imports, key=lambda record: record.cumulative_us, reverse=True)[:options['limit']])
+        package = options['package']
+        if package:
+            self.write_table(f"{package} modules",
+                             [record for record in imports
+                              if record.module == package or record.module.startswith(package + '.')])
+
+        loaded = set(run.modules)
+        deferred = [module for module in settings.STARTUP_DEFERRED_MODULES if module in loaded]
+        self.stdout.write(f"Deferred modules loaded at startup: {', '.join(deferred) or 'none'}")
+        failures = []
+        if deferred:
+            failures.append(f"{', '.join(deferred)} should only load on first use")
+        if options['budget_ms'] and run.total * 1000 > options['budget_ms']:
+            failures.append(f"cold start {run.total * 1000:.0f} ms is over the {options['budget_ms']:g} ms budget")
+        if failures:
+            raise CommandError('; '.join(failures))
+
+    def write_table(self, title: str, records: List[ImportRecord]):
+        self.stdout.write(f"\n{title}:\n{'cumulative':>12} {'self':>8}  module")
+        for record in records:
+            own = '-' if record.self_us is None else f"{record.self_us / 1000:.1f}"
+            self.stdout.write(f"{record.cumulative_us / 1000:>9.1f} ms {own:>5} ms  {record.module}")
+        self.stdout.write('')
@@ -0,0 +1,34 @@
+"""Attach market regimes to trades from MarketFactor history."""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from main_app.jobs import enqueue_analytics_rebuild
+from main_app.regimes import tag_user, tagged_users
+
+
+class Command(BaseCommand):
+    help = "Set Trade.regimeTagIds from market factors and queue analytics rebuilds for affected users."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[], help='Only this user (repeatable).')
+        parser.add_argument('--retag-all', action='store_true',
+                            help='Reclassify trades that already have regimes (after changing REGIME_THRESHOLDS).')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        users = options['user'] or tagged_users()
+        updated = rebuilds = 0
+        for user_id in users:
+            totals = tag_user(user_id, retag=options['retag_all'])
+            updated += totals['updated']
+            if totals['updated']:
+                enqueue_analytics_rebuild(totals['tenant'])
+                rebuilds += 1
+            self.stdout.write(
+                f"{user_id}: {totals['matched']} of {totals['trades']} trades matched "
+                f"{totals['factors']} factor days, {totals['updated']} updated"
+            )
+        self.stdout.write(f"{updated} trades updated, {rebuilds} analytics rebuilds queued "
+                          f"in {time.perf_counter() - started:.2f}s")
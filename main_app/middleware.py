@@ -1,28 +1,221 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
-from .user_model import client
+from django.utils.functional import SimpleLazyObject
+
+from .db import get_async_repository, get_repository
+from .user_model import UserRepository
+
+SESSION_PRINCIPAL_KEY = '_principal'
+
+
+class SimpleUser:
+    def __init__(self, data):
+        self.id = str(data['_id'])
+        self.username = data['username']
+        self.is_authenticated = True
+        self.is_active = True
+
+
+class PrincipalCache:
+    """Bounded LRU of authenticated principals keyed by user id, with a TTL."""
+
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._invalidated_at = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.session_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[user_id]
+        return None
+
+    def put(self, user_id, principal):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, principal)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            now = time.time()
+            # Oldest first: anything cached before an invalidation older than the TTL is stale anyway.
+            for stale, invalidated_at in list(self._invalidated_at.items()):
+                if invalidated_at + self.ttl > now:
+                    break
+                del self._invalidated_at[stale]
+            self._invalidated_at.pop(user_id, None)
+            self._invalidated_at[user_id] = now
+
+    def is_fresh(self, user_id, cached_at):
+        """Whether a principal cached at ``cached_at`` (epoch seconds) is still usable."""
+        if cached_at + self.ttl <= time.time():
+            return False
+        with self._lock:
+            return cached_at > self._invalidated_at.get(user_id, 0)
+
+    def record_session_hit(self):
+        with self._lock:
+            self.session_hits += 1
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._invalidated_at.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.session_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'session_hits': self.session_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits + self.session_hits) / lookups if lookups else 0.0,
+            }
+
+
+principal_cache = PrincipalCache(
+    max_size=getattr(settings, 'MONGO_AUTH_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'MONGO_AUTH_CACHE_TTL', 300),
+)
+
+
+def invalidate_principal(user_id):
+    """Drop a cached principal; call this whenever the user document changes."""
+    principal_cache.invalidate(str(user_id))
+
+
+def _cached_principal(session, user_id):
+    """The principal from the process cache or the signed session, without touching MongoDB."""
+    principal = principal_cache.get(user_id)
+    if principal is not None:
+        return principal
+
+    if getattr(settings, 'MONGO_AUTH_CACHE_IN_SESSION', True):
+        stored = session.get(SESSION_PRINCIPAL_KEY)
+        if stored and stored.get('_id') == user_id and principal_cache.is_fresh(user_id, stored.get('cached_at', 0)):
+            principal_cache.record_session_hit()
+            principal = {'_id': stored['_id'], 'username': stored['username']}
+            principal_cache.put(user_id, principal)
+            return principal
+
+    principal_cache.record_miss()
+    return None
+
+
+def _remember_principal(session, user_id, user_data):
+    if not user_data:
+        return None
+    principal = {'_id': user_id, 'username': user_data['username']}
+    principal_cache.put(user_id, principal)
+    if getattr(settings, 'MONGO_AUTH_CACHE_IN_SESSION', True):
+        session[SESSION_PRINCIPAL_KEY] = dict(principal, cached_at=time.time())
+    return principal
+
+
+def _user_query(user_id):
+    try:
+        return {'_id': ObjectId(user_id)}
+    except (InvalidId, TypeError):
+        return None
+
+
+def load_principal(session, user_id):
+    """Resolve the principal for ``user_id``, going to MongoDB only on a cache miss."""
+    principal = _cached_principal(session, user_id)
+    if principal is not None:
+        return principal
+    query = _user_query(user_id)
+    if query is None:
+        return None
+    user_data = get_repository(UserRepository).get_collection().find_one(query, {'username': 1})
+    return _remember_principal(session, user_id, user_data)
+
+
+async def aload_principal(session, user_id):
+    """``load_principal`` for async code: the cache miss awaits the async driver."""
+    principal = _cached_principal(session, user_id)
+    if principal is not None:
+        return principal
+    query = _user_query(user_id)
+    if query is None:
+        return None
+    user_data = await get_async_repository(UserRepository).get_collection().find_one(query, {'username': 1})
+    return _remember_principal(session, user_id, user_data)
+
+
+def get_user(request):
+    if hasattr(request, '_cached_mongo_user'):
+        return request._cached_mongo_user
+    user_id = request.session.get('user_id')
+    principal = load_principal(request.session, user_id) if user_id else None
+    request._cached_mongo_user = SimpleUser(principal) if principal else AnonymousUser()
+    return request._cached_mongo_user
+
+
+async def aget_user(request):
+    if hasattr(request, '_cached_mongo_user'):
+        return request._cached_mongo_user
+    user_id = request.session.get('user_id')
+    principal = await aload_principal(request.session, user_id) if user_id else None
+    request._cached_mongo_user = SimpleUser(principal) if principal else AnonymousUser()
+    return request._cached_mongo_user
 
 
 class MongoAuthMiddleware:
+    """Sets ``request.user`` (and ``request.auser()`` for async views) from the session's user id.
+
+    Sync and async capable, so an ASGI deployment does not hop to a thread
+    for this middleware. Async views should ``await request.auser()``; once
+    awaited, ``request.user`` returns the same object without a lookup.
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        user_id = request.session.get('user_id')
-        if user_id:
-            user_collection = client['tradingApp']['users']
-            user_data = user_collection.find_one({'_id': user_id})
-            if user_data:
-                class SimpleUser:
-                    def __init__(self, data):
-                        self.id = str(data['_id'])
-                        self.username = data['username']
-                        self.is_authenticated = True
-                        self.is_active = True
-                request.user = SimpleUser(user_data)
-            else:
-                request.user = AnonymousUser()
-        else:
-            request.user = AnonymousUser()
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # Resolved on first access, so views that never read request.user skip the lookup.
+        request.user = SimpleLazyObject(lambda: get_user(request))
 
         response = self.get_response(request)
-        return response
\ No newline at end of file
+        return response
+
+    async def __acall__(self, request):
+        request.user = SimpleLazyObject(lambda: get_user(request))
+        request.auser = partial(aget_user, request)
+        return await self.get_response(request)
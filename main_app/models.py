@@ -1,28 +1,23 @@
 from typing import Optional, List, Dict, Any, NewType
 from datetime import datetime, date, timezone
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, ConfigDict, Field, EmailStr
 import os
 from django.db import models
 from django.contrib.auth.models import User
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
 from pydantic_mongo import AbstractRepository, PydanticObjectId
-from dotenv import load_dotenv
-# Load environment variables from .env file
-load_dotenv()
-  
 
-uri = os.environ.get('uri')
-# Create a new client and connect to the server
-client = MongoClient(uri, server_api=ServerApi('1'))
 
+class LazyModel(BaseModel):
+    # Validators and serializers are built on first use instead of at import; this module is
+    # imported by django.setup(), so eager builds land on every cold start (manage.py startup_profile).
+    model_config = ConfigDict(defer_build=True)
 
 
 # Replaced ObjectIdStr with PydanticObjectId
-class TenantScoped(BaseModel):
+class TenantScoped(LazyModel):
     orgId: PydanticObjectId = Field(description="Tenant/org scope")
     userId: Optional[PydanticObjectId] = Field(None, description="Actor within tenant")
-class AuditMeta(BaseModel):
+class AuditMeta(LazyModel):
     # MongoDB often manages creation timestamps, but we can keep this for explicit control.
     createdAt: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updatedAt: Optional[datetime] = None
@@ -33,7 +28,7 @@ class AuditMeta(BaseModel):
 
 # --- Trading Journal ---
 
-class Instrument(BaseModel):
+class Instrument(LazyModel):
     underlying: str
     optionType: str = Field(pattern="^(CALL|PUT)$")
     strike: float
@@ -49,12 +44,14 @@ market_sentiment_choices = { 'fed talk hawkish', 'fed talk dovish', 'economic da
   'tech earnings strong', 'tech earnings weak', 'overall trend- sideways', 'overall trend- bullish', 'overall trend- bearish',
 
 }
-class TradeSchema(BaseModel):
+class TradeSchema(LazyModel):
     # Mapping tradeId to the MongoDB document ID
     id: PydanticObjectId = Field(alias="_id")
     tenant: TenantScoped
     audit: AuditMeta
     brokerRef: Optional[str] = None
+    # "ref:<brokerRef>", "form:<token>" or "sha:<content hash>"; see main_app.idempotency
+    dedupeKey: Optional[str] = None
     instrument: Instrument
     side: str = Field(pattern="^(BUY|SELL|SHORT|COVER)$")
     qty: int
@@ -62,6 +59,8 @@ class TradeSchema(BaseModel):
     fees: float = 0.0
     openTs: Optional[datetime] = None
     closeTs: Optional[datetime] = None
+    # Closing fills: fill time of the earliest lot they closed (main_app.ledger)
+    entryTs: Optional[datetime] = None
     status: str = Field(pattern="^(OPEN|CLOSED|CANCELLED)$")
     strategyTag: List[str] = []
     marketSentimentTag: List[str] = []  
@@ -70,16 +69,63 @@ class TradeSchema(BaseModel):
     screenshotIds: List[PydanticObjectId] = []
     realizedPnL: Optional[float] = None
     unrealizedPnL: Optional[float] = None
+    # Max adverse/favourable excursion in underlying points (main_app.excursions)
+    mae: Optional[float] = None
+    mfe: Optional[float] = None
 
+# Meta.indexes: {'keys': [(field, direction), ...], **IndexModel options}.
+# Built idempotently by `python manage.py ensure_indexes`.
 class TradeRepository(AbstractRepository[TradeSchema]):
     class Meta:
         collection_name = 'trades'
+        indexes = [
+            {'keys': [('tenant.userId', 1), ('audit.createdAt', -1), ('_id', -1)]},
+            {'keys': [('tenant.userId', 1), ('status', 1), ('openTs', -1)]},
+            {'keys': [('tenant.userId', 1), ('dedupeKey', 1)], 'unique': True,
+             'partialFilterExpression': {'dedupeKey': {'$type': 'string'}}},
+            # Open fills across tenants, for revaluation
+            {'keys': [('status', 1), ('side', 1)]},
+            # Fills of one position, for ledger replays
+            {'keys': [('tenant.userId', 1), ('instrument.underlying', 1), ('instrument.optionType', 1),
+                      ('instrument.strike', 1), ('instrument.expiry', 1)]},
+        ]
+
+class PositionLots(LazyModel):
+    # Parallel arrays, one entry per open lot in fill order
+    qty: List[float] = []
+    cost: List[float] = []  # per-unit price net of the lot's opening fees
+    fillIds: List[PydanticObjectId] = []
+    basis: float = 0.0  # cost of everything still open (average cost under AVERAGE)
+
+class Position(LazyModel):
+    # Mapping positionId to the MongoDB document ID
+    id: PydanticObjectId = Field(alias="_id")
+    tenant: TenantScoped
+    audit: AuditMeta
+    instrument: Instrument
+    method: str = Field(pattern="^(FIFO|LIFO|AVERAGE)$")
+    long: PositionLots = PositionLots()
+    short: PositionLots = PositionLots()
+    realizedPnL: float = 0.0
+    lastPrice: Optional[float] = None
+    lastFillAt: Optional[datetime] = None
+    lastFillId: Optional[PydanticObjectId] = None
+    fills: int = 0
+    revision: Optional[PydanticObjectId] = None  # replaced on every write (optimistic locking)
+
+class PositionRepository(AbstractRepository[Position]):
+    class Meta:
+        collection_name = 'positions'
+        indexes = [
+            {'keys': [('tenant.userId', 1), ('instrument.underlying', 1), ('instrument.optionType', 1),
+                      ('instrument.strike', 1), ('instrument.expiry', 1)], 'unique': True},
+        ]
 
-class ChecklistItem(BaseModel):
+class ChecklistItem(LazyModel):
     label: str
     checked: bool = False
 
-class JournalEntry(BaseModel):
+class JournalEntry(LazyModel):
     # Mapping entryId to the MongoDB document ID
     id: PydanticObjectId = Field(alias="_id")
     tenant: TenantScoped
@@ -96,32 +142,54 @@ class JournalEntry(BaseModel):
 class JournalEntryRepository(AbstractRepository[JournalEntry]):
     class Meta:
         collection_name = 'journal_entries'
-
-class NotebookNote(BaseModel):
+        indexes = [
+            {'keys': [('tenant.userId', 1), ('audit.createdAt', -1)]},
+            {'keys': [('tradeId', 1)], 'sparse': True},
+            # $text search per user (main_app.search with SEARCH_BACKEND='mongo'); one text index per collection
+            {'keys': [('tenant.userId', 1), ('setup', 'text'), ('thesis', 'text'), ('riskPlan', 'text'),
+                      ('emotions', 'text'), ('tags', 'text')],
+             'weights': {'setup': 2, 'tags': 2}, 'name': 'search_text'},
+        ]
+
+class NotebookNote(LazyModel):
     # Mapping noteId to the MongoDB document ID
     id: PydanticObjectId = Field(alias="_id")
     tenant: TenantScoped
     audit: AuditMeta
     title: str
+    titleKey: Optional[str] = None  # normalized title that [[Title]] links resolve against
     markdown: str
+    # Link graph (main_app.links): targets of this note's links by kind ('note', 'trade', 'journal'),
+    # [[Title]] links to no note yet, and the notes linking here under backlinks['note'].
+    links: Dict[str, List[PydanticObjectId]] = Field(default_factory=dict)
+    unresolvedLinks: List[str] = []
     backlinks: Dict[str, List[PydanticObjectId]] = Field(default_factory=dict)
     version: int = 1
 
 class NotebookNoteRepository(AbstractRepository[NotebookNote]):
     class Meta:
         collection_name = 'notebook_notes'
+        indexes = [
+            {'keys': [('tenant.userId', 1), ('audit.createdAt', -1)]},
+            {'keys': [('tenant.userId', 1), ('title', 'text'), ('markdown', 'text')],
+             'weights': {'title': 3}, 'name': 'search_text'},
+            {'keys': [('tenant.userId', 1), ('titleKey', 1)]},
+            {'keys': [('tenant.userId', 1), ('unresolvedLinks', 1)]},
+            {'keys': [('tenant.userId', 1), ('links.trade', 1)]},
+            {'keys': [('tenant.userId', 1), ('links.journal', 1)]},
+        ]
 
 
 # --- Market factors and analytics ---
 
-class MarketFactorValues(BaseModel):
+class MarketFactorValues(LazyModel):
     VIX: Optional[float] = None
     breadth: Optional[float] = None
     trend: Optional[float] = None
     volRegime: Optional[str] = None
     liquidityProxy: Optional[float] = None
 
-class MarketFactor(BaseModel):
+class MarketFactor(LazyModel):
     # Mapping factorId to the MongoDB document ID
     id: PydanticObjectId = Field(alias="_id")
     tenant: TenantScoped
@@ -134,9 +202,29 @@ class MarketFactor(BaseModel):
 class MarketFactorRepository(AbstractRepository[MarketFactor]):
     class Meta:
         collection_name = 'market_factors'
+        indexes = [
+            {'keys': [('tenant.userId', 1), ('date', 1)]},
+        ]
+
+class Regime(LazyModel):
+    # Target of TradeSchema.regimeTagIds; one document per tenant and regime name
+    id: PydanticObjectId = Field(alias="_id")
+    tenant: TenantScoped
+    audit: AuditMeta
+    name: str  # "<factor>:<bucket>", e.g. "VIX:high"
+    factor: str
+    bucket: str
+    bounds: List[Optional[float]] = []  # [lower, upper) of numeric factors under the current thresholds
+
+class RegimeRepository(AbstractRepository[Regime]):
+    class Meta:
+        collection_name = 'regimes'
+        indexes = [
+            {'keys': [('tenant.userId', 1), ('name', 1)], 'unique': True},
+        ]
 
 
-class AnalyticsMetrics(BaseModel):
+class AnalyticsMetrics(LazyModel):
     winRate: Optional[float] = None
     expectancy: Optional[float] = None
     drawdown: Optional[float] = None
@@ -144,13 +232,15 @@ class AnalyticsMetrics(BaseModel):
     sharpeLike: Optional[float] = None
     mae: Optional[float] = None
     mfe: Optional[float] = None
+    # Net session screen time in the period (or hour of day); see main_app.time_tracking
+    screenMinutes: Optional[float] = None
 
-class CohortView(BaseModel):
+class CohortView(LazyModel):
     byStrategy: Dict[str, AnalyticsMetrics] = {}
     byRegime: Dict[str, AnalyticsMetrics] = {}
     byTimeOfDay: Dict[str, AnalyticsMetrics] = {}
 
-class AnalyticsSnapshot(BaseModel):
+class AnalyticsSnapshot(LazyModel):
     # Mapping snapshotId to the MongoDB document ID
     id: PydanticObjectId = Field(alias="_id")
     tenant: TenantScoped
@@ -164,35 +254,51 @@ class AnalyticsSnapshot(BaseModel):
 class AnalyticsSnapshotRepository(AbstractRepository[AnalyticsSnapshot]):
     class Meta:
         collection_name = 'analytics_snapshots'
+        indexes = [
+            {'keys': [('tenant.userId', 1), ('granularity', 1), ('periodStart', -1)], 'unique': True},
+        ]
 
 
-class Attachment(BaseModel):
+class Attachment(LazyModel):
     # Mapping fileId to the MongoDB document ID
     id: PydanticObjectId = Field(alias="_id")
     tenant: TenantScoped
     audit: AuditMeta
     type: str = Field(pattern="^(screenshot|csv)$")
     url: str
-    checksum: str
+    checksum: str  # SHA-256 of the content: the blob's name in main_app.blobs
+    size: Optional[int] = None
+    contentType: Optional[str] = None
+    filename: Optional[str] = None
+    thumbnail: Optional[str] = None  # checksum of the thumbnail blob, once made
+    thumbnailStatus: Optional[str] = Field(None, pattern="^(pending|ready|unavailable)$")
     tradeId: Optional[PydanticObjectId] = None
     journalEntryId: Optional[PydanticObjectId] = None
 
 class AttachmentRepository(AbstractRepository[Attachment]):
     class Meta:
         collection_name = 'attachments'
+        indexes = [
+            {'keys': [('tenant.userId', 1), ('checksum', 1)]},
+            {'keys': [('tradeId', 1)], 'sparse': True},
+            {'keys': [('journalEntryId', 1)], 'sparse': True},
+            # Across tenants: shared thumbnails and blob garbage collection
+            {'keys': [('checksum', 1), ('thumbnailStatus', 1)]},
+            {'keys': [('thumbnail', 1)], 'sparse': True},
+        ]
 
 # --- Time tracking and habits ---
 
-class BreakBlock(BaseModel):
+class BreakBlock(LazyModel):
     start: datetime
     end: datetime
     type: str = Field(pattern="^(break|lunch)$")
 
-class RuleCheck(BaseModel):
+class RuleCheck(LazyModel):
     label: str
     checked: bool
 
-class Session(BaseModel):
+class Session(LazyModel):
     # Mapping sessionId to the MongoDB document ID
     id: PydanticObjectId = Field(alias="_id")
     tenant: TenantScoped
@@ -206,12 +312,19 @@ class Session(BaseModel):
     ruleChecklist: List[RuleCheck] = []
     tags: List[str] = []
     adherenceScore: Optional[float] = None
+    # Written with adherenceScore by main_app.time_tracking.score_sessions
+    netScreenSeconds: Optional[float] = None
+    tradeCount: Optional[int] = None
+    violationCount: Optional[int] = None
 
 class SessionRepository(AbstractRepository[Session]):
     class Meta:
         collection_name = 'sessions'
+        indexes = [
+            {'keys': [('tenant.userId', 1), ('clockIn', -1)]},
+        ]
 
-class BehaviorEvent(BaseModel):
+class BehaviorEvent(LazyModel):
     # Mapping eventId to the MongoDB document ID
     id: PydanticObjectId = Field(alias="_id")
     tenant: TenantScoped
@@ -225,8 +338,16 @@ class BehaviorEvent(BaseModel):
 class BehaviorEventRepository(AbstractRepository[BehaviorEvent]):
     class Meta:
         collection_name = 'behavior_events'
-
-class ImportJob(BaseModel):
+        # Created as a time-series collection (main_app.db.ensure_collection): events are bucketed per tenant
+        # by timestamp. Such collections take no sparse indexes, hence the partial one.
+        timeseries = {'timeField': 'timestamp', 'metaField': 'tenant', 'granularity': 'seconds'}
+        indexes = [
+            {'keys': [('tenant.userId', 1), ('timestamp', 1)]},
+            {'keys': [('sessionId', 1)], 'name': 'sessionId_tagged',
+             'partialFilterExpression': {'sessionId': {'$type': 'objectId'}}},
+        ]
+
+class ImportJob(LazyModel):
     # Mapping jobId to the MongoDB document ID
     id: PydanticObjectId = Field(alias="_id")
     tenant: TenantScoped
@@ -236,16 +357,52 @@ class ImportJob(BaseModel):
     status: str = Field(pattern="^(PENDING|RUNNING|COMPLETED|FAILED)$")
     stats: Dict[str, int] = {}
     errors: List[Dict[str, Any]] = []
+    # Work-queue fields used by main_app.jobs
+    kind: str = Field("import", pattern="^(import|analytics_rebuild|thumbnail)$")
+    attempts: int = 0
+    runAfter: Optional[datetime] = None
+    leaseOwner: Optional[str] = None
+    leaseExpiresAt: Optional[datetime] = None
+    heartbeatAt: Optional[datetime] = None
 
 class ImportJobRepository(AbstractRepository[ImportJob]):
     class Meta:
         collection_name = 'import_jobs'
+        indexes = [
+            {'keys': [('status', 1), ('audit.createdAt', 1)]},
+            {'keys': [('status', 1), ('runAfter', 1)]},
+            {'keys': [('status', 1), ('leaseExpiresAt', 1)]},
+            {'keys': [('tenant.userId', 1), ('audit.createdAt', -1)]},
+        ]
+
+class DataVersion(LazyModel):
+    # One document per user; _id is the user's id
+    id: PydanticObjectId = Field(alias="_id")
+    counters: Dict[str, int] = {}  # scope ("trades", "tradeDocuments", "journal") -> number of writes
+    updatedAt: Optional[datetime] = None
+
+class DataVersionRepository(AbstractRepository[DataVersion]):
+    class Meta:
+        collection_name = 'data_versions'
+        indexes = []
+
+class CacheEntry(LazyModel):
+    # Django cache entry stored by main_app.caching.MongoCache; _id is the cache key
+    id: str = Field(alias="_id")
+    value: bytes  # pickled
+    expiresAt: Optional[datetime] = None  # None: never
+
+class CacheEntryRepository(AbstractRepository[CacheEntry]):
+    class Meta:
+        collection_name = 'cache_entries'
+        indexes = [
+            {'keys': [('expiresAt', 1)], 'expireAfterSeconds': 0},
+        ]
 
 
-# Example Usage (assuming you have a MongoClient)
-# client = MongoClient("mongodb://localhost:27017")
-# db = client["your_database_name"]
-# user_repo = UserRepository(database=db)
+# Example Usage (repositories share the client from main_app.db)
+# from main_app.db import get_repository
+# user_repo = get_repository(UserRepository)
 
 # new_user = UserSchema(orgId=PydanticObjectId(), email="test@example.com", role="admin")
 # user_repo.save(new_user)
\ No newline at end of file
@@ -0,0 +1,145 @@
+"""Writes to journal entries and notebook notes.
+
+Every write stamps ``audit.updatedAt``, bumps the owner's ``journal`` or
+``notes`` data version (``main_app.versions``) and applies the change to
+the owner's search index in this process (``search.apply_write``); other
+processes catch up from the version on their next search.
+
+Note writes also maintain the link graph (``main_app.links``). A note's
+``version`` increases with every save, and an update only applies to the
+version it was read at, so the link diff is always against the revision
+it replaces; a concurrent save makes the update re-read and retry.
+"""
+
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Type
+
+from bson import ObjectId
+from pydantic import Field, field_validator
+from pydantic_mongo import PydanticObjectId
+from pymongo import ReturnDocument
+
+from . import links
+from .db import get_repository
+from .models import ChecklistItem, LazyModel
+from .search import KINDS, apply_write
+from .user_model import tenant_for
+from .versions import bump_data_version
+
+MAX_TEXT = 100_000
+SAVE_ATTEMPTS = 5
+
+
+class WriteConflict(Exception):
+    """The document kept changing between read and write."""
+
+
+class JournalEntryIn(LazyModel):
+    tradeId: Optional[PydanticObjectId] = None
+    setup: Optional[str] = Field(None, max_length=MAX_TEXT)
+    thesis: Optional[str] = Field(None, max_length=MAX_TEXT)
+    riskPlan: Optional[str] = Field(None, max_length=MAX_TEXT)
+    emotions: Optional[str] = Field(None, max_length=MAX_TEXT)
+    checklistItems: List[ChecklistItem] = []
+    tags: List[str] = []
+    screenshotIds: List[PydanticObjectId] = []
+
+    @field_validator('tags')
+    @classmethod
+    def clean_tags(cls, tags: List[str]) -> List[str]:
+        return list(dict.fromkeys(tag.strip() for tag in tags if tag.strip()))
+
+
+class NoteIn(LazyModel):
+    title: str = Field(min_length=1, max_length=200)
+    markdown: str = Field('', max_length=MAX_TEXT)
+
+
+INPUTS: Dict[str, Type[LazyModel]] = {'journal': JournalEntryIn, 'note': NoteIn}
+
+
+def _collection(kind: str):
+    return get_repository(KINDS[kind].repository_class).get_collection()
+
+
+def _now() -> datetime:
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)  # what MongoDB keeps
+
+
+def _written(user_id, kind: str, document_id, document: Optional[dict]):
+    version = bump_data_version(user_id, KINDS[kind].scope)
+    apply_write(user_id, kind, document_id, document, version)
+
+
+def create(kind: str, user_id, data: dict) -> dict:
+    """Validate ``data`` against the kind's input model and insert it; returns the stored document.
+
+    Raises ``pydantic.ValidationError`` on bad input.
+    """
+    fields = INPUTS[kind].model_validate(data).model_dump()
+    now = _now()
+    document = {
+        '_id': ObjectId(),
+        'tenant': tenant_for(user_id),
+        'audit': {'createdAt': now, 'updatedAt': now, 'deletedAt': None},
+        **fields,
+    }
+    if kind == 'note':
+        document.update(links.note_link_fields(user_id, document['_id'], fields['title'], fields['markdown']),
+                        backlinks={}, version=1)
+    _collection(kind).insert_one(document)
+    if kind == 'note':
+        document = links.saved(user_id, document, None)
+    _written(user_id, kind, document['_id'], document)
+    return document
+
+
+def update(kind: str, user_id, document_id, data: dict) -> Optional[dict]:
+    """Apply the fields in ``data`` to the user's document; None if there is no such document."""
+    if kind == 'note':
+        return _update_note(user_id, document_id, data)
+    owned = {'_id': ObjectId(document_id), 'tenant.userId': ObjectId(user_id)}
+    current = _collection(kind).find_one(owned, {field: 1 for field in INPUTS[kind].model_fields})
+    if current is None:
+        return None
+    fields = INPUTS[kind].model_validate({**current, **data}).model_dump()
+    document = _collection(kind).find_one_and_update(owned, {'$set': {**fields, 'audit.updatedAt': _now()}},
+                                                     return_document=ReturnDocument.AFTER)
+    if document is not None:
+        _written(user_id, kind, document['_id'], document)
+    return document
+
+
+def _update_note(user_id, note_id, data: dict) -> Optional[dict]:
+    owned = {'_id': ObjectId(note_id), 'tenant.userId': ObjectId(user_id)}
+    notes = _collection('note')
+    for _ in range(SAVE_ATTEMPTS):
+        current = notes.find_one(owned, {'title': 1, 'markdown': 1, 'titleKey': 1, 'links': 1, 'version': 1})
+        if current is None:
+            return None
+        fields = NoteIn.model_validate({**current, **data}).model_dump()
+        fields.update(links.note_link_fields(user_id, current['_id'], fields['title'], fields['markdown']))
+        version = current.get('version')
+        note = notes.find_one_and_update(
+            {**owned, 'version': version if version is not None else {'$exists': False}},
+            {'$set': {**fields, 'version': (version or 1) + 1, 'audit.updatedAt': _now()}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if note is not None:
+            note = links.saved(user_id, note, current)
+            _written(user_id, 'note', note['_id'], note)
+            return note
+    raise WriteConflict(f"Note {note_id} changed during {SAVE_ATTEMPTS} save attempts")
+
+
+def delete(kind: str, user_id, document_id) -> bool:
+    document = _collection(kind).find_one_and_delete({'_id': ObjectId(document_id),
+                                                      'tenant.userId': ObjectId(user_id)},
+                                                     {'titleKey': 1, 'links': 1, 'backlinks': 1})
+    if document is None:
+        return False
+    if kind == 'note':
+        links.deleted(user_id, document)
+    _written(user_id, kind, document['_id'], None)
+    return True
@@ -0,0 +1,155 @@
+"""Keyset (cursor) pagination over raw MongoDB collections.
+
+Pages are ordered by ``(sort_field, _id)`` descending, and the cursor
+encodes the last row's values so the next page is a range query on the
+compound index instead of a growing ``skip``.
+"""
+
+import base64
+import json
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _get_path(document, path):
+    for part in path.split('.'):
+        if document is None:
+            return None
+        document = document.get(part)
+    return document
+
+
+def encode_cursor(document, sort_field: str) -> str:
+    value = _get_path(document, sort_field)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        value = {'$date': int(value.timestamp() * 1000)}
+    payload = json.dumps([value, str(document['_id'])], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[object, ObjectId]:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, object_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if isinstance(value, dict) and '$date' in value:
+            value = datetime.fromtimestamp(value['$date'] / 1000, tz=timezone.utc)
+        return value, ObjectId(object_id)
+    except (ValueError, TypeError, InvalidId) as exc:
+        raise InvalidCursor(f"Invalid pagination cursor: {cursor!r}") from exc
+
+
+def keyset_query(query: dict, sort_field: str, after: Optional[str]) -> dict:
+    if not after:
+        return query
+    value, object_id = decode_cursor(after)
+    return {
+        '$and': [
+            query,
+            {'$or': [
+                {sort_field: {'$lt': value}},
+                {sort_field: value, '_id': {'$lt': object_id}},
+            ]},
+        ]
+    }
+
+
+def iter_page(collection, query: dict, sort_field: str, limit: int,
+              after: Optional[str] = None, projection: Optional[dict] = None) -> Iterator[dict]:
+    """Stream up to ``limit + 1`` documents; the extra one tells the caller a next page exists."""
+    cursor = collection.find(
+        keyset_query(query, sort_field, after),
+        projection,
+        sort=[(sort_field, -1), ('_id', -1)],
+        limit=limit + 1,
+        batch_size=limit + 1,
+    )
+    return iter(cursor)
+
+
+def fetch_page(collection, query: dict, sort_field: str, limit: int,
+               after: Optional[str] = None, projection: Optional[dict] = None) -> Tuple[List[dict], Optional[str]]:
+    """Return one page of documents and the cursor for the next page (``None`` on the last page)."""
+    documents = list(iter_page(collection, query, sort_field, limit, after, projection))
+    if len(documents) <= limit:
+        return documents, None
+    documents = documents[:limit]
+    return documents, encode_cursor(documents[-1], sort_field)
+
+
+async def afetch_page(collection, query: dict, sort_field: str, limit: int,
+                      after: Optional[str] = None, projection: Optional[dict] = None) -> Tuple[List[dict], Optional[str]]:
+    """``fetch_page`` over a pymongo ``AsyncCollection``."""
+    cursor = collection.find(
+        keyset_query(query, sort_field, after),
+        projection,
+        sort=[(sort_field, -1), ('_id', -1)],
+        limit=limit + 1,
+        batch_size=limit + 1,
+    )
+    documents = await cursor.to_list(limit + 1)
+    if len(documents) <= limit:
+        return documents, None
+    documents = documents[:limit]
+    return documents, encode_cursor(documents[-1], sort_field)
+
+
+class MongoCursorPagination:
+    """DRF paginator for raw collections: ``?after=<cursor>&limit=<n>``.
+
+    The response carries ``next``, a link to the following page, the same way
+    ``rest_framework.pagination.CursorPagination`` does for querysets.
+    """
+
+    sort_field = 'audit.createdAt'
+    cursor_query_param = 'after'
+    page_size_query_param = 'limit'
+    page_size = 25
+    max_page_size = 100
+
+    # request.GET rather than query_params, so plain Django (async) views can use it too.
+    def get_page_size(self, request) -> int:
+        try:
+            size = int(request.GET.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def _page_arguments(self, collection, query, request, projection):
+        self.request = request
+        return (collection, query, self.sort_field, self.get_page_size(request),
+                request.GET.get(self.cursor_query_param), projection)
+
+    def paginate(self, collection, query: dict, request, projection: Optional[dict] = None) -> List[dict]:
+        try:
+            documents, self.next_cursor = fetch_page(*self._page_arguments(collection, query, request, projection))
+        except InvalidCursor as exc:
+            raise ValidationError({self.cursor_query_param: str(exc)})
+        return documents
+
+    async def apaginate(self, collection, query: dict, request, projection: Optional[dict] = None) -> List[dict]:
+        """``paginate`` over an ``AsyncCollection``."""
+        try:
+            documents, self.next_cursor = await afetch_page(*self._page_arguments(collection, query, request, projection))
+        except InvalidCursor as exc:
+            raise ValidationError({self.cursor_query_param: str(exc)})
+        return documents
+
+    def get_next_link(self) -> Optional[str]:
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
@@ -0,0 +1,150 @@
+"""Batch regime tagging of trades from MarketFactor history.
+
+A user's market factors are loaded once into date-sorted NumPy arrays (the
+in-memory index) and every factor row is bucketed into regimes with the
+``REGIME_THRESHOLDS`` setting: numeric factors by ``np.digitize`` over the
+configured edges, ``volRegime`` by its own value. Each regime name
+("VIX:high", "trend:up", ...) has a tenant-scoped ``regimes`` document
+whose id goes into ``TradeSchema.regimeTagIds``.
+
+Trades are joined to factors as of their ``openTs`` date (the latest factor
+on or before it, at most ``REGIME_MAX_FACTOR_AGE_DAYS`` old) with one
+``np.searchsorted`` over the sorted factor dates, which is a merge join
+rather than a lookup per trade. By default only untagged trades are
+touched; ``retag=True`` reclassifies everything after thresholds change.
+"""
+
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+from bson import ObjectId
+from django.conf import settings
+from pymongo import ReturnDocument, UpdateOne
+
+from .bars import day_number
+from .db import get_repository
+from .models import MarketFactorRepository, RegimeRepository, TradeRepository
+from .versions import bump_data_versions
+
+CATEGORICAL_FACTORS = ('volRegime',)
+WRITE_BATCH = 10_000
+
+
+def _day(value) -> int:
+    return day_number(value.date() if isinstance(value, datetime) else value)
+
+
+class FactorIndex:
+    """One user's market factors sorted by date, with the regime names of each day."""
+
+    def __init__(self, documents, thresholds: Dict[str, dict]):
+        documents = sorted(documents, key=lambda document: document['date'])
+        self.days = np.array([_day(document['date']) for document in documents], dtype=np.int64)
+        labels = [[] for _ in documents]
+        for factor, spec in thresholds.items():
+            values = [(document.get('values') or {}).get(factor) for document in documents]
+            if factor in CATEGORICAL_FACTORS:
+                for row, value in enumerate(values):
+                    if value:
+                        labels[row].append(f'{factor}:{value}')
+                continue
+            numbers = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+            buckets = np.digitize(numbers, spec['edges'])
+            names = spec['labels']
+            for row in np.flatnonzero(~np.isnan(numbers)).tolist():
+                labels[row].append(f'{factor}:{names[buckets[row]]}')
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.days)
+
+    def regime_names(self) -> List[str]:
+        return sorted({name for names in self.labels for name in names})
+
+    def match(self, trade_days: np.ndarray, max_age_days: int) -> np.ndarray:
+        """Row of the factor in effect on each trade day, or -1."""
+        rows = np.searchsorted(self.days, trade_days, side='right') - 1
+        found = rows >= 0
+        age = trade_days - self.days[np.maximum(rows, 0)]
+        return np.where(found & (age <= max_age_days), rows, -1)
+
+
+def regime_bounds(name: str, thresholds: Dict[str, dict]) -> List[Optional[float]]:
+    factor, bucket = name.split(':', 1)
+    spec = thresholds.get(factor)
+    if factor in CATEGORICAL_FACTORS or not spec:
+        return []
+    index = spec['labels'].index(bucket)
+    edges = [None] + list(spec['edges']) + [None]
+    return [edges[index], edges[index + 1]]
+
+
+def ensure_regimes(tenant: dict, names: List[str], thresholds: Dict[str, dict]) -> Dict[str, ObjectId]:
+    """{regime name: id}, creating the tenant's regime documents that do not exist yet."""
+    collection = get_repository(RegimeRepository).get_collection()
+    now = datetime.now(timezone.utc)
+    ids = {}
+    for name in names:
+        factor, bucket = name.split(':', 1)
+        document = collection.find_one_and_update(
+            {'tenant.userId': tenant['userId'], 'name': name},
+            {'$set': {'factor': factor, 'bucket': bucket, 'bounds': regime_bounds(name, thresholds),
+                      'audit.updatedAt': now},
+             '$setOnInsert': {'tenant.orgId': tenant['orgId'], 'audit.createdAt': now}},
+            projection={'_id': 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        ids[name] = document['_id']
+    return ids
+
+
+def _trade_day(trade: dict) -> int:
+    return _day(trade.get('openTs') or trade.get('closeTs') or trade['audit']['createdAt'])
+
+
+def tag_user(user_id, retag: bool = False, thresholds: Optional[Dict[str, dict]] = None,
+             max_age_days: Optional[int] = None) -> Dict:
+    """Attach regimes to one user's trades; returns the tenant and counters."""
+    user_id = ObjectId(user_id)
+    thresholds = thresholds or settings.REGIME_THRESHOLDS
+    max_age_days = settings.REGIME_MAX_FACTOR_AGE_DAYS if max_age_days is None else max_age_days
+    factors = list(get_repository(MarketFactorRepository).get_collection().find(
+        {'tenant.userId': user_id}, {'tenant': 1, 'date': 1, 'values': 1},
+    ))
+    totals = {'tenant': factors[0]['tenant'] if factors else None,
+              'factors': len(factors), 'trades': 0, 'matched': 0, 'updated': 0}
+    if not factors:
+        return totals
+    index = FactorIndex(factors, thresholds)
+    regime_ids = ensure_regimes(factors[0]['tenant'], index.regime_names(), thresholds)
+    row_ids = [[regime_ids[name] for name in names] for names in index.labels]
+
+    query = {'tenant.userId': user_id}
+    if not retag:
+        query['regimeTagIds.0'] = {'$exists': False}
+    trades_collection = get_repository(TradeRepository).get_collection()
+    trades = list(trades_collection.find(query, {'openTs': 1, 'closeTs': 1, 'audit.createdAt': 1, 'regimeTagIds': 1}))
+    totals['trades'] = len(trades)
+    if not trades:
+        return totals
+    rows = index.match(np.array([_trade_day(trade) for trade in trades], dtype=np.int64), max_age_days)
+    totals['matched'] = int(np.count_nonzero(rows >= 0))
+
+    operations = []
+    for trade, row in zip(trades, rows.tolist()):
+        tags = row_ids[row] if row >= 0 else []
+        if tags != (trade.get('regimeTagIds') or []):
+            operations.append(UpdateOne({'_id': trade['_id']}, {'$set': {'regimeTagIds': tags}}))
+    for start in range(0, len(operations), WRITE_BATCH):
+        trades_collection.bulk_write(operations[start:start + WRITE_BATCH], ordered=False)
+    if operations:
+        bump_data_versions([user_id])
+    totals['updated'] = len(operations)
+    return totals
+
+
+def tagged_users() -> List:
+    """Users that have market factors to tag against."""
+    return get_repository(MarketFactorRepository).get_collection().distinct('tenant.userId')
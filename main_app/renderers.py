@@ -0,0 +1,52 @@
+"""orjson-based DRF renderer.
+
+``FastJSONRenderer`` encodes response data with orjson: ObjectIds as
+strings, naive datetimes as UTC ("...Z", as pymongo returns them), NumPy
+arrays and scalars natively. Views that already hold encoded bytes (the
+Pydantic fast path in ``schemas.py``) wrap them in ``RawJSON`` and the
+renderer passes them through untouched.
+"""
+
+from decimal import Decimal
+
+import orjson
+from bson import ObjectId
+from rest_framework.renderers import BaseRenderer
+
+ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_SERIALIZE_NUMPY
+
+
+class RawJSON:
+    """Response data that is already a JSON document."""
+
+    def __init__(self, content: bytes):
+        self.content = content
+
+
+def default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if hasattr(value, 'item'):  # NumPy scalars orjson does not take directly
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value) -> bytes:
+    return orjson.dumps(value, default=default, option=ORJSON_OPTIONS)
+
+
+class FastJSONRenderer(BaseRenderer):
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, RawJSON):
+            return data.content
+        return dumps(data)
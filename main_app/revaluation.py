@@ -0,0 +1,306 @@
+"""Mark-to-market revaluation of open option lots from a local price file.
+
+Every OPEN opening fill (BUY/SHORT) across all tenants is loaded once into
+NumPy columns, its open quantity and unit cost taken from the position
+ledger's lots (``main_app.ledger``), and joined to the price file on the
+Instrument key (underlying, optionType, strike, expiry) with one
+``np.unique`` over the concatenated keys, not a lookup per trade.
+
+Instruments without a mark get a Black-Scholes price from the underlying's
+spot in the same file, with the user's latest ``MarketFactorValues.VIX`` as
+the volatility (falling back to the latest VIX of any tenant). Trades with
+neither are reported as unpriced. Changed ``unrealizedPnL`` values go back
+in large unordered ``bulk_write`` batches, so round trips grow with the
+batch count, not per position.
+
+Price file columns: ``underlying, optionType, strike, expiry, mark``. Rows
+with an empty ``optionType`` give the underlying's spot price. Parquet
+files need ``pyarrow``.
+"""
+
+import csv
+import math
+from datetime import date, datetime, timezone
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+from django.conf import settings
+from pymongo import UpdateOne
+
+from .db import get_repository
+from .ledger import OPENING_SIDES
+from .models import MarketFactorRepository, PositionRepository, TradeRepository
+from .versions import bump_data_versions
+
+PRICE_COLUMNS = ('underlying', 'optionType', 'strike', 'expiry', 'mark')
+WRITE_BATCH = 50_000
+STRIKE_SCALE = 10_000  # strikes are joined as integer ten-thousandths
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+OPEN_TRADE_PROJECTION = {
+    'tenant.userId': 1, 'instrument': 1, 'side': 1, 'qty': 1, 'price': 1, 'fees': 1, 'unrealizedPnL': 1,
+}
+
+
+class RevaluationFailed(Exception):
+    pass
+
+
+def _day_number(value) -> int:
+    if isinstance(value, datetime):
+        value = value.date()
+    elif isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    return value.toordinal() - EPOCH_ORDINAL
+
+
+def _read_csv(path: str) -> Dict[str, list]:
+    try:
+        with open(path, newline='', encoding='utf-8-sig') as source:
+            reader = csv.DictReader(source)
+            missing = set(PRICE_COLUMNS) - set(reader.fieldnames or ())
+            if missing:
+                raise RevaluationFailed(f"Price file {path} lacks columns: {', '.join(sorted(missing))}")
+            columns = {name: [] for name in PRICE_COLUMNS}
+            for row in reader:
+                for name in PRICE_COLUMNS:
+                    columns[name].append(row[name])
+            return columns
+    except OSError as exc:
+        raise RevaluationFailed(f"Cannot open price file {path!r}: {exc}") from exc
+
+
+def _read_parquet(path: str) -> Dict[str, list]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as exc:
+        raise RevaluationFailed("Reading Parquet price files requires pyarrow") from exc
+    table = pq.read_table(path, columns=list(PRICE_COLUMNS))
+    return {name: table.column(name).to_pylist() for name in PRICE_COLUMNS}
+
+
+def _mark(value) -> float:
+    return float(value) if value not in (None, '') else np.nan
+
+
+def _converted(columns: Dict[str, list], name: str, convert, keep=None) -> list:
+    """``convert`` over a price column (the rows in ``keep``); a bad value names its row and column."""
+    values = []
+    for row, value in enumerate(columns[name], start=1):
+        if keep is not None and not keep[row - 1]:
+            continue
+        try:
+            values.append(convert(value))
+        except (TypeError, ValueError) as exc:
+            raise RevaluationFailed(f"Price file data row {row}, column {name!r}: cannot read {value!r}") from exc
+    return values
+
+
+class PriceTable:
+    """Option marks and underlying spots from one price file, as NumPy columns."""
+
+    def __init__(self, columns: Dict[str, list]):
+        option_type = np.array([value or '' for value in columns['optionType']], dtype=str)
+        option_type = np.char.upper(np.char.strip(option_type))
+        underlying = np.char.upper(np.char.strip(np.array(columns['underlying'], dtype=str)))
+        mark = np.array(_converted(columns, 'mark', _mark), dtype=np.float64)
+        priced = ~np.isnan(mark)
+        spot = (option_type == '') & priced
+        option = (option_type != '') & priced
+
+        self.spots = dict(zip(underlying[spot].tolist(), mark[spot].tolist()))
+        self.underlying = underlying[option]
+        self.option_type = np.where(np.char.startswith(option_type[option], 'C'), 'CALL', 'PUT')
+        self.strike = np.array(_converted(columns, 'strike', float, option), dtype=np.float64)
+        self.expiry = np.array(_converted(columns, 'expiry', _day_number, option), dtype=np.int64)
+        self.mark = mark[option]
+
+    @classmethod
+    def load(cls, path: str) -> 'PriceTable':
+        reader = _read_parquet if path.lower().endswith(('.parquet', '.pq')) else _read_csv
+        return cls(reader(path))
+
+    def __len__(self):
+        return len(self.mark)
+
+
+def join_keys(left: Tuple[np.ndarray, ...], right: Tuple[np.ndarray, ...]) -> np.ndarray:
+    """Index into ``right`` for every ``left`` row with an equal composite key (-1 if none)."""
+    n_left = len(left[0])
+    if not n_left or not len(right[0]):
+        return np.full(n_left, -1, dtype=np.int64)
+    codes = []
+    for left_column, right_column in zip(left, right):
+        _, inverse = np.unique(np.concatenate([left_column, right_column]), return_inverse=True)
+        codes.append(inverse.ravel())
+    _, combined = np.unique(np.stack(codes, axis=1), axis=0, return_inverse=True)
+    combined = combined.ravel()
+    lookup = np.full(combined.max() + 1, -1, dtype=np.int64)
+    lookup[combined[n_left:]] = np.arange(len(right[0]))
+    return lookup[combined[:n_left]]
+
+
+def norm_cdf(x: np.ndarray) -> np.ndarray:
+    """Standard normal CDF (Abramowitz & Stegun 26.2.17, |error| < 7.5e-8)."""
+    z = np.abs(x)
+    t = 1.0 / (1.0 + 0.2316419 * z)
+    poly = t * (0.319381530 + t * (-0.356563782 + t * (1.781477937 + t * (-1.821255978 + t * 1.330274429))))
+    upper = np.exp(-0.5 * z * z) / math.sqrt(2 * math.pi) * poly
+    return np.where(x >= 0, 1.0 - upper, upper)
+
+
+def black_scholes(spot, strike, years, rate, vol, is_call) -> np.ndarray:
+    """European option prices; expired or zero-vol contracts are priced at intrinsic value."""
+    spot, strike, years, vol = (np.asarray(value, dtype=np.float64) for value in (spot, strike, years, vol))
+    intrinsic = np.where(is_call, np.maximum(spot - strike, 0.0), np.maximum(strike - spot, 0.0))
+    live = (years > 0) & (vol > 0) & (spot > 0) & (strike > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        root = vol * np.sqrt(years)
+        d1 = (np.log(spot / strike) + (rate + 0.5 * vol * vol) * years) / root
+        d2 = d1 - root
+        discount = strike * np.exp(-rate * years)
+        call = spot * norm_cdf(d1) - discount * norm_cdf(d2)
+        put = discount * norm_cdf(-d2) - spot * norm_cdf(-d1)
+    return np.where(live, np.where(is_call, call, put), intrinsic)
+
+
+def latest_vix(as_of: date) -> Tuple[Dict[ObjectId, float], Optional[float]]:
+    """({user id: VIX on or before ``as_of``}, latest VIX of any tenant) in one aggregation."""
+    collection = get_repository(MarketFactorRepository).get_collection()
+    rows = list(collection.aggregate([
+        {'$match': {'date': {'$lte': datetime(as_of.year, as_of.month, as_of.day)}, 'values.VIX': {'$ne': None}}},
+        {'$sort': {'date': -1}},
+        {'$group': {'_id': '$tenant.userId', 'vix': {'$first': '$values.VIX'}, 'date': {'$first': '$date'}}},
+    ]))
+    by_user = {row['_id']: row['vix'] for row in rows}
+    latest = max(rows, key=lambda row: row['date'])['vix'] if rows else None
+    return by_user, latest
+
+
+def open_lot_costs() -> Dict[ObjectId, Tuple[float, float]]:
+    """{opening fill id: (open qty, unit cost)} from the ledger's positions."""
+    collection = get_repository(PositionRepository).get_collection()
+    lots = {}
+    query = {'$or': [{'long.qty.0': {'$exists': True}}, {'short.qty.0': {'$exists': True}}]}
+    for position in collection.find(query, {'method': 1, 'long': 1, 'short': 1}):
+        for side in ('long', 'short'):
+            book = position.get(side) or {}
+            qty = book.get('qty') or []
+            if position['method'] == 'AVERAGE' and qty:
+                costs = [book['basis'] / sum(qty)] * len(qty)
+            else:
+                costs = book.get('cost') or []
+            lots.update(zip(book.get('fillIds') or [], zip(qty, costs)))
+    return lots
+
+
+class OpenTrades:
+    """OPEN opening fills as NumPy columns."""
+
+    def __init__(self, documents, lots: Dict[ObjectId, Tuple[float, float]], multiplier: float):
+        ids, users, underlying, option_type, strike, expiry = [], [], [], [], [], []
+        qty, cost, sign, current = [], [], [], []
+        for document in documents:
+            side = document.get('side')
+            if side not in OPENING_SIDES:
+                continue
+            instrument = document['instrument']
+            lot = lots.get(document['_id'])
+            if lot is None:
+                # Not matched by the ledger yet: the whole fill is open at its own price.
+                fill_qty = float(document['qty'])
+                fee = float(document.get('fees') or 0.0) / (fill_qty * multiplier) if fill_qty else 0.0
+                lot = (fill_qty, document['price'] + fee if side == 'BUY' else document['price'] - fee)
+            ids.append(document['_id'])
+            users.append(document['tenant'].get('userId'))
+            underlying.append(instrument['underlying'].upper())
+            option_type.append(instrument['optionType'])
+            strike.append(float(instrument['strike']))
+            expiry.append(_day_number(instrument['expiry']))
+            qty.append(lot[0])
+            cost.append(lot[1])
+            sign.append(1.0 if side == 'BUY' else -1.0)
+            current.append(document.get('unrealizedPnL'))
+        self.ids = ids
+        self.users = users
+        self.underlying = np.array(underlying, dtype=str)
+        self.option_type = np.array(option_type, dtype=str)
+        self.strike = np.array(strike, dtype=np.float64)
+        self.expiry = np.array(expiry, dtype=np.int64)
+        self.qty = np.array(qty, dtype=np.float64)
+        self.cost = np.array(cost, dtype=np.float64)
+        self.sign = np.array(sign, dtype=np.float64)
+        self.current = np.array([np.nan if value is None else value for value in current], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _strike_key(strike: np.ndarray) -> np.ndarray:
+    return np.round(strike * STRIKE_SCALE).astype(np.int64)
+
+
+def price_trades(trades: OpenTrades, prices: PriceTable, as_of: date, rate: float,
+                 vix_by_user: Dict[ObjectId, float], default_vix: Optional[float]):
+    """Vectorized (price, source) per trade; source is 0 = mark, 1 = Black-Scholes, -1 = unpriced."""
+    match = join_keys(
+        (trades.underlying, trades.option_type, _strike_key(trades.strike), trades.expiry),
+        (prices.underlying, prices.option_type, _strike_key(prices.strike), prices.expiry),
+    )
+    price = np.full(len(trades), np.nan)
+    source = np.full(len(trades), -1, dtype=np.int8)
+    marked = match >= 0
+    price[marked] = prices.mark[match[marked]]
+    source[marked] = 0
+
+    missing = np.flatnonzero(~marked)
+    if len(missing):
+        spot = np.array([prices.spots.get(name, np.nan) for name in trades.underlying[missing].tolist()])
+        vix = np.array([vix_by_user.get(trades.users[index], default_vix) for index in missing.tolist()],
+                       dtype=np.float64)
+        priceable = ~np.isnan(spot) & ~np.isnan(vix)
+        rows = missing[priceable]
+        years = np.maximum(trades.expiry[rows] - _day_number(as_of), 0) / 365.0
+        price[rows] = black_scholes(spot[priceable], trades.strike[rows], years, rate, vix[priceable] / 100.0,
+                                    trades.option_type[rows] == 'CALL')
+        source[rows] = 1
+    return price, source
+
+
+def revalue(price_path: str, as_of: Optional[date] = None, rate: Optional[float] = None,
+            multiplier: Optional[float] = None, dry_run: bool = False) -> Dict[str, int]:
+    """Revalue every open lot against ``price_path`` and store changed ``unrealizedPnL``."""
+    as_of = as_of or datetime.now(timezone.utc).date()
+    rate = settings.RISK_FREE_RATE if rate is None else rate
+    multiplier = multiplier or settings.OPTION_CONTRACT_MULTIPLIER
+    prices = PriceTable.load(price_path)
+    collection = get_repository(TradeRepository).get_collection()
+    documents = collection.find({'status': 'OPEN', 'side': {'$in': list(OPENING_SIDES)}}, OPEN_TRADE_PROJECTION,
+                                batch_size=WRITE_BATCH)
+    trades = OpenTrades(documents, open_lot_costs(), multiplier)
+    vix_by_user, default_vix = latest_vix(as_of)
+    price, source = price_trades(trades, prices, as_of, rate, vix_by_user, default_vix)
+
+    pnl = trades.sign * (price - trades.cost) * trades.qty * multiplier
+    priced = source >= 0
+    changed = priced & ~np.isclose(pnl, trades.current, rtol=1e-9, atol=1e-9)
+    rows = np.flatnonzero(changed)
+    totals = {
+        'trades': len(trades),
+        'marked': int(np.count_nonzero(source == 0)),
+        'theoretical': int(np.count_nonzero(source == 1)),
+        'unpriced': int(np.count_nonzero(~priced)),
+        'updated': len(rows),
+    }
+    if dry_run:
+        return totals
+    values = pnl[rows].tolist()
+    for start in range(0, len(rows), WRITE_BATCH):
+        operations = [
+            UpdateOne({'_id': trades.ids[index]}, {'$set': {'unrealizedPnL': value}})
+            for index, value in zip(rows[start:start + WRITE_BATCH].tolist(), values[start:start + WRITE_BATCH])
+        ]
+        collection.bulk_write(operations, ordered=False)
+    bump_data_versions(trades.users[index] for index in rows.tolist())
+    return totals
@@ -0,0 +1,223 @@
+"""Pydantic response schemas for the JSON API.
+
+Raw MongoDB documents are validated straight into these shapes and dumped
+to JSON bytes by pydantic-core (``TypeAdapter.validate_python`` /
+``dump_json`` over whole lists), skipping DRF serializer fields and the
+renderer's ``json.dumps``. Field names and output match ``serializers.py``:
+fields missing from a document are left out, as DRF does.
+
+The schemas are ``TypedDict``s rather than ``BaseModel``s: validating into
+plain dicts avoids building a model instance per document, which is about
+half the cost on a trade list. Their validators are built on first use, not
+at import, which keeps them off cold starts of unrelated requests.
+"""
+
+from datetime import date, datetime
+from functools import cached_property
+from typing import Annotated, Dict, Iterable, List, Optional, Tuple, get_args, get_origin, get_type_hints
+
+from bson import ObjectId
+from pydantic import (
+    AliasPath, BeforeValidator, ConfigDict, Field, PlainSerializer, SkipValidation, TypeAdapter, with_config,
+)
+from pydantic.fields import FieldInfo
+from typing_extensions import TypedDict, is_typeddict
+
+
+def _iso_utc(value: datetime) -> str:
+    # pymongo returns naive UTC datetimes; render them the way DRF does ("...Z")
+    if value.tzinfo is None:
+        return value.isoformat() + 'Z'
+    return value.isoformat().replace('+00:00', 'Z')
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+# Values come from our own database, so ids and timestamps are not re-validated,
+# only converted on output; Python-level validators dominate the cost otherwise.
+ObjectIdStr = Annotated[SkipValidation[ObjectId], PlainSerializer(str, return_type=str)]
+UTCDateTime = Annotated[datetime, PlainSerializer(_iso_utc, return_type=str, when_used='json')]
+StoredDate = Annotated[date, BeforeValidator(_as_date)]  # dates are stored as midnight-UTC datetimes
+
+RESPONSE_CONFIG = ConfigDict(arbitrary_types_allowed=True, extra='ignore')
+
+
+@with_config(RESPONSE_CONFIG)
+class InstrumentOut(TypedDict, total=False):
+    underlying: Optional[str]
+    optionType: Optional[str]
+    strike: Optional[float]
+    expiry: Optional[StoredDate]
+
+
+@with_config(RESPONSE_CONFIG)
+class TradeOut(TypedDict, total=False):
+    tradeId: Annotated[ObjectIdStr, Field(validation_alias='_id')]
+    createdAt: Annotated[Optional[UTCDateTime], Field(validation_alias=AliasPath('audit', 'createdAt'))]
+    brokerRef: Optional[str]
+    instrument: Optional[InstrumentOut]
+    side: Optional[str]
+    qty: Optional[int]
+    price: Optional[float]
+    fees: Optional[float]
+    openTs: Optional[UTCDateTime]
+    closeTs: Optional[UTCDateTime]
+    status: Optional[str]
+    strategyTag: List[str]
+    marketSentimentTag: List[str]
+    regimeTagIds: List[ObjectIdStr]
+    journalEntryIds: List[ObjectIdStr]
+    realizedPnL: Optional[float]
+    unrealizedPnL: Optional[float]
+    mae: Optional[float]
+    mfe: Optional[float]
+
+
+@with_config(RESPONSE_CONFIG)
+class ChecklistItemOut(TypedDict, total=False):
+    label: str
+    checked: bool
+
+
+@with_config(RESPONSE_CONFIG)
+class JournalEntryOut(TypedDict, total=False):
+    entryId: Annotated[ObjectIdStr, Field(validation_alias='_id')]
+    createdAt: Annotated[Optional[UTCDateTime], Field(validation_alias=AliasPath('audit', 'createdAt'))]
+    tradeId: Optional[ObjectIdStr]
+    setup: Optional[str]
+    thesis: Optional[str]
+    riskPlan: Optional[str]
+    emotions: Optional[str]
+    checklistItems: List[ChecklistItemOut]
+    tags: List[str]
+    screenshotIds: List[ObjectIdStr]
+
+
+@with_config(RESPONSE_CONFIG)
+class NotebookNoteOut(TypedDict, total=False):
+    noteId: Annotated[ObjectIdStr, Field(validation_alias='_id')]
+    createdAt: Annotated[Optional[UTCDateTime], Field(validation_alias=AliasPath('audit', 'createdAt'))]
+    updatedAt: Annotated[Optional[UTCDateTime], Field(validation_alias=AliasPath('audit', 'updatedAt'))]
+    title: str
+    markdown: str
+    links: Dict[str, List[ObjectIdStr]]
+    unresolvedLinks: List[str]
+    backlinks: Dict[str, List[ObjectIdStr]]
+    version: int
+
+
+@with_config(RESPONSE_CONFIG)
+class AttachmentOut(TypedDict, total=False):
+    attachmentId: Annotated[ObjectIdStr, Field(validation_alias='_id')]
+    createdAt: Annotated[Optional[UTCDateTime], Field(validation_alias=AliasPath('audit', 'createdAt'))]
+    type: str
+    url: str
+    checksum: str
+    size: Optional[int]
+    contentType: Optional[str]
+    filename: Optional[str]
+    thumbnailStatus: Optional[str]
+    tradeId: Optional[ObjectIdStr]
+    journalEntryId: Optional[ObjectIdStr]
+
+
+def _nested_schema(annotation):
+    """The TypedDict a (possibly Optional/Annotated) field holds directly; lists do not count."""
+    if is_typeddict(annotation):
+        return annotation
+    if get_origin(annotation) is list:
+        return None
+    for argument in get_args(annotation):
+        nested = _nested_schema(argument)
+        if nested:
+            return nested
+    return None
+
+
+def schema_fields(schema) -> Dict[str, Tuple[str, object]]:
+    """{field name: (document path, nested schema or None)}."""
+    fields = {}
+    for name, annotation in get_type_hints(schema, include_extras=True).items():
+        path = name
+        for meta in getattr(annotation, '__metadata__', ()):
+            if isinstance(meta, FieldInfo) and meta.validation_alias:
+                alias = meta.validation_alias
+                path = '.'.join(str(part) for part in alias.path) if isinstance(alias, AliasPath) else alias
+        fields[name] = (path, _nested_schema(annotation))
+    return fields
+
+
+class DocumentSchema:
+    """Validates raw documents into a response schema and dumps them as JSON bytes.
+
+    ``fields`` (from ``?fields=``) selects top-level fields; the id field is
+    always included, and ``projection()`` fetches only what will be dumped.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.fields = schema_fields(schema)
+        self.id_field = next(name for name, (path, _) in self.fields.items() if path == '_id')
+
+    @cached_property
+    def one(self) -> TypeAdapter:
+        return TypeAdapter(self.schema)
+
+    @cached_property
+    def many(self) -> TypeAdapter:
+        return TypeAdapter(List[self.schema])
+
+    def field_names(self) -> List[str]:
+        return list(self.fields)
+
+    def include(self, fields=None) -> Optional[set]:
+        return set(fields) | {self.id_field} if fields else None
+
+    def projection(self, fields=None, keys=()) -> dict:
+        """What to fetch for ``fields``, plus the document paths ``keys`` (the pagination key) even if not dumped."""
+        projection = {self.fields[name][0]: 1 for name in self.include(fields) or self.fields}
+        for key in keys:
+            if not any(key == path or key.startswith(path + '.') for path in projection):
+                projection[key] = 1
+        return projection
+
+    def dump(self, document: dict, fields=None) -> bytes:
+        return self.one.dump_json(self.one.validate_python(document), include=self.include(fields))
+
+    def dump_many(self, documents: List[dict], fields=None) -> bytes:
+        include = self.include(fields)
+        return self.many.dump_json(self.many.validate_python(documents),
+                                   include={'__all__': include} if include else None)
+
+    def dump_lines(self, documents: List[dict], fields=None) -> bytes:
+        """NDJSON: one object per line."""
+        include = self.include(fields)
+        return b''.join(self.one.dump_json(item, include=include) + b'\n'
+                        for item in self.many.validate_python(documents))
+
+    def rows(self, documents: Iterable[dict], fields=None) -> List[dict]:
+        """JSON-ready dicts, for formats other than JSON."""
+        include = self.include(fields)
+        return self.many.dump_python(self.many.validate_python(list(documents)), mode='json',
+                                     include={'__all__': include} if include else None)
+
+    def columns(self, fields=None) -> List[str]:
+        """Flat column names; nested schemas become ``parent.child`` columns."""
+        include = self.include(fields)
+        columns = []
+        for name, (_, nested) in self.fields.items():
+            if include and name not in include:
+                continue
+            if nested:
+                columns.extend(f'{name}.{child}' for child in get_type_hints(nested))
+            else:
+                columns.append(name)
+        return columns
+
+
+TRADE_SCHEMA = DocumentSchema(TradeOut)
+JOURNAL_ENTRY_SCHEMA = DocumentSchema(JournalEntryOut)
+NOTEBOOK_NOTE_SCHEMA = DocumentSchema(NotebookNoteOut)
+ATTACHMENT_SCHEMA = DocumentSchema(AttachmentOut)
@@ -0,0 +1,393 @@
+"""Full-text search over journal entries and notebook notes.
+
+Each user's entries and notes are held in an in-process inverted index
+(``UserIndex``): term -> {document id: field-weighted term frequency},
+ranked with BM25. Every query word must match, either exactly or as the
+prefix of an indexed term (through a sorted vocabulary), so results follow
+the user's typing; each response carries tag facets over all matches.
+
+Indexes live in an LRU of ``settings.SEARCH_INDEX_CACHE_SIZE`` users and
+record the ``journal`` and ``notes`` data versions they reflect. Writes
+through ``main_app.notebook`` update the cached index in place
+(``apply_write``); after a write from another process the version moves
+and the next search re-reads only the documents whose ``audit.updatedAt``
+changed, rather than rebuilding.
+
+With ``settings.SEARCH_BACKEND = 'mongo'`` queries go to the collections'
+``search_text`` indexes instead (whole words only, no prefixes), where
+holding indexes in worker memory is not wanted; the local index is used
+when the text index is missing.
+"""
+
+import heapq
+import math
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from bson import ObjectId
+from django.conf import settings
+from pymongo.errors import OperationFailure
+
+from .db import get_repository
+from .models import JournalEntryRepository, NotebookNoteRepository
+from .versions import JOURNAL, NOTES, DataStamp, data_stamp
+
+K1 = 1.2
+B = 0.75
+MIN_PREFIX = 2  # shorter query words match whole terms only
+PREFIX_EXPANSIONS = 50  # vocabulary terms one query word may expand to
+PREFIX_WEIGHT = 0.8  # a prefix match ranks below the same word matched whole
+MAX_TERM_LENGTH = 64
+TITLE_LENGTH = 80
+FACET_LIMIT = 20
+
+TOKEN = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    'a an and are as at be but by for from had has have i if in is it its my of on or so that the then this '
+    'to was were will with'.split()
+)
+
+
+class Kind(NamedTuple):
+    repository_class: type
+    scope: str  # data version scope its writes bump
+    fields: Dict[str, float]  # searchable field: weight (mirrors the search_text index weights)
+
+
+KINDS = {
+    'journal': Kind(JournalEntryRepository, JOURNAL,
+                    {'setup': 2.0, 'thesis': 1.0, 'riskPlan': 1.0, 'emotions': 1.0, 'tags': 2.0}),
+    'note': Kind(NotebookNoteRepository, NOTES, {'title': 3.0, 'markdown': 1.0}),
+}
+SCOPES = tuple(kind.scope for kind in KINDS.values())
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN.findall(text.lower())
+            if token not in STOPWORDS and len(token) <= MAX_TERM_LENGTH]
+
+
+def _text(value) -> str:
+    return ' '.join(value) if isinstance(value, list) else value or ''
+
+
+def _title(kind: str, document: dict) -> str:
+    if kind == 'note':
+        text = document.get('title') or ''
+    else:
+        text = next((document[field] for field in ('setup', 'thesis', 'riskPlan', 'emotions') if document.get(field)),
+                    '')
+    line = text.strip().split('\n', 1)[0]
+    return line if len(line) <= TITLE_LENGTH else line[:TITLE_LENGTH - 1].rstrip() + '…'
+
+
+def _stored(value: Optional[datetime]) -> Optional[datetime]:
+    # As read back from MongoDB: naive UTC, millisecond precision (writes here may hold aware datetimes).
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+
+def projection(kind: str) -> dict:
+    return {**{field: 1 for field in KINDS[kind].fields}, 'tags': 1, 'audit': 1}
+
+
+class IndexedDocument(NamedTuple):
+    kind: str
+    title: str
+    tags: Tuple[str, ...]
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+    terms: Dict[str, float]  # weighted frequency per term, kept to undo the postings on update
+
+    @classmethod
+    def from_document(cls, kind: str, document: dict) -> 'IndexedDocument':
+        terms = Counter()
+        for field, weight in KINDS[kind].fields.items():
+            for token in tokenize(_text(document.get(field))):
+                terms[token] += weight
+        audit = document.get('audit') or {}
+        return cls(kind, _title(kind, document), tuple(document.get('tags') or ()), _stored(audit.get('createdAt')),
+                   _stored(audit.get('updatedAt')), dict(terms))
+
+
+class UserIndex:
+    """Inverted index of one user's journal entries and notes."""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.documents: Dict[str, IndexedDocument] = {}
+        self.lengths: Dict[str, float] = {}
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self.vocabulary: List[str] = []  # sorted terms, for prefix matching
+        self.tags: Dict[str, Set[str]] = {}
+        self.total_length = 0.0
+        self.versions: Dict[str, int] = {}  # scope -> data version reflected
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, document_id: str, document: IndexedDocument):
+        self.remove(document_id)
+        self.documents[document_id] = document
+        length = sum(document.terms.values())
+        self.lengths[document_id] = length
+        self.total_length += length
+        for term, frequency in document.terms.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+                insort(self.vocabulary, term)
+            postings[document_id] = frequency
+        for tag in document.tags:
+            self.tags.setdefault(tag, set()).add(document_id)
+
+    def remove(self, document_id: str):
+        document = self.documents.pop(document_id, None)
+        if document is None:
+            return
+        self.total_length -= self.lengths.pop(document_id)
+        for term in document.terms:
+            postings = self.postings[term]
+            del postings[document_id]
+            if not postings:
+                del self.postings[term]
+                del self.vocabulary[bisect_left(self.vocabulary, term)]
+        for tag in document.tags:
+            tagged = self.tags[tag]
+            tagged.discard(document_id)
+            if not tagged:
+                del self.tags[tag]
+
+    def sync(self, stamp: DataStamp):
+        """Catch up with writes made elsewhere since the versions this index reflects."""
+        with self.lock:
+            for name, kind in KINDS.items():
+                version = stamp.counters.get(kind.scope, 0)
+                if kind.scope not in self.versions:
+                    self._load(name)
+                elif self.versions[kind.scope] < version:  # a stamp read before apply_write may be behind
+                    self._refresh(name)
+                else:
+                    continue
+                self.versions[kind.scope] = version
+
+    def _collection(self, kind: str):
+        return get_repository(KINDS[kind].repository_class).get_collection()
+
+    def _load(self, kind: str):
+        for document in self._collection(kind).find({'tenant.userId': ObjectId(self.user_id)}, projection(kind)):
+            self.add(str(document['_id']), IndexedDocument.from_document(kind, document))
+
+    def _refresh(self, kind: str):
+        """Re-read documents whose updatedAt moved, add new ones and drop deleted ones."""
+        stored = {document_id: document.updated_at for document_id, document in self.documents.items()
+                  if document.kind == kind}
+        changed = []
+        for document in self._collection(kind).find({'tenant.userId': ObjectId(self.user_id)},
+                                                     {'audit.updatedAt': 1}):
+            document_id = str(document['_id'])
+            updated_at = (document.get('audit') or {}).get('updatedAt')
+            if document_id not in stored or stored.pop(document_id) != updated_at:
+                changed.append(document['_id'])
+        for document_id in stored:
+            self.remove(document_id)
+        if changed:
+            for document in self._collection(kind).find({'_id': {'$in': changed}}, projection(kind)):
+                self.add(str(document['_id']), IndexedDocument.from_document(kind, document))
+
+    def _matches(self, word: str, average_length: float) -> Dict[str, float]:
+        """BM25 score of one query word per matching document; the best of its exact and prefix matches."""
+        terms = [(word, 1.0)] if word in self.postings else []
+        if len(word) >= MIN_PREFIX:
+            start = bisect_right(self.vocabulary, word)
+            for term in self.vocabulary[start:start + PREFIX_EXPANSIONS]:
+                if not term.startswith(word):
+                    break
+                terms.append((term, PREFIX_WEIGHT))
+        count = len(self.documents)
+        scores = {}
+        for term, weight in terms:
+            postings = self.postings[term]
+            idf = weight * math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for document_id, frequency in postings.items():
+                norm = K1 * (1 - B + B * self.lengths[document_id] / average_length)
+                score = idf * frequency * (K1 + 1) / (frequency + norm)
+                if score > scores.get(document_id, 0.0):
+                    scores[document_id] = score
+        return scores
+
+    def search(self, query: str, tags: Sequence[str] = (), kinds: Iterable[str] = KINDS,
+               limit: int = 20, offset: int = 0) -> dict:
+        with self.lock:
+            words = list(dict.fromkeys(tokenize(query)))
+            average_length = (self.total_length / len(self.documents)) if self.documents else 1.0
+            if words:
+                scores = None
+                # Rarest words first, so the intersection shrinks early.
+                for word in sorted(words, key=lambda word: len(self.postings.get(word, ()))):
+                    matches = self._matches(word, average_length or 1.0)
+                    scores = matches if scores is None else {
+                        document_id: score + matches[document_id]
+                        for document_id, score in scores.items() if document_id in matches
+                    }
+                    if not scores:
+                        break
+            elif not query.strip():
+                scores = dict.fromkeys(self.documents, 0.0)
+            else:  # only stopwords or punctuation: nothing can match
+                scores = {}
+            kinds = set(kinds)
+            tagged = [self.tags.get(tag, set()) for tag in tags]
+            matched = [document_id for document_id in scores
+                       if self.documents[document_id].kind in kinds
+                       and all(document_id in documents for documents in tagged)]
+
+            facets = Counter(tag for document_id in matched for tag in self.documents[document_id].tags)
+            if words:
+                top = heapq.nlargest(offset + limit, matched, key=lambda document_id: (scores[document_id],
+                                                                                       document_id))
+            else:  # browsing by tag: newest first
+                top = heapq.nlargest(offset + limit, matched,
+                                     key=lambda document_id: (self.documents[document_id].created_at
+                                                              or datetime.min, document_id))
+            hits = []
+            for document_id in top[offset:]:
+                document = self.documents[document_id]
+                hits.append(hit(document.kind, document_id, document.title, document.tags, document.created_at,
+                                scores[document_id]))
+            return result(len(matched), hits, facets)
+
+
+def hit(kind, document_id, title, tags, created_at, score) -> dict:
+    return {'kind': kind, 'id': str(document_id), 'title': title, 'tags': list(tags), 'createdAt': created_at,
+            'score': round(score, 4)}
+
+
+def result(total: int, hits: List[dict], facets: Counter) -> dict:
+    return {'total': total, 'results': hits,
+            'facets': {'tags': [{'tag': tag, 'count': count} for tag, count in facets.most_common(FACET_LIMIT)]}}
+
+
+class IndexCache:
+    """LRU of per-user search indexes."""
+
+    def __init__(self, max_size: int = 128):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def peek(self, user_id: str) -> Optional[UserIndex]:
+        with self._lock:
+            return self._entries.get(user_id)
+
+    def get_or_create(self, user_id: str) -> UserIndex:
+        with self._lock:
+            index = self._entries.get(user_id)
+            if index is None:
+                self.misses += 1
+                index = self._entries[user_id] = UserIndex(user_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+            else:
+                self.hits += 1
+            self._entries.move_to_end(user_id)
+            return index
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'size': len(self._entries), 'documents': sum(len(index) for index in self._entries.values()),
+                    'hits': self.hits, 'misses': self.misses}
+
+
+indexes = IndexCache(settings.SEARCH_INDEX_CACHE_SIZE)
+
+
+def user_index(user_id, stamp: Optional[DataStamp] = None) -> UserIndex:
+    """The user's index, current as of ``stamp`` (read now if not given)."""
+    index = indexes.get_or_create(str(user_id))
+    index.sync(stamp or data_stamp(user_id))
+    return index
+
+
+def apply_write(user_id, kind: str, document_id, document: Optional[dict], version: int):
+    """Index a document just written (``None``: deleted) whose write bumped its scope to ``version``.
+
+    Only an index that was current before this write is updated; otherwise
+    another write came in between and the next search syncs.
+    """
+    index = indexes.peek(str(user_id))
+    if index is None:
+        return
+    scope = KINDS[kind].scope
+    with index.lock:
+        if index.versions.get(scope) != version - 1:
+            return
+        if document is None:
+            index.remove(str(document_id))
+        else:
+            index.add(str(document_id), IndexedDocument.from_document(kind, document))
+        index.versions[scope] = version
+
+
+def _text_search(user_id, query: str, tags: Sequence[str], kinds: Iterable[str], limit: int, offset: int) -> dict:
+    """The same search over the ``search_text`` indexes (``$text``: stemmed whole words)."""
+    candidates, total, facets = [], 0, Counter()
+    for kind in kinds:
+        match = {'tenant.userId': ObjectId(user_id)}
+        if query.strip():
+            match['$text'] = {'$search': query}
+        if tags:
+            match['tags'] = {'$all': list(tags)}
+        collection = get_repository(KINDS[kind].repository_class).get_collection()
+        fields = projection(kind)
+        if '$text' in match:
+            fields['score'] = {'$meta': 'textScore'}
+            sort = [('score', {'$meta': 'textScore'})]
+        else:
+            sort = [('audit.createdAt', -1)]
+        candidates += [(kind, document) for document in collection.find(match, fields, sort=sort,
+                                                                        limit=offset + limit)]
+        total += collection.count_documents(match)
+        facets.update({row['_id']: row['count'] for row in collection.aggregate([
+            {'$match': match}, {'$unwind': '$tags'}, {'$group': {'_id': '$tags', 'count': {'$sum': 1}}},
+        ])})
+
+    def rank(candidate):
+        kind, document = candidate
+        return document.get('score', 0.0), (document.get('audit') or {}).get('createdAt') or datetime.min
+
+    hits = [hit(kind, document['_id'], _title(kind, document), document.get('tags') or (),
+                (document.get('audit') or {}).get('createdAt'), document.get('score', 0.0))
+            for kind, document in heapq.nlargest(offset + limit, candidates, key=rank)[offset:]]
+    return result(total, hits, facets)
+
+
+def search(user_id, query: str, tags: Sequence[str] = (), kinds: Iterable[str] = KINDS, limit: int = 20,
+           offset: int = 0, stamp: Optional[DataStamp] = None) -> dict:
+    """Ranked hits of ``query`` among the user's documents of ``kinds`` that carry every tag in ``tags``.
+
+    An empty query lists the tagged documents, newest first.
+    """
+    started = time.perf_counter()
+    backend = 'local'
+    payload = None
+    if settings.SEARCH_BACKEND == 'mongo':
+        try:
+            payload = _text_search(user_id, query, tags, kinds, limit, offset)
+            backend = 'mongo'
+        except OperationFailure:  # no search_text index (yet): `manage.py ensure_indexes`
+            payload = None
+    if payload is None:
+        payload = user_index(user_id, stamp).search(query, tags, kinds, limit, offset)
+    return dict(payload, query=query, backend=backend, tookMs=round((time.perf_counter() - started) * 1000, 2))
@@ -1,33 +1,109 @@
 """Django REST Framework serializers for trading app models."""
 
+from datetime import datetime
+
 from rest_framework import serializers
 from django.contrib.auth.models import User as DjangoUser
 
 
 class UserSerializer(serializers.ModelSerializer):
     """Serializer for Django's built-in User model."""
-    
+
     class Meta:
         model = DjangoUser
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'date_joined']
         read_only_fields = ['id', 'date_joined']
 
 
-class TradeListSerializer(serializers.Serializer):
-    """Simple serializer for trade data (example)."""
-    
-    tradeId = serializers.CharField()
+class MongoDateField(serializers.DateField):
+    """A date that MongoDB stored as a midnight-UTC datetime."""
+
+    def to_representation(self, value):
+        if isinstance(value, datetime):
+            value = value.date()
+        return super().to_representation(value)
+
+
+class ObjectIdListField(serializers.ListField):
+    child = serializers.CharField()
+
+
+class MongoDocumentSerializer(serializers.Serializer):
+    """Read-only serializer over raw MongoDB documents with ``?fields=`` selection.
+
+    ``fields`` restricts the output to the named top-level fields, and
+    ``projection()`` turns the same selection into a MongoDB projection so
+    unselected fields are never read from the server.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields) - {self.Meta.id_field}:
+                self.fields.pop(name)
+
+    @classmethod
+    def field_names(cls):
+        return list(cls._declared_fields)
+
+    @classmethod
+    def projection(cls, fields=None) -> dict:
+        names = fields or cls.field_names()
+        return {cls._declared_fields[name].source or name: 1 for name in names if name in cls._declared_fields}
+
+
+class InstrumentSerializer(serializers.Serializer):
+    underlying = serializers.CharField()
+    optionType = serializers.CharField()
+    strike = serializers.FloatField()
+    expiry = MongoDateField()
+
+
+class TradeListSerializer(MongoDocumentSerializer):
+    """Trade document in the /api/trades/ shape (DRF path; the views use ``schemas.TradeOut``)."""
+
+    tradeId = serializers.CharField(source='_id')
+    createdAt = serializers.DateTimeField(source='audit.createdAt')
+    brokerRef = serializers.CharField(required=False, allow_null=True)
+    instrument = InstrumentSerializer()
     side = serializers.CharField()
     qty = serializers.IntegerField()
     price = serializers.FloatField()
+    fees = serializers.FloatField(required=False)
+    openTs = serializers.DateTimeField(required=False, allow_null=True)
+    closeTs = serializers.DateTimeField(required=False, allow_null=True)
     status = serializers.CharField()
+    strategyTag = serializers.ListField(child=serializers.CharField(), required=False)
+    marketSentimentTag = serializers.ListField(child=serializers.CharField(), required=False)
+    regimeTagIds = ObjectIdListField(required=False)
+    journalEntryIds = ObjectIdListField(required=False)
+    realizedPnL = serializers.FloatField(required=False, allow_null=True)
+    unrealizedPnL = serializers.FloatField(required=False, allow_null=True)
+    mae = serializers.FloatField(required=False, allow_null=True)
+    mfe = serializers.FloatField(required=False, allow_null=True)
+
+    class Meta:
+        id_field = 'tradeId'
 
 
-class JournalEntrySerializer(serializers.Serializer):
-    """Simple serializer for journal entry data (example)."""
-    
-    entryId = serializers.CharField()
-    title = serializers.CharField(required=False)
-    setup = serializers.CharField(required=False)
-    thesis = serializers.CharField(required=False)
-    emotions = serializers.CharField(required=False)
+class ChecklistItemSerializer(serializers.Serializer):
+    label = serializers.CharField()
+    checked = serializers.BooleanField()
+
+
+class JournalEntrySerializer(MongoDocumentSerializer):
+    """Journal entry in the /api/journal/ shape (DRF path; the views use ``schemas.JournalEntryOut``)."""
+
+    entryId = serializers.CharField(source='_id')
+    createdAt = serializers.DateTimeField(source='audit.createdAt')
+    tradeId = serializers.CharField(required=False, allow_null=True)
+    setup = serializers.CharField(required=False, allow_null=True)
+    thesis = serializers.CharField(required=False, allow_null=True)
+    riskPlan = serializers.CharField(required=False, allow_null=True)
+    emotions = serializers.CharField(required=False, allow_null=True)
+    checklistItems = ChecklistItemSerializer(many=True, required=False)
+    tags = serializers.ListField(child=serializers.CharField(), required=False)
+    screenshotIds = ObjectIdListField(required=False)
+
+    class Meta:
+        id_field = 'entryId'
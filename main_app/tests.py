@@ -1,41 +1,768 @@
-import os
-from django.test import TestCase
-
-
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
-from dotenv import load_dotenv
-# Load environment variables from .env file
-load_dotenv()
-  
-
-uri = os.environ.get('uri')
-# Create a new client and connect to the server
-client = MongoClient(uri, server_api=ServerApi('1'))
-# Send a ping to confirm a successful connection
-try:
-    database = client.get_database("sample_mflix")
-    movies = database.get_collection("movies")
-    # Query for a movie that has the title 'Back to the Future'
-    query = { "title": "Back to the Future" }
-    movie = movies.find_one(query)
-    print(movie)
-    
-    # Access the database named "mydatabase".
-    # If "mydatabase" does not exist, MongoDB will create it when content is added.
-    mydb = client["mydatabase"]
-
-    # Access a collection named "mycollection" within "mydatabase".
-    # If "mycollection" does not exist, MongoDB will create it.
-    mycol = mydb["mycollection"]
-
-    # Insert a document into the collection. This action will create both the collection
-    # and the database if they don't already exist.
-    mydocument = { "name": "John", "address": "Highway 37" }
-    x = mycol.insert_one(mydocument)
-    print(f"Document inserted with ID: {x.inserted_id}")
-
-    print(client.list_database_names())
-    client.close()
-except Exception as e:
-    raise Exception("Unable to find the document due to the following error: ", e)
\ No newline at end of file
+"""Unit tests for the pure logic; none of them talks to MongoDB."""
+
+import hashlib
+import io
+import json
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from unittest import mock
+
+import numpy as np
+from asgiref.sync import iscoroutinefunction
+from bson import ObjectId
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .analytics import RUIN_UNITS, group_metrics
+from .api_views import byte_range, diagnostics
+from .bars import BAR_DTYPE, MS_PER_DAY, BarStore, day_number
+from .behavior import EventWriter
+from .blobs import BlobNotFound, BlobTooLarge, FileSystemBlobStore, StoredBlob, read_range
+from .caching import conditional, fragment_key
+from .cohort_queries import metrics_from_stats, python_cohort_stats
+from .db import MongoConnectionManager, PoolStatsListener, connection_manager, index_models, repository_classes
+from .equity import MIN_PATHS, simulate_ruin
+from .excursions import compute_excursions
+from .exports import flatten
+from .idempotency import dedupe_key
+from .importer import ImportFailed, RowMapper, get_template, numbered_batches, validate_batch
+from .incremental_analytics import apply_trade_change, period_bounds
+from .jobs import _run_import, claim, complete, fail, heartbeat, retry_delay
+from .ledger import _write_position, replay_fills
+from .links import parse
+from .middleware import (
+    SESSION_PRINCIPAL_KEY, MongoAuthMiddleware, PrincipalCache, SimpleUser, aload_principal, principal_cache,
+)
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_query
+from .regimes import FactorIndex, regime_bounds
+from .renderers import dumps
+from .revaluation import PriceTable, RevaluationFailed, black_scholes, join_keys
+from .schemas import TRADE_SCHEMA
+from .search import IndexedDocument, UserIndex
+from .time_tracking import Intervals, SessionColumns, net_intervals, net_screen_seconds, union
+from .user_model import UserRepository
+from .versions import DataStamp
+
+
+class ConnectionManagerTests(SimpleTestCase):
+    def test_pool_listener_derives_open_and_checked_out_connections(self):
+        listener = PoolStatsListener()
+        for event in ('connection_created', 'connection_created', 'connection_checked_out', 'connection_checked_out',
+                      'connection_checked_in', 'connection_closed'):
+            getattr(listener, event)(None)
+        stats = listener.snapshot()
+        self.assertEqual((stats['connections_created'], stats['open_connections'], stats['in_use']), (2, 1, 1))
+
+    @override_settings(MONGODB_URI='mongodb://localhost:27017', MONGODB_MAX_POOL_SIZE=7)
+    def test_one_lazy_client_and_cached_repositories(self):
+        class Repository:
+            def __init__(self, database):
+                self.database = database
+
+        manager = MongoConnectionManager()
+        self.addCleanup(manager.close)
+        self.assertFalse(manager.pool_stats()['initialized'])
+        self.assertIs(manager.get_client(), manager.get_client())  # MongoClient connects in the background
+        self.assertIs(manager.get_repository(Repository), manager.get_repository(Repository))
+        stats = manager.pool_stats()
+        self.assertTrue(stats['initialized'])
+        self.assertEqual(stats['max_pool_size'], 7)
+
+    def test_diagnostics_are_for_admins(self):
+        request = APIRequestFactory().get('/api/diagnostics/')
+        force_authenticate(request, SimpleUser({'_id': ObjectId(), 'username': 'ann'}))
+        with mock.patch.object(connection_manager, 'get_repository') as repository:
+            users = repository.return_value.get_collection.return_value
+            users.find_one.return_value = {'role': 'reader'}
+            self.assertEqual(diagnostics(request).status_code, 403)
+            users.find_one.return_value = {'role': 'admin'}
+            response = diagnostics(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('in_use', response.data['mongoPool'])
+        self.assertIn('hit_rate', response.data['principalCache'])
+
+
+class PrincipalCacheTests(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = PrincipalCache(max_size=2, ttl=60)
+        cache.put('a', {'_id': 'a'})
+        cache.put('b', {'_id': 'b'})
+        cache.get('a')
+        cache.put('c', {'_id': 'c'})
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), {'_id': 'a'})
+        self.assertEqual(cache.stats()['evictions'], 1)
+        expired = PrincipalCache(ttl=0)
+        expired.put('a', {'_id': 'a'})
+        self.assertIsNone(expired.get('a'))
+
+    def test_invalidation_outdates_session_copies(self):
+        cache = PrincipalCache(ttl=60)
+        cached_at = time.time() - 1
+        self.assertTrue(cache.is_fresh('a', cached_at))
+        cache.invalidate('a')
+        self.assertFalse(cache.is_fresh('a', cached_at))
+        self.assertTrue(cache.is_fresh('b', cached_at))
+        self.assertFalse(cache.is_fresh('b', time.time() - 61))
+
+    def test_invalidations_older_than_the_ttl_are_dropped(self):
+        cache = PrincipalCache(ttl=60)
+        with mock.patch('main_app.middleware.time.time', return_value=1000.0):
+            cache.invalidate('a')
+            cache.invalidate('b')
+        with mock.patch('main_app.middleware.time.time', return_value=1030.0):
+            cache.invalidate('a')
+        with mock.patch('main_app.middleware.time.time', return_value=1070.0):
+            cache.invalidate('c')
+        self.assertEqual(list(cache._invalidated_at), ['a', 'c'])
+
+    def test_user_writes_invalidate(self):
+        user_id = ObjectId()
+        principal_cache.put(str(user_id), {'_id': user_id})
+        self.addCleanup(principal_cache.clear)
+        with mock.patch.object(UserRepository, 'get_collection'):
+            UserRepository(database=mock.Mock()).delete_by_id(user_id)
+        self.assertIsNone(principal_cache.get(str(user_id)))
+
+
+class IndexModelTests(SimpleTestCase):
+    def test_default_names_and_options(self):
+        class Repository:
+            class Meta:
+                indexes = [{'keys': [('tenant.userId', 1), ('audit.createdAt', -1)]},
+                           {'keys': [('dedupeKey', 1)], 'unique': True, 'name': 'dedupe'}]
+
+        first, second = (model.document for model in index_models(Repository))
+        self.assertEqual(first['name'], 'tenant.userId_1_audit.createdAt_-1')
+        self.assertEqual(list(first['key'].items()), [('tenant.userId', 1), ('audit.createdAt', -1)])
+        self.assertEqual((second['name'], second['unique']), ('dedupe', True))
+
+    def test_every_declared_index_builds(self):
+        for repository_class in repository_classes():
+            names = [model.document['name'] for model in index_models(repository_class)]
+            self.assertEqual(len(names), len(set(names)), repository_class.__name__)
+
+
+class CursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        document = {'_id': ObjectId(), 'audit': {'createdAt': datetime(2026, 3, 2, 14, 30, 5, 123000)}}
+        value, object_id = decode_cursor(encode_cursor(document, 'audit.createdAt'))
+        self.assertEqual(value, datetime(2026, 3, 2, 14, 30, 5, 123000, tzinfo=timezone.utc))
+        self.assertEqual(object_id, document['_id'])
+        after = encode_cursor(document, 'audit.createdAt')
+        self.assertEqual(keyset_query({'tenant.userId': 1}, 'audit.createdAt', after), {
+            '$and': [{'tenant.userId': 1}, {'$or': [
+                {'audit.createdAt': {'$lt': value}},
+                {'audit.createdAt': value, '_id': {'$lt': document['_id']}},
+            ]}],
+        })
+
+    def test_first_page_and_bad_cursor(self):
+        self.assertEqual(keyset_query({'a': 1}, 'audit.createdAt', None), {'a': 1})
+        for cursor in ('not-a-cursor', encode_cursor({'_id': 'x', 'n': 1}, 'n')):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
+
+
+class GroupMetricsTests(SimpleTestCase):
+    def test_drawdown_follows_each_group_curve(self):
+        codes = np.array([0, 1, 0, 1, 0, 2])
+        pnl = np.array([10.0, -5.0, -20.0, 5.0, 15.0, 3.0])
+        metrics = group_metrics(codes, 4, pnl)
+        np.testing.assert_array_equal(metrics['count'], [3, 2, 1, 0])
+        np.testing.assert_array_equal(metrics['sum'], [5.0, 0.0, 3.0, 0.0])
+        # Group 0: equity 10, -10, 5 under a peak of 10. Group 1 never rises above the floor of 0.
+        np.testing.assert_array_equal(metrics['drawdown'][:3], [20.0, 5.0, 0.0])
+        np.testing.assert_array_equal(metrics['peak'][:3], [10.0, 0.0, 3.0])
+        self.assertTrue(np.isnan(metrics['drawdown'][3]))
+
+    def test_matches_a_loop_per_group(self):
+        rng = np.random.default_rng(7)
+        codes = rng.integers(0, 5, 500)
+        pnl = rng.normal(0, 10, 500)
+        metrics = group_metrics(codes, 5, pnl)
+        for group in range(5):
+            equity = np.cumsum(pnl[codes == group])
+            peak = np.maximum(np.maximum.accumulate(equity), 0.0)
+            self.assertAlmostEqual(metrics['drawdown'][group], (peak - equity).max())
+
+
+def closed_trade(pnl, when, **fields):
+    return dict({'_id': ObjectId(), 'tenant': {'userId': ObjectId(), 'orgId': ObjectId()}, 'status': 'CLOSED',
+                 'realizedPnL': pnl, 'openTs': when - timedelta(hours=1), 'closeTs': when,
+                 'strategyTag': ['breakout'], 'audit': {'createdAt': when}}, **fields)
+
+
+class IncrementalAnalyticsTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(connection_manager, 'get_repository')
+        self.collection = patcher.start().return_value.get_collection.return_value
+        self.addCleanup(patcher.stop)
+
+    def written(self):
+        return self.collection.bulk_write.call_args.args[0]
+
+    def test_period_bounds(self):
+        day = date(2026, 2, 18)  # a Wednesday
+        self.assertEqual(period_bounds(day, 'daily'), (day, day))
+        self.assertEqual(period_bounds(day, 'weekly'), (date(2026, 2, 16), date(2026, 2, 22)))
+        self.assertEqual(period_bounds(day, 'monthly'), (date(2026, 2, 1), date(2026, 2, 28)))
+
+    def test_changes_outside_the_metrics_write_nothing(self):
+        trade = closed_trade(25.0, datetime(2026, 3, 4, 15))
+        self.assertEqual(apply_trade_change(trade, dict(trade, notes='edited')), 0)
+        self.assertEqual(apply_trade_change(None, dict(trade, status='OPEN')), 0)
+        self.collection.bulk_write.assert_not_called()
+
+    def test_closing_adds_the_trade_to_each_period(self):
+        trade = closed_trade(25.0, datetime(2026, 3, 4, 15))
+        self.assertEqual(apply_trade_change(dict(trade, status='OPEN', realizedPnL=None), trade), 3)
+        self.assertEqual([(update._filter['granularity'], update._filter['periodStart']) for update in self.written()],
+                         [('daily', date(2026, 3, 4)), ('weekly', date(2026, 3, 2)), ('monthly', date(2026, 3, 1))])
+        self.assertTrue(self.collection.bulk_write.call_args.kwargs['ordered'])
+
+    def test_a_changed_result_is_removed_before_it_is_added_again(self):
+        trade = closed_trade(25.0, datetime(2026, 3, 4, 15))
+        self.assertEqual(apply_trade_change(trade, dict(trade, realizedPnL=-5.0)), 6)
+        signs = [update._doc[0]['$set']['stats.n']['$add'][1] for update in self.written()]
+        self.assertEqual(signs, [-1, -1, -1, 1, 1, 1])
+
+
+class CohortStatsTests(SimpleTestCase):
+    def test_each_tag_matches_its_own_curve(self):
+        rng = np.random.default_rng(3)
+        documents = [{'_id': ObjectId(), 'realizedPnL': float(rng.normal(0, 10)),
+                      'closeTs': datetime(2026, 3, 2) + timedelta(hours=n),
+                      'strategyTag': [str(tag) for tag in rng.choice(['a', 'b', 'c'], rng.integers(0, 3), False)]}
+                     for n in range(60)]
+        rows = python_cohort_stats(documents, {'byStrategy': 'strategyTag'})['byStrategy']
+        self.assertEqual([row['_id'] for row in rows], ['a', 'b', 'c'])
+        for row in rows:
+            pnl = np.array([document['realizedPnL'] for document in documents
+                            if row['_id'] in document['strategyTag']])
+            self.assertEqual(row['n'], len(pnl))
+            self.assertAlmostEqual(row['sum'], pnl.sum())
+            self.assertAlmostEqual(row['maxDrawdown'], group_metrics(np.zeros(len(pnl), int), 1, pnl)['drawdown'][0])
+
+    def test_metrics_from_stats(self):
+        stats = {'n': 4, 'sum': 20.0, 'sumSq': 550.0, 'wins': 2, 'losses': 2, 'grossWin': 30.0, 'grossLoss': 10.0,
+                 'maxDrawdown': 5.0}
+        metrics = metrics_from_stats(stats)
+        self.assertEqual((metrics['winRate'], metrics['expectancy'], metrics['drawdown']), (0.5, 5.0, 5.0))
+        self.assertAlmostEqual(metrics['sharpeLike'], 5.0 / 112.5 ** 0.5)
+        self.assertEqual(metrics['riskOfRuin'], 0.0)  # payoff 3 at a 50% win rate: an edge of 1
+        self.assertEqual(metrics_from_stats(dict(stats, wins=0, grossWin=0.0))['riskOfRuin'], 1.0)
+        self.assertIsNone(metrics_from_stats(dict(stats, n=0))['winRate'])
+
+
+class ImporterTests(SimpleTestCase):
+    tenant = {'userId': ObjectId(), 'orgId': ObjectId()}
+    now = datetime(2026, 3, 2, 20, 0)
+
+    def test_broker_template_maps_aliases_and_formats(self):
+        row = {'Order #': '381', 'Underlying Symbol': 'SPY', 'Call or Put': 'c', 'Strike Price': '$1,400',
+               'Expiration Date': '3/20/26', 'Action': 'Sell to Close', 'Quantity': '2', 'Average Price': '-1.25',
+               'Fees': '1.30', 'Date': '2026-03-02T14:30:00+00:00'}
+        mapper = RowMapper(get_template('tastytrade'))
+        documents, errors = validate_batch([(2, row), (3, dict(row, Quantity='two'))], mapper, self.tenant, self.now)
+        self.assertEqual([error['row'] for error in errors], [3])
+        self.assertIn('qty', errors[0]['error'])
+        document, = documents
+        self.assertEqual((document['side'], document['qty'], document['price'], document['status']),
+                         ('SELL', 2, 1.25, 'OPEN'))
+        self.assertEqual(document['openTs'], datetime(2026, 3, 2, 14, 30, tzinfo=timezone.utc))
+        instrument = document['instrument']
+        self.assertEqual((instrument['optionType'], instrument['strike']), ('CALL', 1400.0))
+        self.assertEqual(instrument['expiry'].date() if isinstance(instrument['expiry'], datetime)
+                         else instrument['expiry'], date(2026, 3, 20))
+        self.assertEqual(document['tenant'], self.tenant)
+
+    def test_default_template_splits_lists_and_unknown_templates_fail(self):
+        mapper = RowMapper(get_template(None))
+        trade = mapper({'side': 'BOT', 'qty': '1', 'strategyTag': 'gap; ;fade', 'fees': ''}, self.tenant, self.now)
+        self.assertEqual((trade['side'], trade['strategyTag'], trade['status']), ('BUY', ['gap', 'fade'], 'OPEN'))
+        self.assertNotIn('fees', trade)
+        with self.assertRaises(ImportFailed):
+            get_template('nope')
+
+    def test_batches_carry_csv_line_numbers(self):
+        self.assertEqual(list(numbered_batches(iter('abcde'), 2)),
+                         [[(2, 'a'), (3, 'b')], [(4, 'c'), (5, 'd')], [(6, 'e')]])
+
+
+@override_settings(JOB_RETRY_BASE_SECONDS=10, JOB_RETRY_MAX_SECONDS=300, JOB_MAX_ATTEMPTS=3, JOB_LEASE_SECONDS=60)
+class JobQueueTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch('main_app.jobs._collection')
+        self.collection = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def test_retry_delay_doubles_up_to_the_cap_with_jitter(self):
+        for attempts, full in ((1, 10), (2, 20), (4, 80), (10, 300)):
+            for _ in range(50):
+                self.assertTrue(full / 2 <= retry_delay(attempts) <= full)
+
+    def test_claim_takes_pending_and_lease_expired_jobs(self):
+        claim('w1', query={'kind': 'import'})
+        query, update = self.collection.find_one_and_update.call_args.args
+        runnable, extra = query['$and']
+        self.assertEqual(extra, {'kind': 'import'})
+        pending, unscheduled, expired = runnable['$or']
+        now = expired['leaseExpiresAt']['$lt']
+        self.assertEqual(pending, {'status': 'PENDING', 'runAfter': {'$lte': now}})
+        self.assertEqual(expired['status'], 'RUNNING')
+        self.assertEqual(update['$set']['leaseOwner'], 'w1')
+        self.assertEqual(update['$set']['leaseExpiresAt'], now + timedelta(seconds=60))
+        self.assertEqual(update['$inc'], {'attempts': 1})
+
+    def test_failures_back_off_until_out_of_attempts(self):
+        self.collection.update_one.return_value.matched_count = 1
+        self.assertEqual(fail({'_id': 1, 'attempts': 1}, 'w1', 'boom'), 'PENDING')
+        query, update = self.collection.update_one.call_args.args
+        self.assertEqual(query, {'_id': 1, 'status': 'RUNNING', 'leaseOwner': 'w1'})
+        self.assertGreater(update['$set']['runAfter'], datetime.now(timezone.utc) + timedelta(seconds=4))
+        self.assertEqual(fail({'_id': 1, 'attempts': 3}, 'w1', 'boom'), 'FAILED')
+
+    def test_a_lost_lease_is_not_released(self):
+        self.collection.update_one.return_value.matched_count = 0
+        self.assertIsNone(complete({'_id': 1}, 'w1'))
+        self.assertIsNone(fail({'_id': 1, 'attempts': 1}, 'w1', 'boom'))
+        self.assertFalse(heartbeat(1, 'w1', 60))
+
+    def test_a_retry_that_finds_only_duplicates_still_post_processes(self):
+        job = {'_id': 1, 'tenant': {'userId': ObjectId(), 'orgId': ObjectId()}}
+        totals = dict.fromkeys(('rowsRead', 'rowsInserted', 'rowsDuplicate', 'rowsFailed', 'batches',
+                                'closedWithPnL'), 0)
+        with mock.patch.multiple('main_app.jobs', execute_import=mock.DEFAULT, bump_data_version=mock.DEFAULT,
+                                 enqueue_analytics_rebuild=mock.DEFAULT) as patched, \
+                mock.patch('main_app.ledger.replay_user') as replay_user, mock.patch('main_app.regimes.tag_user'):
+            replay_user.return_value = {'realizedChanged': 0}
+            patched['execute_import'].return_value = dict(totals, rowsRead=3, rowsDuplicate=3)
+            _run_import(job)
+            replay_user.assert_called_once_with(job['tenant']['userId'])
+            patched['enqueue_analytics_rebuild'].assert_called_once_with(job['tenant'])
+            patched['execute_import'].return_value = dict(totals, rowsRead=3, rowsFailed=3)
+            _run_import(job)
+            replay_user.assert_called_once()
+
+
+class DedupeKeyTests(SimpleTestCase):
+    trade = {'side': 'BUY', 'qty': 2, 'price': 1.25, 'fees': 1.3, 'openTs': datetime(2026, 3, 2, 14, 30),
+             'instrument': {'underlying': 'SPY', 'optionType': 'CALL', 'strike': 400,
+                            'expiry': datetime(2026, 3, 20)}}
+
+    def test_broker_ref_then_form_token_then_content(self):
+        self.assertEqual(dedupe_key({**self.trade, 'brokerRef': 'X1'}, 'token'), 'ref:X1')
+        self.assertEqual(dedupe_key(self.trade, 'token'), 'form:token')
+        self.assertTrue(dedupe_key(self.trade).startswith('sha:'))
+
+    def test_content_key_ignores_representation_and_lifecycle(self):
+        same = {**self.trade, 'qty': 2.0, 'openTs': datetime(2026, 3, 2, 15, 30, tzinfo=timezone(timedelta(hours=1))),
+                'instrument': {**self.trade['instrument'], 'strike': 400.0},
+                'status': 'CLOSED', 'realizedPnL': 12.0, 'tags': ['x']}
+        self.assertEqual(dedupe_key(same), dedupe_key(self.trade))
+        self.assertNotEqual(dedupe_key({**self.trade, 'price': 1.26}), dedupe_key(self.trade))
+
+
+def fill(side, qty, price, minutes, fees=0.0):
+    return {'_id': ObjectId(), 'side': side, 'qty': qty, 'price': price, 'fees': fees,
+            'openTs': datetime(2026, 3, 2, 14, 30) + timedelta(minutes=minutes)}
+
+
+class LedgerTests(SimpleTestCase):
+    def setUp(self):
+        self.fills = [fill('BUY', 10, 1.0, 0), fill('BUY', 10, 2.0, 1), fill('SELL', 15, 3.0, 2)]
+
+    def realized(self, method):
+        book, fields, unmatched = replay_fills(self.fills, method, 1.0)
+        self.assertEqual(unmatched, 0.0)
+        return book, fields
+
+    def test_fifo_closes_the_oldest_lot_first(self):
+        book, fields = self.realized('FIFO')
+        self.assertAlmostEqual(fields[self.fills[2]['_id']]['realizedPnL'], 10 * 2.0 + 5 * 1.0)
+        self.assertEqual(fields[self.fills[0]['_id']]['status'], 'CLOSED')
+        self.assertEqual(fields[self.fills[1]['_id']], {'status': 'OPEN', 'unrealizedPnL': 5.0})
+
+    def test_lifo_closes_the_newest_lot_first(self):
+        book, fields = self.realized('LIFO')
+        self.assertAlmostEqual(fields[self.fills[2]['_id']]['realizedPnL'], 10 * 1.0 + 5 * 2.0)
+        self.assertEqual(fields[self.fills[0]['_id']], {'status': 'OPEN', 'unrealizedPnL': 10.0})
+
+    def test_average_releases_the_mean_cost(self):
+        book, fields = self.realized('AVERAGE')
+        self.assertAlmostEqual(fields[self.fills[2]['_id']]['realizedPnL'], 15 * (3.0 - 1.5))
+        self.assertAlmostEqual(book.books['long'].average_cost(), 1.5)
+
+    def test_fees_and_short_lots(self):
+        fills = [fill('SHORT', 2, 5.0, 0, fees=1.0), fill('COVER', 2, 4.0, 1, fees=1.0)]
+        book, fields, unmatched = replay_fills(fills, 'FIFO', 100.0)
+        # Credit of 5 less 0.005 per unit of fees, bought back at 4, less the closing fee.
+        self.assertAlmostEqual(fields[fills[1]['_id']]['realizedPnL'], (4.995 - 4.0) * 2 * 100 - 1.0)
+
+    def test_rewriting_a_position_keeps_its_creation_time(self):
+        book, fields = self.realized('FIFO')
+        now = datetime(2026, 3, 3, tzinfo=timezone.utc)
+        update = _write_position(ObjectId(), {}, ('SPY', 'CALL', 400.0, datetime(2026, 12, 18)), book, now)
+        self.assertEqual(update._doc['$setOnInsert'], {'audit.createdAt': now})
+        self.assertEqual(update._doc['$set']['audit.updatedAt'], now)
+        self.assertNotIn('audit', update._doc['$set'])
+
+    def test_closes_record_when_their_earliest_lot_was_opened(self):
+        fields = self.realized('FIFO')[1]
+        self.assertEqual(fields[self.fills[2]['_id']]['entryTs'], self.fills[0]['openTs'])
+        fills = self.fills[:2] + [fill('SELL', 5, 3.0, 2)]
+        book, fields, unmatched = replay_fills(fills, 'LIFO', 1.0)
+        self.assertEqual(fields[fills[2]['_id']]['entryTs'], fills[1]['openTs'])
+
+    def test_unmatched_close(self):
+        fills = [fill('BUY', 1, 1.0, 0), fill('SELL', 3, 2.0, 1), fill('SELL', 1, 2.0, 2)]
+        book, fields, unmatched = replay_fills(fills, 'FIFO', 1.0)
+        self.assertEqual(unmatched, 1.0)
+        self.assertNotIn(fills[2]['_id'], fields)
+
+
+class RevaluationTests(SimpleTestCase):
+    def test_reference_prices_and_intrinsic(self):
+        prices = black_scholes([100, 100, 90, 90], [100, 100, 100, 100], [1, 1, 0, 1], 0.05, [0.2, 0.2, 0.2, 0],
+                               np.array([True, False, False, True]))
+        np.testing.assert_allclose(prices[:2], [10.4506, 5.5735], atol=1e-4)
+        np.testing.assert_array_equal(prices[2:], [10.0, 0.0])
+
+    def test_put_call_parity(self):
+        spot, strike, years, rate, vol = 105.0, 95.0, 0.5, 0.03, 0.35
+        call, put = black_scholes([spot] * 2, [strike] * 2, [years] * 2, rate, [vol] * 2, np.array([True, False]))
+        self.assertAlmostEqual(call - put, spot - strike * np.exp(-rate * years), places=5)
+
+    def test_price_table_splits_spots_from_options(self):
+        table = PriceTable({'underlying': [' spy', 'SPY', 'SPY', 'QQQ'], 'optionType': ['', 'c', 'Put', 'C'],
+                            'strike': [None, '400', '390.5', None], 'expiry': [None, '2026-03-20', '2026-03-20', None],
+                            'mark': ['401.2', '3.5', '1.25', '']})
+        self.assertEqual(table.spots, {'SPY': 401.2})
+        self.assertEqual(table.option_type.tolist(), ['CALL', 'PUT'])
+        np.testing.assert_array_equal(table.strike, [400.0, 390.5])
+        self.assertEqual(len(table), 2)
+
+    def test_join_keys(self):
+        left = (np.array(['SPY', 'SPY', 'QQQ']), np.array([1, 2, 1]))
+        right = (np.array(['SPY', 'QQQ']), np.array([2, 1]))
+        np.testing.assert_array_equal(join_keys(left, right), [-1, 0, 1])
+
+    def test_unreadable_values_name_their_row_and_column(self):
+        columns = {'underlying': ['SPY', 'SPY'], 'optionType': ['C', ''], 'strike': ['400', None],
+                   'expiry': ['2026-03-20', None], 'mark': ['3.5', '401.2']}
+        for column, value in (('mark', 'n/a'), ('strike', 'abc'), ('expiry', '20/03/2026')):
+            bad = dict(columns, **{column: [value, columns[column][1]]})
+            with self.assertRaisesMessage(RevaluationFailed, f"row 1, column '{column}'"):
+                PriceTable(bad)
+
+
+class BarStoreTests(SimpleTestCase):
+    day = MS_PER_DAY * 20_500
+    minute = 60_000
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = BarStore(directory.name)
+
+    def write(self, *bars):
+        return self.store.write('spy', np.array(list(bars), dtype=BAR_DTYPE))
+
+    def test_extremes_over_inclusive_windows_across_days(self):
+        day, minute = self.day, self.minute
+        self.assertEqual(self.write((day + minute, 10, 12, 9, 11), (day + 2 * minute, 11, 15, 10, 14),
+                                    (day + MS_PER_DAY, 14, 14.5, 8, 9)), 2)
+        self.assertEqual(self.store.extremes('SPY', day + minute, day + MS_PER_DAY), (10.0, 15.0, 8.0))
+        self.assertEqual(self.store.extremes('SPY', day + 2 * minute, day + 2 * minute), (11.0, 15.0, 10.0))
+        self.assertIsNone(self.store.extremes('SPY', day + 3 * minute, day + MS_PER_DAY - 1))
+        self.assertIsNone(self.store.extremes('QQQ', day, day + MS_PER_DAY))
+
+    def test_a_closing_fill_is_measured_from_its_lots(self):
+        day, minute = self.day, self.minute
+        self.write((day + minute, 10, 12, 9, 11), (day + 2 * minute, 11, 15, 10, 14),
+                   (day + 3 * minute, 14, 14, 14, 14))
+        opened, closed = (datetime(1970, 1, 1) + timedelta(milliseconds=day + n * minute) for n in (1, 3))
+        close = {'_id': 1, 'instrument': {'underlying': 'SPY', 'optionType': 'CALL'}, 'side': 'SELL',
+                 'openTs': closed, 'closeTs': closed, 'entryTs': opened}
+        # A long call: the low of 9 is 1 point against the entry at 10, the high of 15 is 5 in favour.
+        self.assertEqual(compute_excursions([close], self.store), {1: (1.0, 5.0)})
+        self.assertEqual(compute_excursions([dict(close, entryTs=None)], self.store), {1: (0.0, 0.0)})
+
+    def test_new_bars_replace_stored_ones(self):
+        self.write((self.day + self.minute, 10, 12, 9, 11))
+        self.store.extremes('SPY', self.day, self.day + MS_PER_DAY)  # leaves the day memory-mapped
+        self.write((self.day + self.minute, 20, 21, 19, 20), (self.day, 5, 6, 4, 5))
+        self.assertEqual(self.store.extremes('SPY', self.day, self.day + MS_PER_DAY), (5.0, 21.0, 4.0))
+        self.assertEqual(len(self.store.day('SPY', self.day // MS_PER_DAY)), 2)
+
+
+class RiskOfRuinTests(SimpleTestCase):
+    pnl = np.array([30.0, -20.0, 15.0, -25.0, 40.0, -10.0])
+
+    def test_a_seed_gives_the_same_answer_with_any_number_of_workers(self):
+        single = simulate_ruin(self.pnl, paths=5_000, horizon=60, capital=50.0, seed=11, workers=1)
+        self.assertEqual(simulate_ruin(self.pnl, paths=5_000, horizon=60, capital=50.0, seed=11, workers=3), single)
+        self.assertTrue(0.0 < single['probability'] < 1.0)
+
+    def test_defaults_come_from_the_observed_trades(self):
+        result = simulate_ruin(self.pnl, paths=100)
+        self.assertEqual(result['horizon'], len(self.pnl))
+        self.assertAlmostEqual(result['capital'], RUIN_UNITS * 55.0 / 3)
+
+    def test_no_losses_no_ruin(self):
+        self.assertEqual(simulate_ruin(np.array([1.0, 2.0]), paths=100)['probability'], 0.0)
+
+    def test_step_cap_cuts_paths_then_horizon(self):
+        result = simulate_ruin(self.pnl, paths=10_000, horizon=500, max_steps=100_000)
+        self.assertEqual((result['paths'], result['horizon']), (200, 500))
+        result = simulate_ruin(self.pnl, paths=10_000, horizon=5_000, max_steps=100_000)
+        self.assertEqual((result['paths'], result['horizon']), (MIN_PATHS, 1_000))
+
+
+class FactorIndexTests(SimpleTestCase):
+    thresholds = {'vix': {'edges': [15, 25], 'labels': ['low', 'mid', 'high']}, 'volRegime': {}}
+
+    def setUp(self):
+        self.index = FactorIndex([
+            {'date': datetime(2026, 3, 4), 'values': {'vix': 25.0}},
+            {'date': datetime(2026, 3, 2), 'values': {'vix': 14.9, 'volRegime': 'contango'}},
+            {'date': datetime(2026, 3, 3), 'values': {'vix': 15.0}},
+            {'date': datetime(2026, 3, 9), 'values': None},
+        ], self.thresholds)
+
+    def test_an_edge_value_falls_in_the_upper_bucket(self):
+        self.assertEqual(self.index.labels, [['vix:low', 'volRegime:contango'], ['vix:mid'], ['vix:high'], []])
+        self.assertEqual(self.index.regime_names(), ['vix:high', 'vix:low', 'vix:mid', 'volRegime:contango'])
+
+    def test_trades_match_the_latest_factor_within_max_age(self):
+        days = np.array([day_number(date(2026, 3, day)) for day in (1, 2, 6, 7, 9)])
+        np.testing.assert_array_equal(self.index.match(days, 2), [-1, 0, 2, -1, 3])
+
+    def test_regime_bounds(self):
+        self.assertEqual(regime_bounds('vix:low', self.thresholds), [None, 15])
+        self.assertEqual(regime_bounds('vix:mid', self.thresholds), [15, 25])
+        self.assertEqual(regime_bounds('volRegime:contango', self.thresholds), [])
+
+
+class ExportTests(SimpleTestCase):
+    def test_flatten_follows_dotted_columns_and_joins_lists(self):
+        row = {'side': 'BUY', 'instrument': {'strike': 400.0}, 'strategyTag': ['gap', 'fade'], 'legs': [{'qty': 1}],
+               'closeTs': None}
+        columns = ['side', 'instrument.strike', 'instrument.expiry', 'strategyTag', 'legs', 'closeTs', 'side.x']
+        self.assertEqual(flatten(row, columns), ['BUY', 400.0, '', 'gap|fade', '[{"qty":1}]', '', ''])
+
+
+class DocumentSchemaTests(SimpleTestCase):
+    def test_dump_renames_ids_and_marks_naive_times_as_utc(self):
+        trade_id, user_id = ObjectId(), ObjectId()
+        document = {'_id': trade_id, 'tenant': {'userId': user_id}, 'side': 'BUY', 'qty': 2,
+                    'openTs': datetime(2026, 3, 2, 14, 30), 'audit': {'createdAt': datetime(2026, 3, 2, 15)}}
+        self.assertEqual(json.loads(TRADE_SCHEMA.dump(document, ['tradeId', 'side', 'openTs', 'createdAt'])), {
+            'tradeId': str(trade_id), 'side': 'BUY', 'openTs': '2026-03-02T14:30:00Z',
+            'createdAt': '2026-03-02T15:00:00Z',
+        })
+
+    def test_renderer_takes_bson_and_numpy_values(self):
+        object_id = ObjectId()
+        self.assertEqual(json.loads(dumps({'id': object_id, 'n': np.int64(3), 'x': np.float32(0.5),
+                                           'd': Decimal('1.5'), 'a': np.array([1, 2])})),
+                         {'id': str(object_id), 'n': 3, 'x': 0.5, 'd': 1.5, 'a': [1, 2]})
+
+    def test_projection_keeps_the_pagination_keys(self):
+        projection = TRADE_SCHEMA.projection(['side'], keys=('audit.createdAt', '_id'))
+        self.assertEqual(set(projection) - {'side'}, {'audit.createdAt', '_id'})
+
+
+class AsyncPrincipalTests(SimpleTestCase):
+    def setUp(self):
+        principal_cache.clear()
+        self.addCleanup(principal_cache.clear)
+
+    async def test_a_miss_awaits_the_async_driver_once(self):
+        user_id, session = str(ObjectId()), {}
+        with mock.patch('main_app.middleware.get_async_repository') as repository:
+            find_one = repository.return_value.get_collection.return_value.find_one = mock.AsyncMock(
+                return_value={'username': 'ann'})
+            for _ in range(2):
+                self.assertEqual(await aload_principal(session, user_id), {'_id': user_id, 'username': 'ann'})
+        find_one.assert_awaited_once()
+        self.assertEqual(session[SESSION_PRINCIPAL_KEY]['username'], 'ann')
+        self.assertIsNone(await aload_principal({}, 'not-an-id'))
+
+    def test_middleware_matches_the_handler(self):
+        async def handler(request):
+            return None
+
+        self.assertTrue(iscoroutinefunction(MongoAuthMiddleware(handler)))
+        self.assertFalse(iscoroutinefunction(MongoAuthMiddleware(lambda request: None)))
+
+
+class ConditionalResponseTests(SimpleTestCase):
+    updated = datetime(2026, 3, 2, 14, 30)
+
+    def request(self, counters, **headers):
+        request = RequestFactory().get('/dashboard/', **headers)
+        request.user = SimpleUser({'_id': 'u1', 'username': 'ann'})
+        request._data_stamp = DataStamp(counters, self.updated)
+        return request
+
+    def test_unchanged_scopes_answer_304_without_the_view(self):
+        calls = []
+
+        @conditional('trades')
+        def view(request):
+            calls.append(request)
+            return HttpResponse('ok')
+
+        etag = view(self.request({'trades': 1, 'journal': 4}))['ETag']
+        self.assertEqual(view(self.request({'trades': 1, 'journal': 5}, HTTP_IF_NONE_MATCH=etag)).status_code, 304)
+        self.assertEqual(view(self.request({'trades': 2}, HTTP_IF_NONE_MATCH=etag)).status_code, 200)
+        self.assertEqual(len(calls), 2)
+
+    def test_fragment_key_carries_the_scope_versions(self):
+        stamp = DataStamp({'trades': 3, 'journal': 4}, self.updated)
+        self.assertEqual(fragment_key('equity', 'u1', ('trades', 'notes'), stamp), 'fragment:equity:u1:3.0')
+
+
+class UserIndexTests(SimpleTestCase):
+    notes = {
+        'a': ('Breakout rules', 'Wait for volume', ['rules']),
+        'b': ('Friday review', 'The breakout failed again; breakout traders got trapped', ['review']),
+        'c': ('Breakdowns', 'Short the retest', ['rules', 'short']),
+        'd': ('Lunch', 'Nothing to see', []),
+    }
+
+    def setUp(self):
+        self.index = UserIndex('u1')
+        for day, (note_id, (title, markdown, tags)) in enumerate(self.notes.items(), start=2):
+            self.index.add(note_id, IndexedDocument.from_document('note', {
+                'title': title, 'markdown': markdown, 'tags': tags, 'audit': {'createdAt': datetime(2026, 3, day)}}))
+
+    def ids(self, query, **options):
+        return [hit['id'] for hit in self.index.search(query, **options)['results']]
+
+    def test_title_words_weigh_more(self):
+        self.assertEqual(self.ids('breakout'), ['a', 'b'])
+        self.assertEqual(self.ids('breakout volume'), ['a'])  # every word must match
+
+    def test_prefixes_rank_below_whole_words(self):
+        def scores(query):
+            return {hit['id']: hit['score'] for hit in self.index.search(query)['results']}
+
+        self.assertEqual(set(scores('break')), {'a', 'b', 'c'})
+        self.assertLess(scores('break')['a'], scores('breakout')['a'])
+        self.assertEqual(self.ids('b'), [])  # too short to expand
+
+    def test_tag_facets_and_filters(self):
+        facets = self.index.search('break')['facets']['tags']
+        self.assertEqual({facet['tag']: facet['count'] for facet in facets}, {'rules': 2, 'review': 1, 'short': 1})
+        self.assertEqual(facets[0]['tag'], 'rules')
+        self.assertEqual(self.ids('', tags=['rules']), ['c', 'a'])  # newest first
+        self.assertEqual(self.ids('break', tags=['rules', 'short']), ['c'])
+        self.index.remove('a')
+        self.assertEqual(self.ids('breakout'), ['b'])
+
+    def test_stopwords_alone_match_nothing(self):
+        self.assertEqual(self.index.search('the and')['total'], 0)
+        self.assertEqual(self.index.search('  ')['total'], 4)
+
+
+class LinkParseTests(SimpleTestCase):
+    def test_titles_and_ids(self):
+        trade = ObjectId()
+        parsed = parse(f'See [[Risk  Rules|rules]], [[playbook#Entries]], [[ ]], [[trade:{trade}]] '
+                       f'and [[note:{"z" * 24}]]')
+        self.assertEqual(parsed.titles, {'risk rules', 'playbook', f'note:{"z" * 24}'})
+        self.assertEqual(parsed.ids, {'trade': {trade}})
+        self.assertEqual(parse(None), parse(''))
+
+
+class BlobStoreTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = FileSystemBlobStore(directory.name)
+
+    def test_identical_content_is_stored_once(self):
+        first = self.store.save(io.BytesIO(b'x' * 1000))
+        self.assertEqual(first, StoredBlob(hashlib.sha256(b'x' * 1000).hexdigest(), 1000, True))
+        self.assertEqual(self.store.save(io.BytesIO(b'x' * 1000)), first._replace(created=False))
+        with self.assertRaises(BlobTooLarge):
+            self.store.save(io.BytesIO(b'y' * 11), max_size=10)
+        self.assertEqual(list(self.store.incoming.iterdir()), [])
+        with self.assertRaises(BlobNotFound):
+            self.store.open('../../etc/passwd')
+
+    def test_range_reads_stream_and_close(self):
+        content = bytes(range(256)) * 4_000  # several chunks
+        blob, size = self.store.open(self.store.save(io.BytesIO(content)).checksum)
+        first, last = byte_range('bytes=1000-', size)
+        self.assertEqual(b''.join(read_range(blob, first, last - first + 1)), content[1000:])
+        self.assertTrue(blob.closed)
+
+    def test_byte_range_header(self):
+        self.assertEqual(byte_range('bytes=0-99', 50), (0, 49))
+        self.assertEqual(byte_range('bytes=-10', 50), (40, 49))
+        self.assertEqual(byte_range('bytes=-100', 50), (0, 49))
+        for header in (None, 'bytes=0-1,5-6', 'bytes=9-3', 'items=0-1'):
+            self.assertIsNone(byte_range(header, 50))
+        for header in ('bytes=50-', 'bytes=-0'):
+            with self.assertRaises(ValueError):
+                byte_range(header, 50)
+
+
+def at(hour, minute=0):
+    return datetime(2026, 3, 2, hour, minute)
+
+
+class TimeTrackingTests(SimpleTestCase):
+    def test_union_merges_per_row(self):
+        merged = union(Intervals(np.array([1, 0, 0, 0, 1]), np.array([5.0, 0.0, 2.0, 10.0, 0.0]),
+                                 np.array([6.0, 3.0, 4.0, 10.0, 5.0])))
+        np.testing.assert_array_equal(merged.rows, [0, 1])
+        np.testing.assert_array_equal(merged.start, [0.0, 0.0])
+        np.testing.assert_array_equal(merged.end, [4.0, 6.0])
+
+    def test_net_intervals_subtract_clipped_breaks(self):
+        columns = SessionColumns.from_documents([
+            {'_id': ObjectId(), 'clockIn': at(9), 'clockOut': at(17),
+             'breaks': [{'start': at(12), 'end': at(12, 30)}, {'start': at(12, 15), 'end': at(13)},
+                        {'start': at(16, 30), 'end': at(18)}]},
+            {'_id': ObjectId(), 'clockIn': at(19), 'clockOut': at(20), 'lunch': {'start': at(8), 'end': at(9)}},
+        ])
+        net = net_intervals(columns)
+        np.testing.assert_array_equal(net.rows, [0, 0, 1])
+        np.testing.assert_array_equal(net.end - net.start, [3 * 3600, 3.5 * 3600, 3600])
+        np.testing.assert_array_equal(net_screen_seconds(columns, net), [6.5 * 3600, 3600])
+
+
+class EventWriterTests(SimpleTestCase):
+    def writer(self, batch_size, flush_seconds):
+        writer = EventWriter(batch_size, flush_seconds, max_pending=0)
+        self.batches = []
+        writer._insert = self.batches.append
+        return writer
+
+    def wait_for(self, condition, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.005)
+        self.assertTrue(condition())
+
+    def test_unbuffered_writes_in_the_caller(self):
+        self.writer(10, 0).submit([{'n': 1}])
+        self.assertEqual(self.batches, [[{'n': 1}]])
+
+    def test_flushes_on_size_and_age_after_draining(self):
+        writer = self.writer(3, 0.05)
+        writer.submit([{'n': n} for n in range(4)])
+        self.wait_for(lambda: writer.pending == 0)
+        self.assertEqual([len(batch) for batch in self.batches], [3, 1])
+        # The flusher is asleep on an empty buffer now; a small submit must still be written on age.
+        writer.submit([{'n': 4}])
+        self.wait_for(lambda: writer.pending == 0)
+        self.assertEqual(self.batches[-1], [{'n': 4}])
@@ -0,0 +1,298 @@
+"""Session time tracking: net screen time, trade/event joins and adherence scores.
+
+A user's sessions are loaded once into NumPy arrays (``SessionColumns``) and
+every quantity is computed for all of them together:
+
+- net screen time is the session window minus the union of its breaks and
+  lunch: the blocks are sorted per session and merged with a segmented
+  running maximum, so overlapping or nested breaks are only subtracted once;
+- trades (by entry time) and behavior events are joined to the sessions
+  whose window contains them with a sorted-interval join: both sides are
+  sorted once and each window becomes a ``searchsorted`` slice of the other;
+- ``adherenceScore`` combines the rule checklist with the rule violations
+  per trade of the session.
+
+The hourly screen time of the net intervals also feeds the ``byTimeOfDay``
+cohort of the analytics snapshots (``AnalyticsMetrics.screenMinutes``).
+Times are UTC, like the trade hours of that cohort.
+"""
+
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from .analytics import epoch_seconds
+from .db import get_repository
+from .models import BehaviorEventRepository, SessionRepository, TradeRepository
+
+HOUR = 3600
+SESSION_PROJECTION = {
+    'clockIn': 1,
+    'clockOut': 1,
+    'breaks': 1,
+    'lunch': 1,
+    'ruleChecklist': 1,
+    'adherenceScore': 1,
+    'netScreenSeconds': 1,
+    'tradeCount': 1,
+    'violationCount': 1,
+}
+# Session fields written by score_sessions.
+SCORE_FIELDS = ('adherenceScore', 'netScreenSeconds', 'tradeCount', 'violationCount')
+
+
+class Intervals(NamedTuple):
+    """Intervals as parallel arrays, ordered by (session row, start)."""
+    rows: np.ndarray
+    start: np.ndarray
+    end: np.ndarray
+
+
+class SessionColumns:
+    """Sessions of one user as parallel arrays, ordered by clockIn.
+
+    Open sessions (no clockOut) run until ``now``.
+    """
+
+    def __init__(self, ids: List[ObjectId], clock_in: np.ndarray, clock_out: np.ndarray, closed: np.ndarray,
+                 breaks: Intervals, checked: np.ndarray, checklist: np.ndarray, stored: List[dict]):
+        self.ids = ids
+        self.clock_in = clock_in
+        self.clock_out = clock_out
+        self.closed = closed
+        self.breaks = breaks
+        self.checked = checked
+        self.checklist = checklist
+        self.stored = stored  # the SCORE_FIELDS as loaded, to skip unchanged writes
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[dict], now: Optional[datetime] = None) -> 'SessionColumns':
+        now = epoch_seconds(now or datetime.now(timezone.utc))
+        ids, clock_in, clock_out, closed, checked, checklist, stored = [], [], [], [], [], [], []
+        break_rows, break_start, break_end = [], [], []
+        for document in sorted(documents, key=lambda document: epoch_seconds(document['clockIn'])):
+            row = len(ids)
+            ids.append(document['_id'])
+            clock_in.append(epoch_seconds(document['clockIn']))
+            closed.append(bool(document.get('clockOut')))
+            clock_out.append(epoch_seconds(document['clockOut']) if closed[-1] else now)
+            blocks = list(document.get('breaks') or [])
+            if document.get('lunch'):
+                blocks.append(document['lunch'])
+            for block in blocks:
+                break_rows.append(row)
+                break_start.append(epoch_seconds(block['start']))
+                break_end.append(epoch_seconds(block['end']))
+            rules = document.get('ruleChecklist') or []
+            checked.append(sum(1 for rule in rules if rule.get('checked')))
+            checklist.append(len(rules))
+            stored.append({field: document.get(field) for field in SCORE_FIELDS})
+        clock_in = np.asarray(clock_in, dtype=np.float64)
+        clock_out = np.maximum(np.asarray(clock_out, dtype=np.float64), clock_in)
+        breaks = Intervals(np.asarray(break_rows, dtype=np.int64), np.asarray(break_start, dtype=np.float64),
+                           np.asarray(break_end, dtype=np.float64))
+        return cls(ids, clock_in, clock_out, np.asarray(closed, dtype=bool), breaks,
+                   np.asarray(checked, dtype=np.int64), np.asarray(checklist, dtype=np.int64), stored)
+
+
+def load_session_columns(user_id, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                         now: Optional[datetime] = None) -> SessionColumns:
+    """The user's sessions clocked in within [start, end)."""
+    query = {'tenant.userId': ObjectId(user_id)}
+    if start or end:
+        query['clockIn'] = {key: value for key, value in (('$gte', start), ('$lt', end)) if value}
+    cursor = get_repository(SessionRepository).get_collection().find(query, SESSION_PROJECTION, batch_size=10000)
+    return SessionColumns.from_documents(cursor, now)
+
+
+def union(intervals: Intervals) -> Intervals:
+    """Merge overlapping or touching intervals of the same row; the result is disjoint and sorted."""
+    rows, start, end = intervals
+    keep = end > start
+    rows, start, end = rows[keep], start[keep], end[keep]
+    if not len(rows):
+        return Intervals(rows, start, end)
+    order = np.lexsort((start, rows))
+    rows, start, end = rows[order], start[order], end[order]
+    # Segmented running max of the ends: lifting each row above the previous
+    # one lets a single maximum.accumulate restart at every row boundary.
+    base = min(start.min(), end.min())
+    lift = end.max() - base + 1.0
+    reach = np.maximum.accumulate(end - base + rows * lift) - rows * lift + base
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = rows[1:] != rows[:-1]
+    previous = np.concatenate(([-np.inf], reach[:-1]))
+    opens = first | (start > previous)
+    heads = np.flatnonzero(opens)
+    return Intervals(rows[heads], start[heads], np.maximum.reduceat(end, heads))
+
+
+def clip(intervals: Intervals, lower: np.ndarray, upper: np.ndarray) -> Intervals:
+    """Intersect each interval with [lower, upper) of its row."""
+    rows, start, end = intervals
+    return Intervals(rows, np.maximum(start, lower[rows]), np.minimum(end, upper[rows]))
+
+
+def net_intervals(columns: SessionColumns) -> Intervals:
+    """Each session window minus the union of its breaks, as disjoint intervals."""
+    n = len(columns)
+    blocks = union(clip(columns.breaks, columns.clock_in, columns.clock_out))
+    # A session with k merged blocks leaves k + 1 gaps: [clockIn, s1), [e1, s2), ..., [ek, clockOut).
+    rows = np.concatenate((np.arange(n), blocks.rows))
+    order = np.lexsort((np.concatenate((np.full(n, -np.inf), blocks.start)), rows))
+    starts = np.concatenate((columns.clock_in, blocks.end))[order]
+    order = np.lexsort((np.concatenate((np.full(n, np.inf), blocks.start)), rows))
+    ends = np.concatenate((columns.clock_out, blocks.start))[order]
+    rows = rows[order]
+    keep = ends > starts
+    return Intervals(rows[keep], starts[keep], ends[keep])
+
+
+def net_screen_seconds(columns: SessionColumns, net: Optional[Intervals] = None) -> np.ndarray:
+    """Seconds of each session spent outside breaks."""
+    net = net_intervals(columns) if net is None else net
+    return np.bincount(net.rows, weights=net.end - net.start, minlength=len(columns))
+
+
+def window_join(window_start: np.ndarray, window_end: np.ndarray,
+                timestamps: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Sorted-interval join of points to windows [start, end).
+
+    Returns ``(order, lo, hi)``: the points inside window ``i`` are
+    ``order[lo[i]:hi[i]]``. Windows may overlap; a point then belongs to each.
+    """
+    order = np.argsort(timestamps, kind='stable')
+    ordered = timestamps[order]
+    return order, np.searchsorted(ordered, window_start, 'left'), np.searchsorted(ordered, window_end, 'left')
+
+
+def hourly_screen_time(net: Intervals) -> Tuple[np.ndarray, np.ndarray]:
+    """Screen seconds per clock hour: (hour starts as datetime64[h], seconds), hours ascending."""
+    first = np.floor(net.start / HOUR).astype(np.int64)
+    last = np.ceil(net.end / HOUR).astype(np.int64) - 1
+    counts = np.maximum(last - first + 1, 0)
+    pieces = np.repeat(np.arange(len(first)), counts)
+    offsets = np.cumsum(counts) - counts
+    hours = first[pieces] + np.arange(counts.sum()) - np.repeat(offsets, counts)
+    seconds = np.minimum(net.end[pieces], (hours + 1) * HOUR) - np.maximum(net.start[pieces], hours * HOUR)
+    present, codes = np.unique(hours, return_inverse=True)
+    return present.astype('datetime64[h]'), np.bincount(codes, weights=seconds, minlength=len(present))
+
+
+def time_of_day(hours: np.ndarray, seconds: np.ndarray) -> np.ndarray:
+    """Fold an hourly series into 24 hour-of-day buckets."""
+    return np.bincount(hours.astype(np.int64) % 24, weights=seconds, minlength=24)
+
+
+def screen_time(user_id) -> Tuple[np.ndarray, np.ndarray]:
+    """The user's hourly net screen time over closed sessions (see ``hourly_screen_time``).
+
+    Open sessions are left out: one never clocked out would count until now.
+    """
+    columns = load_session_columns(user_id)
+    net = net_intervals(columns)
+    closed = columns.closed[net.rows]
+    return hourly_screen_time(Intervals(net.rows[closed], net.start[closed], net.end[closed]))
+
+
+def _trade_entries(user_id, start: datetime, end: datetime) -> np.ndarray:
+    cursor = get_repository(TradeRepository).get_collection().find(
+        {'tenant.userId': ObjectId(user_id), 'status': {'$in': ['OPEN', 'CLOSED']},
+         'openTs': {'$gte': start, '$lt': end}},
+        {'openTs': 1, '_id': 0},
+    )
+    return np.asarray([epoch_seconds(trade['openTs']) for trade in cursor], dtype=np.float64)
+
+
+def _violations(user_id, start: datetime, end: datetime,
+                session_ids: List[ObjectId]) -> Tuple[np.ndarray, List[Optional[ObjectId]]]:
+    user = ObjectId(user_id)
+    cursor = get_repository(BehaviorEventRepository).get_collection().find(
+        {'type': 'rule_violation', '$or': [
+            {'tenant.userId': user, 'timestamp': {'$gte': start, '$lt': end}},
+            {'tenant.userId': user, 'sessionId': {'$in': session_ids}},  # tagged, even if logged after clockOut
+        ]},
+        {'timestamp': 1, 'sessionId': 1, '_id': 0},
+    )
+    timestamps, session_ids = [], []
+    for event in cursor:
+        timestamps.append(epoch_seconds(event['timestamp']))
+        session_ids.append(event.get('sessionId'))
+    return np.asarray(timestamps, dtype=np.float64), session_ids
+
+
+def violation_counts(columns: SessionColumns, timestamps: np.ndarray,
+                     session_ids: List[Optional[ObjectId]]) -> np.ndarray:
+    """Rule violations per session: by ``sessionId`` when the event has one, else by time window."""
+    rows = {session_id: row for row, session_id in enumerate(columns.ids)}
+    tagged = np.asarray([rows.get(session_id, -1) if session_id else -1 for session_id in session_ids],
+                        dtype=np.int64)
+    counts = np.bincount(tagged[tagged >= 0], minlength=len(columns))
+    untagged = np.asarray([not session_id for session_id in session_ids], dtype=bool)
+    _, lo, hi = window_join(columns.clock_in, columns.clock_out, timestamps[untagged])
+    return counts + (hi - lo)
+
+
+def adherence_scores(checked: np.ndarray, checklist: np.ndarray, trades: np.ndarray,
+                     violations: np.ndarray) -> np.ndarray:
+    """Adherence in [0, 1] per session; NaN where there is nothing to score.
+
+    The mean of the share of checklist rules ticked (sessions with a
+    checklist) and the share of trades without a rule violation (sessions
+    with trades or violations; a violation without trades scores 0).
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rules = np.where(checklist > 0, checked / checklist, np.nan)
+        discipline = np.where((trades > 0) | (violations > 0),
+                              1.0 - np.minimum(violations, np.maximum(trades, 1)) / np.maximum(trades, 1), np.nan)
+        parts = np.stack((rules, discipline))
+        present = (~np.isnan(parts)).sum(axis=0)
+        return np.where(present > 0, np.nansum(parts, axis=0) / np.maximum(present, 1), np.nan)
+
+
+def _value(value: float, digits: int):
+    return None if value != value else round(float(value), digits)
+
+
+def score_sessions(user_id, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Recompute ``adherenceScore``, net screen time and trade/violation counts of the user's closed sessions.
+
+    Only sessions whose values changed are written. Open sessions are left
+    alone until they are clocked out.
+    """
+    columns = load_session_columns(user_id, now=now)
+    totals = {'sessions': len(columns), 'open': 0, 'updated': 0}
+    if not len(columns):
+        return totals
+    closed = columns.closed
+    totals['open'] = int((~closed).sum())
+    start = datetime.fromtimestamp(columns.clock_in.min(), timezone.utc)
+    end = datetime.fromtimestamp(columns.clock_out.max() + 1, timezone.utc)
+
+    _, lo, hi = window_join(columns.clock_in, columns.clock_out, _trade_entries(user_id, start, end))
+    trades = hi - lo
+    violations = violation_counts(columns, *_violations(user_id, start, end, columns.ids))
+    scores = adherence_scores(columns.checked, columns.checklist, trades, violations)
+    seconds = net_screen_seconds(columns)
+
+    operations = []
+    for row in np.flatnonzero(closed).tolist():
+        values = {
+            'adherenceScore': _value(scores[row], 4),
+            'netScreenSeconds': _value(seconds[row], 3),
+            'tradeCount': int(trades[row]),
+            'violationCount': int(violations[row]),
+        }
+        stored = columns.stored[row]
+        if any(stored[field] != value for field, value in values.items()):
+            operations.append(UpdateOne({'_id': columns.ids[row]}, {'$set': values}))
+    if operations:
+        get_repository(SessionRepository).get_collection().bulk_write(operations, ordered=False)
+    totals['updated'] = len(operations)
+    return totals
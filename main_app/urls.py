@@ -1,5 +1,6 @@
 
-from django.urls import path, include
+from django.conf import settings
+from django.urls import path, include, re_path
 from rest_framework.routers import DefaultRouter
 from django.http import HttpResponse
 from . import views
@@ -9,6 +10,20 @@ from . import login_views
 # REST API Router
 router = DefaultRouter()
 router.register(r'users', api_views.UserViewSet, basename='user')
+router.register(r'trades', api_views.TradeViewSet, basename='trade')
+router.register(r'journal', api_views.JournalEntryViewSet, basename='journal')
+router.register(r'notes', api_views.NotebookNoteViewSet, basename='note')
+router.register(r'attachments', api_views.AttachmentViewSet, basename='attachment')
+
+# Under ASGI the hot read paths are served by async views (main_app.async_views).
+if settings.ASYNC_VIEWS:
+    from . import async_views as hot_views
+    async_api = [path('api/trades/', hot_views.trade_list)]  # list only; detail and export stay on the router
+    analytics_view = hot_views.analytics
+else:
+    hot_views = login_views
+    async_api = []
+    analytics_view = api_views.analytics
 
 urlpatterns = [
     # Web pages
@@ -16,17 +31,30 @@ urlpatterns = [
 
     # API endpoints
     path('api/', api_views.api_root, name='api-root'),
+    *async_api,
     path('api/', include(router.urls)),
+    path('api/jobs/<str:job_id>/', api_views.job_detail, name='job-detail'),
+    path('api/equity/', api_views.equity, name='equity'),
+    path('api/diagnostics/', api_views.diagnostics, name='diagnostics'),
+    path('api/analytics/', analytics_view, name='analytics'),
+    path('api/search/', api_views.search, name='search'),
+    path('api/behavior-events/', api_views.behavior_events, name='behavior-events'),
+    path('api/attachments/<str:attachment_id>/content/', api_views.attachment_content, name='attachment-content'),
+    path('api/attachments/<str:attachment_id>/thumbnail/', api_views.attachment_thumbnail,
+         name='attachment-thumbnail'),
+    re_path(r'^api/related/(?P<kind>note|trade|journal)/(?P<document_id>[0-9a-fA-F]{24})/$', api_views.related,
+            name='related'),
 
     # login endpoints
-    path('login/', login_views.login_page, name='login_page'),
+    path('login/', hot_views.login_page, name='login_page'),
     path('register/', login_views.register_page, name='register_page'),
-    path('landing/', views.landing_page, name='landing_page'),
+    path('landing/', hot_views.landing_page, name='landing_page'),
+    path('landing/trades/', hot_views.load_more_trades, name='load_more_trades'),
     path('navbar/', views.navbar, name='navbar'),
     path('logout/', login_views.logout_view, name='logout_view'),
     
     # add a trade
-    
+    path('landing/new/', login_views.new_trade, name='new_trade'),
 
 
     ]
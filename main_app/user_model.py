@@ -1,25 +1,20 @@
 import os
-from time import timezone 
 from django.contrib.auth.models import User
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
 from pydantic_mongo import AbstractRepository, PydanticObjectId
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from pydantic import BaseModel, Field, EmailStr
 from typing import Optional, Dict, Any
-from dotenv import load_dotenv
 from datetime import datetime, timezone
 
-# Load environment variables from .env file
-load_dotenv()
-  
-uri = os.environ.get('uri')
-# Create a new client and connect to the server
-client = MongoClient(uri, server_api=ServerApi('1'))
+from bson import ObjectId
 
+from .db import get_repository
+from .models import LazyModel
 
-class UserSchema(BaseModel):
+
+# Deferred: EmailStr imports email_validator (tens of ms) when the schema is built
+class UserSchema(LazyModel):
     id: PydanticObjectId = Field(alias="_id")
     orgId: PydanticObjectId
     email: EmailStr
@@ -36,6 +31,43 @@ class UserSchema(BaseModel):
 
 class UserRepository(AbstractRepository[UserSchema]):
     class Meta:
-        database_name = 'tradingApp'
         collection_name = 'users'
-    
\ No newline at end of file
+        indexes = [
+            {'keys': [('username', 1)], 'unique': True},
+            {'keys': [('email', 1)], 'unique': True},
+        ]
+
+    # Every write goes through here so that no process keeps serving a cached principal of the old document.
+    def save(self, model):
+        result = super().save(model)
+        _invalidate(model.id)
+        return result
+
+    def save_many(self, models):
+        models = list(models)
+        super().save_many(models)
+        for model in models:
+            _invalidate(model.id)
+
+    def delete(self, model):
+        result = super().delete(model)
+        _invalidate(model.id)
+        return result
+
+    def delete_by_id(self, _id):
+        result = super().delete_by_id(_id)
+        _invalidate(_id)
+        return result
+
+
+def _invalidate(user_id):
+    from .middleware import invalidate_principal  # the middleware imports this module
+    invalidate_principal(user_id)
+
+
+def tenant_for(user_id) -> dict:
+    """The ``tenant`` subdocument of records written for ``user_id``."""
+    user = get_repository(UserRepository).get_collection().find_one({'_id': ObjectId(user_id)}, {'orgId': 1})
+    if user is None:
+        raise ValueError(f"Unknown user: {user_id}")
+    return {'orgId': user['orgId'], 'userId': ObjectId(user_id)}
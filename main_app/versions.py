@@ -0,0 +1,88 @@
+"""Per-user data version counters for cache invalidation.
+
+Writes bump a per-user counter in ``data_versions``, one counter per scope:
+
+- ``trades``: a user's closed-trade P&L changed (equity curves, analytics);
+- ``tradeDocuments``: any other stored field of a trade changed (new trades,
+  unrealized P&L, regime tags, excursions), i.e. what trade lists show;
+- ``journal``: journal entries changed;
+- ``notes``: notebook notes changed;
+- ``attachments``: attachments changed (uploads, deletions, thumbnails).
+
+Caches key entries on (user, version), so no process serves data older than
+the last write and nothing needs to be purged explicitly. A response that
+lists trades depends on both trade scopes (``TRADE_LIST_SCOPES``).
+"""
+
+from datetime import datetime, timezone
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+
+from .db import get_async_repository, get_repository
+from .models import DataVersionRepository
+
+TRADES = 'trades'
+TRADE_DOCUMENTS = 'tradeDocuments'
+JOURNAL = 'journal'
+NOTES = 'notes'
+ATTACHMENTS = 'attachments'
+TRADE_LIST_SCOPES = (TRADES, TRADE_DOCUMENTS)  # what a list of trades shows
+
+
+class DataStamp(NamedTuple):
+    """Every counter of one user, read at once, and the time of the last bump."""
+    counters: Dict[str, int]
+    updated_at: Optional[datetime]
+
+    def version(self, scopes: Iterable[str]) -> Tuple[int, ...]:
+        return tuple(self.counters.get(scope, 0) for scope in scopes)
+
+
+def _collection():
+    return get_repository(DataVersionRepository).get_collection()
+
+
+def _stamp(document: Optional[dict]) -> DataStamp:
+    document = document or {}
+    return DataStamp(document.get('counters') or {}, document.get('updatedAt'))
+
+
+def data_version(user_id, scope: str = TRADES) -> int:
+    document = _collection().find_one({'_id': ObjectId(user_id)}, {f'counters.{scope}': 1})
+    return ((document or {}).get('counters') or {}).get(scope, 0)
+
+
+def data_stamp(user_id) -> DataStamp:
+    return _stamp(_collection().find_one({'_id': ObjectId(user_id)}))
+
+
+async def adata_stamp(user_id) -> DataStamp:
+    collection = get_async_repository(DataVersionRepository).get_collection()
+    return _stamp(await collection.find_one({'_id': ObjectId(user_id)}))
+
+
+def _bump(scopes: Iterable[str], now: datetime) -> dict:
+    return {'$inc': {f'counters.{scope}': 1 for scope in scopes}, '$set': {'updatedAt': now}}
+
+
+def bump_data_version(user_id, scope: str = TRADES) -> int:
+    document = _collection().find_one_and_update(
+        {'_id': ObjectId(user_id)},
+        _bump([scope], datetime.now(timezone.utc)),
+        projection={f'counters.{scope}': 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return document['counters'][scope]
+
+
+def bump_data_versions(user_ids: Iterable, scopes: Iterable[str] = (TRADE_DOCUMENTS,)) -> int:
+    """Bump ``scopes`` of many users in one round trip; returns the number of users."""
+    update = _bump(scopes, datetime.now(timezone.utc))
+    operations = [UpdateOne({'_id': ObjectId(user_id)}, update, upsert=True)
+                  for user_id in {str(user_id) for user_id in user_ids if user_id}]
+    if operations:
+        _collection().bulk_write(operations, ordered=False)
+    return len(operations)
@@ -2,12 +2,14 @@ from django.shortcuts import render
 from django.http import HttpResponse
 from django.contrib.auth.decorators import login_required
 from django.template import loader
+from django.views.decorators.cache import cache_page
 # Create your views here.
 
 
 def about_page(request):
     return render(request, 'login.html')
 
+@cache_page(60 * 60)  # a static fragment: served from the cache backend, not re-rendered
 def navbar(request):
     return render(request, 'nav.html')
 
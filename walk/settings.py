@@ -13,7 +13,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 import os
 from pathlib import Path
 from dotenv import load_dotenv
-# Load environment variables from .env file
+# Load environment variables from .env file; the only place it is read, app modules use os.environ/settings
 load_dotenv()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -144,9 +144,23 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Importing database client libraries at module import can break deployment initialization
 MONGODB_URI = os.environ.get('uri', 'mongodb://localhost:27017/')
 MONGODB_DB_NAME = os.environ.get('MONGODB_DB_NAME', 'tradingApp')
+# Connection pool for the shared client in main_app/db.py (created on first use)
+MONGODB_MAX_POOL_SIZE = int(os.environ.get('MONGODB_MAX_POOL_SIZE', '10'))
+MONGODB_MIN_POOL_SIZE = int(os.environ.get('MONGODB_MIN_POOL_SIZE', '0'))
+MONGODB_MAX_IDLE_TIME_MS = int(os.environ.get('MONGODB_MAX_IDLE_TIME_MS', '60000'))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGODB_CONNECT_TIMEOUT_MS', '5000'))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGODB_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGODB_SOCKET_TIMEOUT_MS', '20000'))
+
+# Serve the hot views from main_app.async_views over the async driver (api/asgi.py turns this on)
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False').lower() in ('1', 'true', 'yes')
 
 # Django REST Framework Configuration
 REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'main_app.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -167,6 +181,89 @@ REST_FRAMEWORK = {
 SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
 SESSION_COOKIE_AGE = 1209600  # Two weeks in seconds
 
+# Authenticated-principal cache used by main_app.middleware.MongoAuthMiddleware
+MONGO_AUTH_CACHE_SIZE = int(os.environ.get('MONGO_AUTH_CACHE_SIZE', '1024'))
+MONGO_AUTH_CACHE_TTL = int(os.environ.get('MONGO_AUTH_CACHE_TTL', '300'))  # seconds
+MONGO_AUTH_CACHE_IN_SESSION = True  # also keep the principal in the signed session cookie
+
+# Position ledger (main_app.ledger)
+LEDGER_METHOD = os.environ.get('LEDGER_METHOD', 'FIFO')  # FIFO, LIFO or AVERAGE
+OPTION_CONTRACT_MULTIPLIER = 100
+RISK_FREE_RATE = float(os.environ.get('RISK_FREE_RATE', '0.04'))  # Black-Scholes fallback in main_app.revaluation
+BAR_STORE_DIR = os.environ.get('BAR_STORE_DIR', str(BASE_DIR / 'bars'))  # memory-mapped OHLC (main_app.bars)
+
+# Regime tagging (main_app.regimes): numeric factors are bucketed by their edges, volRegime by its value.
+# Changing these needs `manage.py tag_regimes --retag-all`.
+REGIME_THRESHOLDS = {
+    'VIX': {'edges': [15.0, 25.0], 'labels': ['low', 'normal', 'high']},
+    'breadth': {'edges': [0.4, 0.6], 'labels': ['weak', 'neutral', 'strong']},
+    'trend': {'edges': [0.0], 'labels': ['down', 'up']},
+    'volRegime': {},
+}
+REGIME_MAX_FACTOR_AGE_DAYS = int(os.environ.get('REGIME_MAX_FACTOR_AGE_DAYS', '4'))  # covers long weekends
+
+# Equity curve service (main_app.equity)
+EQUITY_CACHE_SIZE = int(os.environ.get('EQUITY_CACHE_SIZE', '256'))
+EQUITY_MC_MAX_STEPS = int(os.environ.get('EQUITY_MC_MAX_STEPS', '5000000'))  # paths x horizon per request, inline
+EQUITY_MC_WORKERS = int(os.environ.get('EQUITY_MC_WORKERS', str(os.cpu_count() or 1)))  # manage.py simulate_ruin only
+
+# Response and fragment cache (main_app.caching). Entries are keyed on each user's data version, so the backend
+# only bounds memory: locmem (per-process LRU), file (shared on one host), redis (needs the redis package), or
+# mongo (shared through MongoDB where no Redis is deployed).
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+CACHE_RELEASE = os.environ.get('CACHE_RELEASE', os.environ.get('VERCEL_GIT_COMMIT_SHA', 'dev'))[:12]  # per deploy
+CACHE_BACKENDS = {
+    'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+               'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', '5000'))}},
+    'file': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+             'LOCATION': os.environ.get('CACHE_DIR', str(BASE_DIR / 'cache'))},
+    'redis': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+              'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379')},
+    'mongo': {'BACKEND': 'main_app.caching.MongoCache'},
+}
+CACHES = {
+    'default': {
+        **CACHE_BACKENDS[CACHE_BACKEND],
+        'KEY_PREFIX': CACHE_RELEASE,
+        'TIMEOUT': int(os.environ.get('CACHE_TIMEOUT', '86400')),
+    },
+}
+
+# Journal and notebook search (main_app.search): 'local' keeps an inverted index per user in each process (BM25,
+# prefix matching) for up to SEARCH_INDEX_CACHE_SIZE users; 'mongo' queries the collections' text indexes instead.
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'local')
+SEARCH_INDEX_CACHE_SIZE = int(os.environ.get('SEARCH_INDEX_CACHE_SIZE', '128'))
+
+# Attachments (main_app.attachments): content-addressed blobs in GridFS ('gridfs') or under BLOB_DIR ('filesystem',
+# only where the disk outlives the process). Thumbnails are made by `manage.py run_worker` and need Pillow.
+BLOB_BACKEND = os.environ.get('BLOB_BACKEND', 'gridfs')
+BLOB_DIR = os.environ.get('BLOB_DIR', str(BASE_DIR / 'blobs'))
+ATTACHMENT_MAX_BYTES = int(os.environ.get('ATTACHMENT_MAX_BYTES', str(20 * 1024 * 1024)))
+THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', '320'))  # longest side, pixels
+
+# Behavior event ingestion (main_app.behavior): each request writes its batch with one insert_many. On a long-lived
+# server, BEHAVIOR_EVENT_FLUSH_SECONDS > 0 buffers events per process instead and writes them once
+# BEHAVIOR_EVENT_BATCH_SIZE are waiting or the oldest has waited that long; keep it 0 on serverless deploys (Vercel),
+# where nothing runs after the response. With BEHAVIOR_EVENT_MAX_PENDING waiting, requests wait up to
+# BEHAVIOR_EVENT_ENQUEUE_TIMEOUT seconds for room and then get a 503.
+BEHAVIOR_EVENT_BATCH_SIZE = int(os.environ.get('BEHAVIOR_EVENT_BATCH_SIZE', '500'))
+BEHAVIOR_EVENT_FLUSH_SECONDS = float(os.environ.get('BEHAVIOR_EVENT_FLUSH_SECONDS', '0'))
+BEHAVIOR_EVENT_MAX_PENDING = int(os.environ.get('BEHAVIOR_EVENT_MAX_PENDING', '20000'))
+BEHAVIOR_EVENT_ENQUEUE_TIMEOUT = float(os.environ.get('BEHAVIOR_EVENT_ENQUEUE_TIMEOUT', '2'))
+
+# Background job queue (main_app.jobs, manage.py run_worker)
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '60'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '5'))
+JOB_RETRY_BASE_SECONDS = int(os.environ.get('JOB_RETRY_BASE_SECONDS', '10'))
+JOB_RETRY_MAX_SECONDS = int(os.environ.get('JOB_RETRY_MAX_SECONDS', '900'))
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', '2'))
+WORKER_POLL_SECONDS = float(os.environ.get('WORKER_POLL_SECONDS', '2'))
+
+# Cold-start bounds checked by `manage.py startup_profile`: modules that must only load on first use,
+# and an optional budget in milliseconds for importing the app and its URLconf (0: report only).
+STARTUP_DEFERRED_MODULES = ['numpy', 'email_validator', 'PIL', 'main_app.equity', 'main_app.jobs']
+STARTUP_BUDGET_MS = float(os.environ.get('STARTUP_BUDGET_MS', '0'))
+
 # Login/Logout URLs
 LOGIN_URL = '/login/'
 LOGOUT_REDIRECT_URL = '/login/'
\ No newline at end of file